@@ -1,13 +1,10 @@
 import click
-from rag.ingest import ingest_raw
-from rag.embed import build_index
-from rag.retrieve import Retriever
-from rag.pipeline import RAGPipeline
-from providers.chatgpt import ChatGPTProvider
-from providers.deepseek import DeepSeekProvider
 
 from dotenv import load_dotenv
 
+# Las dependencias pesadas (faiss, sentence-transformers, openai) se importan dentro de cada
+# comando: `ingest` no necesita ninguna y el CLI arranca sin cargarlas.
+
 load_dotenv()
 
 @click.group()
@@ -16,30 +13,100 @@ def cli():
     pass
 
 @cli.command()
-def ingest():
+@click.option("--full", is_flag=True, help="Reprocesar todos los archivos aunque no hayan cambiado")
+@click.option("--workers", default=1, help="Procesos de extracción en paralelo (0 = todos los núcleos)")
+@click.option("--chunker", type=click.Choice(["structure", "window"]), default="structure",
+              help="Por estructura (Título/Artículo, hijos + secciones padre) o ventanas de 900 palabras")
+def ingest(full, workers, chunker):
     """Procesar documentos en data/raw -> data/processed/chunks.parquet"""
-    ingest_raw()
+    from rag.ingest import ingest_raw
+    ingest_raw(incremental=not full, workers=workers, chunker=chunker)
+
+@cli.command()
+@click.option("--full", is_flag=True, help="Reconstruir el índice desde cero")
+@click.option("--type", "index_type", type=click.Choice(["flat", "ivf", "ivfpq", "hnsw"]), default="flat",
+              help="Tipo de índice FAISS (exacto o aproximado)")
+@click.option("--nlist", type=int, default=None, help="Listas IVF (por defecto ~4*sqrt(n))")
+@click.option("--pq-m", type=int, default=16, help="Subvectores PQ (ivfpq)")
+@click.option("--hnsw-m", type=int, default=32, help="Vecinos por nodo (hnsw)")
+@click.option("--backend", type=click.Choice(["st", "onnx"]), default=None,
+              help="Motor de embeddings (por defecto EMBED_BACKEND o st)")
+@click.option("--shards/--no-shards", default=True, help="Sub-índices por documento para búsquedas filtradas")
+@click.option("--in-place", is_flag=True, help="Escribir data/index.faiss sin snapshots versionados")
+@click.option("--keep", default=3, help="Snapshots que se conservan")
+@click.option("--workers", type=int, default=None,
+              help="Codificar en N procesos con checkpoints reanudables (0 = todos los núcleos)")
+@click.option("--dtype", type=click.Choice(["float32", "float16"]), default="float32",
+              help="Tipo del archivo de embeddings intermedio (con --workers)")
+def index(full, index_type, nlist, pq_m, hnsw_m, backend, shards, in_place, keep, workers, dtype):
+    """Construir embeddings e índice FAISS (nuevo snapshot en data/snapshots/)"""
+    from rag.embed import build_index
+    from rag.snapshots import SNAPSHOT_ROOT
+    build_index(incremental=not full, index_type=index_type, backend=backend, shards=shards,
+                snapshots=None if in_place else SNAPSHOT_ROOT, keep=keep, workers=workers, dtype=dtype,
+                nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m)
 
 @cli.command()
-def index():
-    """Construir embeddings e índice FAISS"""
-    build_index()
+@click.option("--use", "version", default=None, help="Poner en servicio esta versión (p. ej. volver a la anterior)")
+def snapshots(version):
+    """Listar los snapshots del índice o cambiar el vigente"""
+    from rag.snapshots import SNAPSHOT_ROOT, list_snapshots, current_version, set_current
+
+    if version:
+        set_current(SNAPSHOT_ROOT, version)
+        print(f"CURRENT -> {version} (los procesos en servicio la cargan en segundos)")
+        return
+    current = current_version(SNAPSHOT_ROOT)
+    for m in list_snapshots(SNAPSHOT_ROOT):
+        mark = "*" if m["version"] == current else " "
+        print(f"{mark} {m['version']}  {m['created']}  {m['index_type']:<6} {m['chunks']:>7} chunks "
+              f"{m['documents']:>4} documentos")
+
+def make_provider(name):
+    """chatgpt, deepseek o auto (enrutador entre ambos)."""
+    from providers.chatgpt import ChatGPTProvider
+    from providers.deepseek import DeepSeekProvider
+    from providers.router import RouterProvider
+
+    if name == "chatgpt":
+        return ChatGPTProvider()
+    if name == "deepseek":
+        return DeepSeekProvider()
+    return RouterProvider([ChatGPTProvider(max_retries=0), DeepSeekProvider(max_retries=0)])
 
 @cli.command()
-@click.option("--provider", type=click.Choice(["chatgpt","deepseek"]), default="chatgpt")
+@click.option("--provider", type=click.Choice(["chatgpt", "deepseek", "auto"]), default="chatgpt",
+              help="auto = enrutador entre ambos (el más rápido y sano, con hedging)")
 @click.option("--k", default=4, help="Número de chunks recuperados")
 @click.option("--temperature", default=0.0, help="Temperatura de generación")
 @click.option("--max-tokens", default=512, help="Máx. tokens en la respuesta")
-def chat(provider, k, temperature, max_tokens):
+@click.option("--cache/--no-cache", default=False, help="Usar caché de respuestas persistente")
+@click.option("--semantic-threshold", type=float, default=None, help="Umbral coseno para reutilizar respuestas de preguntas similares")
+@click.option("--mode", type=click.Choice(["dense", "bm25", "hybrid"]), default="dense", help="Recuperación densa, léxica (BM25) o híbrida")
+@click.option("--fusion", type=click.Choice(["rrf", "weighted"]), default="rrf", help="Fusión del modo híbrido")
+@click.option("--doc", "docs", multiple=True, help="Buscar solo en este doc_id (repetible)")
+@click.option("--title", default=None, help="Buscar solo en documentos con este título (o parte)")
+@click.option("--year", type=int, default=None, help="Buscar solo en documentos de este año")
+@click.option("--rerank", is_flag=True, help="Reordenar candidatos con un cross-encoder y enviar menos fragmentos")
+@click.option("--rerank-top-n", default=2, help="Fragmentos que llegan al LLM con --rerank")
+@click.option("--rerank-budget-ms", default=250.0, help="Tiempo máximo de reranking (0 = sin límite)")
+def chat(provider, k, temperature, max_tokens, cache, semantic_threshold, mode, fusion, docs, title, year,
+         rerank, rerank_top_n, rerank_budget_ms):
     """Iniciar chatbot interactivo"""
-    retriever = Retriever("data/index.faiss", "data/processed/chunks.parquet")
+    from rag.retrieve import Retriever
+    from rag.pipeline import RAGPipeline
+    from rag.answer_cache import AnswerCache
+    from rag.shards import normalize_filters
+    from rag.rerank import CrossEncoderReranker
 
-    if provider == "chatgpt":
-        prov = ChatGPTProvider()
-    else:
-        prov = DeepSeekProvider()
+    retriever = Retriever(mode=mode, fusion=fusion)
+    filters = normalize_filters({"doc_id": list(docs), "title": title, "year": year})
 
-    pipeline = RAGPipeline(retriever, prov)
+    prov = make_provider(provider)
+    answer_cache = AnswerCache(semantic_threshold=semantic_threshold, version=lambda: retriever.version) \
+        if cache else None
+    reranker = CrossEncoderReranker(top_n=rerank_top_n, budget_ms=rerank_budget_ms) if rerank else None
+    pipeline = RAGPipeline(retriever, prov, answer_cache=answer_cache, reranker=reranker)
 
     print(f"\nChatbot UFRO ({provider.upper()}) listo. Escribe tu pregunta (Enter vacío para salir).\n")
 
@@ -47,7 +114,7 @@ def chat(provider, k, temperature, max_tokens):
         q = input("Pregunta> ").strip()
         if not q:
             break
-        res = pipeline.synthesize(q, top_k=k, temperature=temperature, max_tokens=max_tokens)
+        res = pipeline.synthesize(q, top_k=k, temperature=temperature, max_tokens=max_tokens, filters=filters)
         print("\n--- Respuesta ---\n")
         print(res["answer"])
         print("\n--- Citas detectadas ---")
@@ -55,8 +122,55 @@ def chat(provider, k, temperature, max_tokens):
             print("-", cit)
         print("\n--- Fragmentos usados ---")
         for h in res["hits"]:
-            print(f"- {h['title']} (p{h.get('page')}) score={h['score']:.3f}")
+            print(f"- {h['title']} (p{h.get('page')}) score={h['score']:.3f}"
+                  + (f" rerank={h['rerank_score']:.3f}" if "rerank_score" in h else ""))
+        if "latency_rerank" in res:
+            print(f"\n(reranking {res['latency_rerank'] * 1000:.0f} ms, {res['prompt_tokens_saved']} tokens ahorrados"
+                  + (", fuera de presupuesto" if res["rerank_fallback"] else "") + ")")
+        if res.get("cache_hit"):
+            print("\n(respuesta desde caché)")
         print("\n============================\n")
 
+    if answer_cache is not None:
+        answer_cache.save()
+
+@cli.command()
+@click.argument("input_path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--out", "out_path", default="data/batch/answers.jsonl", help="JSONL de salida (se reanuda si existe)")
+@click.option("--provider", type=click.Choice(["chatgpt", "deepseek", "auto"]), default="chatgpt")
+@click.option("--k", default=4, help="Número de chunks recuperados")
+@click.option("--max-tokens", default=512, help="Máx. tokens en la respuesta")
+@click.option("--concurrency", default=8, help="Llamadas al LLM en paralelo")
+@click.option("--tpm", type=int, default=0, help="Presupuesto de tokens por minuto (prompt + respuesta; 0 = sin límite)")
+@click.option("--mode", type=click.Choice(["dense", "bm25", "hybrid"]), default="dense", help="Recuperación densa, léxica (BM25) o híbrida")
+@click.option("--cache/--no-cache", default=False, help="Usar y llenar la caché de respuestas persistente")
+@click.option("--restart", is_flag=True, help="Descartar la salida previa en vez de reanudarla")
+@click.option("--rerank", is_flag=True, help="Reordenar candidatos con un cross-encoder y enviar menos fragmentos")
+@click.option("--rerank-top-n", default=2, help="Fragmentos que llegan al LLM con --rerank")
+def batch(input_path, out_path, provider, k, max_tokens, concurrency, tpm, mode, cache, restart, rerank,
+          rerank_top_n):
+    """Responder un archivo de preguntas (JSONL o CSV) -> JSONL, reanudable"""
+    from rag.retrieve import Retriever
+    from rag.pipeline import RAGPipeline
+    from rag.answer_cache import AnswerCache
+    from rag.batch import BatchRunner
+    from rag.rerank import CrossEncoderReranker
+
+    retriever = Retriever(mode=mode)
+    answer_cache = AnswerCache(version=lambda: retriever.version) if cache else None
+    # En lote no hay un usuario esperando: reranking sin presupuesto de tiempo
+    reranker = CrossEncoderReranker(top_n=rerank_top_n, budget_ms=0) if rerank else None
+    pipeline = RAGPipeline(retriever, make_provider(provider), answer_cache=answer_cache, reranker=reranker)
+    runner = BatchRunner(pipeline, concurrency=concurrency, tpm=tpm or None, top_k=k, max_tokens=max_tokens)
+    try:
+        stats = runner.run(input_path, out_path, restart=restart)
+    finally:
+        if answer_cache is not None:
+            answer_cache.save()
+    print(f"\n{stats['ok']} respondidas, {stats['errors']} con error, {stats['skipped']} ya estaban "
+          f"({stats['cache_hits']} desde caché, {stats['tokens']} tokens) en {stats['seconds']}s -> {out_path}")
+    if stats["errors"]:
+        print("Vuelve a ejecutar el mismo comando para reintentar las que fallaron.")
+
 if __name__ == "__main__":
     cli()
\ No newline at end of file
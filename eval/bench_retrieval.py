@@ -0,0 +1,263 @@
+"""
+Benchmark de la recuperación sola (sin LLM): calidad y latencia de Retriever.query.
+
+Conjuntos de consultas:
+  - gold:      eval/gold_set.jsonl; cada pregunta se mapea a (doc_id, página) con el campo
+               "targets" si existe, o con una heurística sobre "references" ("..., p.3")
+  - synthetic: oraciones tomadas de chunks al azar; el objetivo es la página de ese chunk
+
+Reporta recall@k, MRR y nDCG, latencia de encode/search/fetch en p50/p95/p99, QPS con uno
+y varios hilos y los tokens de contexto que recibiría el LLM (primeros CONTEXT_K hits). El resultado se guarda en JSON para comparar corridas:
+
+    python eval/bench_retrieval.py --mode dense --mode hybrid --out eval/bench.json
+    python eval/bench_retrieval.py --out eval/bench_new.json --compare eval/bench.json
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import re
+import json
+import time
+import math
+import random
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import click
+import numpy as np
+
+from rag.bm25 import fold_accents, tokenize
+from rag.packing import count_tokens
+
+PAGE_RE = re.compile(r"\bp(?:ag|ág)?\.?\s*(\d+)", re.IGNORECASE)
+SENTENCE_RE = re.compile(r"(?<=[.;:!?])\s+")
+STAGES = ("encode", "search", "fetch", "total")
+CONTEXT_K = 4  # top_k del pipeline
+
+# Tolerancias para marcar regresiones con --compare
+RECALL_TOLERANCE = 0.02
+LATENCY_TOLERANCE = 0.20
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3)}
+
+
+def _squash(text: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", fold_accents(text))
+
+
+def map_reference(ref: str, docs):
+    """
+    Heurística "Reglamento estudios, inscripción asignaturas, p.12" -> [(doc_id, 12)].
+    El documento es el de mayor número de palabras de la referencia en su título (empates:
+    todos); la página sale del sufijo "p.N". Devuelve [] si no hay coincidencias.
+    """
+    m = PAGE_RE.search(ref)
+    page = int(m.group(1)) if m else None
+    words = [w for w in tokenize(PAGE_RE.sub("", ref)) if len(w) >= 4]
+    scores = {doc_id: sum(1 for w in words if w in _squash(title)) for doc_id, title in docs.items()}
+    best = max(scores.values(), default=0)
+    if best == 0:
+        return []
+    return [(doc_id, page) for doc_id, s in scores.items() if s == best]
+
+
+def gold_queries(path, docs):
+    """Consultas del gold set con sus objetivos; las no mapeables se cuentan aparte."""
+    queries, unmapped = [], 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            item = json.loads(line)
+            if item.get("targets"):
+                targets = [(t["doc_id"], t.get("page")) for t in item["targets"]]
+            else:
+                targets = [t for ref in item.get("references", []) for t in map_reference(ref, docs)]
+            if targets:
+                queries.append({"question": item["question"], "targets": targets})
+            else:
+                unmapped += 1
+    return queries, unmapped
+
+
+def synthetic_queries(store, n, seed=0):
+    """Una oración (8-30 palabras) de chunks al azar; objetivo = (doc_id, página) del chunk."""
+    rng = random.Random(seed)
+    positions = list(range(len(store)))
+    rng.shuffle(positions)
+    queries = []
+    for pos in positions:
+        if len(queries) >= n:
+            break
+        row = store.rows([pos])[0]
+        sentences = [s for s in SENTENCE_RE.split(row["text"]) if 8 <= len(s.split()) <= 30]
+        if sentences:
+            queries.append({"question": rng.choice(sentences), "targets": [(row["doc_id"], row.get("page"))]})
+    return queries
+
+
+def _relevant(hit, targets):
+    for doc_id, page in targets:
+        if hit.get("doc_id") == doc_id and (page is None or hit.get("page") == page):
+            return (doc_id, page)
+    return None
+
+
+def rank_metrics(hits, targets, ks):
+    """recall@k (fracción de objetivos encontrados), rango recíproco y nDCG binario."""
+    found_at = {}
+    for rank, hit in enumerate(hits, start=1):
+        t = _relevant(hit, targets)
+        if t is not None and t not in found_at:
+            found_at[t] = rank
+    n_targets = len(set(targets))
+    out = {f"recall@{k}": sum(1 for r in found_at.values() if r <= k) / n_targets for k in ks}
+    out["mrr"] = 1.0 / min(found_at.values()) if found_at else 0.0
+    dcg = sum(1.0 / math.log2(r + 1) for r in found_at.values())
+    idcg = sum(1.0 / math.log2(r + 1) for r in range(1, min(n_targets, len(hits) or 1) + 1))
+    out["ndcg"] = dcg / idcg if idcg else 0.0
+    return out
+
+
+def measure_qps(retriever, questions, top_k, mode, threads):
+    retriever.cache.clear()
+    start = time.perf_counter()
+    if threads <= 1:
+        for q in questions:
+            retriever.query(q, top_k=top_k, mode=mode)
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(lambda q: retriever.query(q, top_k=top_k, mode=mode), questions))
+    return round(len(questions) / (time.perf_counter() - start), 1)
+
+
+def run_config(retriever, query_set, queries, mode, ks, threads):
+    max_k = max(ks)
+    retriever.cache.clear()
+    metrics, stage_ms, context = [], {s: [] for s in STAGES}, []
+    for q in queries:
+        t = {}
+        start = time.perf_counter()
+        hits = retriever.query(q["question"], top_k=max_k, mode=mode, timings=t)
+        t["total"] = time.perf_counter() - start
+        for s in STAGES:
+            stage_ms[s].append(t.get(s, 0.0) * 1000)
+        metrics.append(rank_metrics(hits, q["targets"], ks))
+        context.append(sum(count_tokens(h["text"]) for h in hits[:CONTEXT_K]))
+
+    questions = [q["question"] for q in queries]
+    result = {
+        "index": retriever.index_path,
+        "index_type": retriever.manifest.get("index_type"),
+        "expand": retriever.parents is not None,
+        "mode": mode,
+        "query_set": query_set,
+        "queries": len(queries),
+    }
+    for name in metrics[0] if metrics else []:
+        result[name] = round(float(np.mean([m[name] for m in metrics])), 4)
+    result["context_tokens"] = round(float(np.mean(context)), 1) if context else 0.0
+    result["latency_ms"] = {s: percentiles(v) for s, v in stage_ms.items()}
+    result["qps_1"] = measure_qps(retriever, questions, max_k, mode, 1)
+    result[f"qps_{threads}"] = measure_qps(retriever, questions, max_k, mode, threads)
+    return result
+
+
+def _key(r):
+    return (r["index"], r["mode"], r["query_set"])
+
+
+def compare(results, baseline_path):
+    """Imprime diferencias contra una corrida anterior; devuelve la lista de regresiones."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {_key(r): r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        old = baseline.get(_key(r))
+        if old is None:
+            continue
+        print(f"\n{r['index']} · {r['mode']} · {r['query_set']}")
+        for name in [n for n in r if n.startswith("recall@")] + ["mrr", "ndcg"]:
+            delta = r[name] - old.get(name, 0.0)
+            flag = " ⚠" if delta < -RECALL_TOLERANCE else ""
+            print(f"  {name:<10}{old.get(name, 0.0):>8.4f} -> {r[name]:.4f} ({delta:+.4f}){flag}")
+            if flag:
+                regressions.append(f"{_key(r)} {name}")
+        new_p95, old_p95 = r["latency_ms"]["total"]["p95"], old["latency_ms"]["total"]["p95"]
+        flag = " ⚠" if old_p95 and new_p95 > old_p95 * (1 + LATENCY_TOLERANCE) else ""
+        print(f"  {'p95 ms':<10}{old_p95:>8.3f} -> {new_p95:.3f}{flag}")
+        if flag:
+            regressions.append(f"{_key(r)} p95")
+    return regressions
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+@click.command()
+@click.option("--index", "indexes", multiple=True, help="Índices a comparar (repetible; por defecto el snapshot vigente)")
+@click.option("--meta", default=None, help="Metadatos (por defecto, los que están junto al índice)")
+@click.option("--mode", "modes", multiple=True, default=["dense"], help="dense, bm25 o hybrid (repetible)")
+@click.option("--k", "ks", default="1,3,5,10", help="Valores de k para recall@k")
+@click.option("--gold", default="eval/gold_set.jsonl")
+@click.option("--synthetic", default=200, help="Número de consultas sintéticas (0 = ninguna)")
+@click.option("--threads", default=8, help="Hilos para la medición de QPS concurrente")
+@click.option("--seed", default=0)
+@click.option("--expand/--no-expand", default=True, help="Expandir hijos a sus secciones padre (si existen)")
+@click.option("--out", default="eval/bench_retrieval.json", help="Archivo JSON de salida")
+@click.option("--compare", "baseline", default=None, help="JSON de una corrida anterior para comparar")
+def main(indexes, meta, modes, ks, gold, synthetic, threads, seed, expand, out, baseline):
+    from rag.retrieve import Retriever
+
+    ks = sorted(int(k) for k in ks.split(",") if k)
+    results = []
+    for index_path in indexes or [None]:
+        # Sin caché de embeddings: cada consulta mide el encode real
+        retriever = Retriever(index_path=index_path, meta_path=meta, cache_size=0, expand=expand)
+        docs = dict(zip(retriever.store.column("doc_id").to_pylist(), retriever.store.column("title").to_pylist()))
+
+        query_sets = {}
+        g, unmapped = gold_queries(gold, docs)
+        if g:
+            query_sets["gold"] = g
+        print(f"gold: {len(g)} preguntas mapeadas, {unmapped} sin objetivo")
+        if synthetic:
+            query_sets["synthetic"] = synthetic_queries(retriever.store, synthetic, seed)
+
+        for mode in modes:
+            for name, queries in query_sets.items():
+                r = run_config(retriever, name, queries, mode, ks, threads)
+                results.append(r)
+                lat = r["latency_ms"]
+                print(f"{index_path} · {mode} · {name} ({r['queries']} q): "
+                      + " ".join(f"R@{k}={r[f'recall@{k}']:.3f}" for k in ks)
+                      + f" MRR={r['mrr']:.3f} nDCG={r['ndcg']:.3f} ctx={r['context_tokens']} tok"
+                      + f" | ms p50/p95/p99 encode {lat['encode']['p50']}/{lat['encode']['p95']}/{lat['encode']['p99']}"
+                      + f" search {lat['search']['p50']}/{lat['search']['p95']}/{lat['search']['p99']}"
+                      + f" fetch {lat['fetch']['p50']}/{lat['fetch']['p95']}/{lat['fetch']['p99']}"
+                      + f" | QPS 1={r['qps_1']} {threads}={r[f'qps_{threads}']}")
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "git": _git_rev(), "ks": ks,
+                 "threads": threads, "seed": seed},
+        "results": results,
+    }
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {out}")
+
+    if baseline:
+        regressions = compare(results, baseline)
+        if regressions:
+            print(f"\nRegresiones: {len(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,66 @@
+"""
+Evaluación del pipeline RAG sobre eval/gold_set.jsonl.
+
+Ejecuta preguntas × proveedores × repeticiones en un pool de workers acotado, con límite de
+tasa por proveedor, y guarda cada respuesta en un archivo de replay (JSONL) para volver a
+calcular las métricas sin red:
+
+    python eval/evaluate.py --reps 5 --workers 8 --rps chatgpt=2,deepseek=1
+    python eval/evaluate.py --replay eval/replay.jsonl
+    python eval/evaluate.py --rerank --record eval/replay_rerank.jsonl   # con cross-encoder (rag/rerank.py)
+"""
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import json
 import time
 import csv
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from statistics import mean
-import re
-from rag.pipeline import RAGPipeline
-from rag.retrieve import Retriever
-from rag.prompts import SYSTEM_PROMPT, USER_PROMPT_TEMPLATE
-from providers.chatgpt import ChatGPTProvider
-from providers.deepseek import DeepSeekProvider
-from sentence_transformers import SentenceTransformer, util
+import click
 import numpy as np
 from dotenv import load_dotenv
 
 load_dotenv()
 
+PROVIDERS = ("chatgpt", "deepseek")
+
+
 def em_score(pred: str, gold: str) -> int:
     return int(pred.strip().lower() == gold.strip().lower())
 
-def cosine_sim(pred: str, gold: str, model) -> float:
-    if not pred or not gold:
-        return 0.0
-    emb_pred = model.encode(pred, convert_to_tensor=True)
-    emb_gold = model.encode(gold, convert_to_tensor=True)
-    return float(util.pytorch_cos_sim(emb_pred, emb_gold).item())
+
+def cosine_scores(model, preds, gold_embs) -> np.ndarray:
+    """Similitud coseno de cada predicción con su respuesta esperada (embeddings normalizados)."""
+    scores = np.zeros(len(preds), dtype="float32")
+    idx = [i for i, p in enumerate(preds) if p]
+    if idx:
+        embs = model.encode([preds[i] for i in idx])
+        scores[idx] = np.sum(embs * gold_embs[idx], axis=1)
+    return scores
+
 
 def coverage_citations(pred_citations, gold_refs):
     found = sum(1 for c in pred_citations if c in gold_refs)
     return found / max(len(gold_refs), 1)
 
+
+def scored_text(record) -> str:
+    """
+    Texto que se puntúa: la salida cruda del modelo, antes de la política de abstención (igual
+    que el harness anterior). Los replays sin "raw" se puntúan con "answer".
+    """
+    raw = record.get("raw")
+    return raw if raw is not None else record["answer"]
+
+
 def load_gold(path="eval/gold_set.jsonl"):
     with open(path, "r", encoding="utf-8") as f:
         return [json.loads(line) for line in f]
 
+
 def estimate_cost(tokens_prompt, tokens_completion, provider_name):
     if tokens_prompt is None or tokens_completion is None:
         return None
@@ -46,119 +71,261 @@ def estimate_cost(tokens_prompt, tokens_completion, provider_name):
     else:
         return None
 
+
 def write_csv(path, fieldnames, rows):
     with open(path, "w", encoding="utf-8", newline="") as f:
         writer = csv.DictWriter(f, fieldnames=fieldnames)
         writer.writeheader()
         writer.writerows(rows)
 
-def main():
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def parse_rates(spec: str, providers):
+    """"2" -> mismo límite para todos; "chatgpt=2,deepseek=1" -> por proveedor (req/s)."""
+    if "=" not in spec:
+        return {p: float(spec) for p in providers}
+    rates = {}
+    for part in spec.split(","):
+        name, value = part.split("=")
+        rates[name.strip()] = float(value)
+    return rates
+
+
+class _RecordingProvider:
+    """Envuelve un proveedor y guarda la respuesta cruda (antes de la política de abstención)."""
+
+    def __init__(self, provider):
+        self._provider = provider
+        self.raw = None
+
+    def __getattr__(self, name):
+        return getattr(self._provider, name)
+
+    def chat(self, messages, **kwargs):
+        self.raw = self._provider.chat(messages, **kwargs)
+        return self.raw
+
+    def chat_with_usage(self, messages, **kwargs):
+        response = self._provider.chat_with_usage(messages, **kwargs)
+        self.raw = response.get("text", "")
+        return response
+
+
+def run_one(retriever, provider, limiter, item, rep, top_k, max_tokens, reranker=None):
+    """Una llamada al pipeline para (pregunta, proveedor, repetición); devuelve el registro de replay."""
+    from rag.pipeline import RAGPipeline
+
+    if limiter is not None:
+        limiter.acquire()
+    recorder = _RecordingProvider(provider)
+    pipeline = RAGPipeline(retriever, recorder, reranker=reranker)
+    record = {"id": item.get("id"), "question": item["question"], "provider": provider.name, "rep": rep,
+              "t_start": time.time()}
+    try:
+        res = pipeline.synthesize(item["question"], top_k=top_k, max_tokens=max_tokens,
+                                  temperature=0.0, with_usage=True)
+        record.update({
+            "answer": res["answer"],
+            "raw": recorder.raw,
+            "abstained": res.get("abstained", False),
+            "citations": res["citations"],
+            "latency_retrieve": res["latency_retrieve"],
+            "latency_llm": res["latency_llm"],
+            "latency_total": res["latency_total"],
+            "tokens_prompt": res["tokens_prompt"],
+            "tokens_completion": res["tokens_completion"],
+            "prompt_tokens_raw": res.get("prompt_tokens_raw"),
+            "prompt_tokens_packed": res.get("prompt_tokens_packed"),
+            "latency_rerank": res.get("latency_rerank"),
+            "prompt_tokens_saved": res.get("prompt_tokens_saved"),
+            "error": None,
+        })
+    except Exception as e:
+        record.update({"answer": "", "raw": None, "abstained": False, "citations": [], "error": str(e)})
+    record["t_end"] = time.time()
+    return record
+
+
+def run_live(gold_set, provider_names, reps, workers, rates, top_k, max_tokens, record_path, rerank=False):
+    from rag.retrieve import Retriever
+    from rag.rerank import CrossEncoderReranker
+    from rag.ratelimit import TokenBucket
+    from providers.chatgpt import ChatGPTProvider
+    from providers.deepseek import DeepSeekProvider
+
+    available = {"chatgpt": ChatGPTProvider, "deepseek": DeepSeekProvider}
+    providers = {name: available[name]() for name in provider_names}
+    limiters = {name: TokenBucket(rates[name]) if rates.get(name) else None for name in provider_names}
     retriever = Retriever()
-    providers = [ChatGPTProvider(), DeepSeekProvider()]
-    pipelines = {p.name: RAGPipeline(retriever, p) for p in providers}
-    model_embed = SentenceTransformer("all-MiniLM-L6-v2")
-    gold_set = load_gold()
-
-    detailed_results = {p.name: [] for p in providers}
-    metrics_accum = {p.name: defaultdict(list) for p in providers}
-
-    for item in gold_set:
-        question = item["question"]
-        expected_answer = item["expected_answer"]
-        gold_refs = item.get("references", [])
-
-        for pname, pipeline in pipelines.items():
-            start_total = time.time()
-            query = pipeline.rewrite_query(question)
-
-            hits = retriever.query(query, top_k=5)
-            snippets = "\n\n".join([f"[{h['title']}, p{h.get('page')}] {h['text']}" for h in hits])
-
-            user_prompt = USER_PROMPT_TEMPLATE.format(question=question, snippets=snippets)
-            messages = [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
+    reranker = CrossEncoderReranker() if rerank else None
+
+    records = []
+    lock = threading.Lock()
+    out = open(record_path, "w", encoding="utf-8") if record_path else None
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(run_one, retriever, providers[name], limiters[name], item, rep, top_k, max_tokens,
+                            reranker)
+                for rep in range(reps) for item in gold_set for name in provider_names
             ]
+            for fut in as_completed(futures):
+                record = fut.result()
+                with lock:
+                    records.append(record)
+                    if out is not None:
+                        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        out.flush()
+                if record["error"]:
+                    print(f"[{record['provider']}] error en {record['id']}: {record['error']}")
+    finally:
+        if out is not None:
+            out.close()
+    return records
 
-            start_llm = time.time()
-            if hasattr(pipeline.provider, "chat_with_usage"):
-                response = pipeline.provider.chat_with_usage(messages, max_tokens=512, temperature=0.0)
-                answer = response.get("text", "")
-                usage = response.get("usage", None)
-            else:
-                answer = pipeline.provider.chat(messages, max_tokens=512, temperature=0.0)
-                usage = None
-            latency_total = time.time() - start_total
-            latency_llm = time.time() - start_llm
 
-            tokens_prompt = getattr(usage, "prompt_tokens", None) if usage else None
-            tokens_completion = getattr(usage, "completion_tokens", None) if usage else None
+def load_replay(path, provider_names):
+    with open(path, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [r for r in records if r["provider"] in provider_names]
 
-            citations = re.findall(r"\[([^\]]+)\]", answer) if answer else []
 
-            em = em_score(answer, expected_answer) if answer else 0
-            coverage = coverage_citations(citations, gold_refs)
-            cos_sim = cosine_sim(answer, expected_answer, model_embed)
-            cost = estimate_cost(tokens_prompt, tokens_completion, pname)
+def score(records, gold_set):
+    """Calcula las métricas por registro; los embeddings de las respuestas esperadas se calculan una vez."""
+    from rag.encoder import get_engine
 
-            detailed_results[pname].append({
-                "question": question,
-                "provider": pname,
-                "answer": answer,
-                "references": "; ".join(citations)
-            })
+    model_embed = get_engine()
+    gold_by_question = {item["question"]: item for item in gold_set}
+    questions = list(gold_by_question)
+    gold_embs = model_embed.encode([gold_by_question[q]["expected_answer"] for q in questions])
+    row_of = {q: i for i, q in enumerate(questions)}
 
-            metrics_accum[pname][question].append({
-                "latency": latency_total,
-                "em": em,
-                "coverage": coverage,
-                "cosine_similarity": cos_sim,
-                "cost": cost if cost is not None else 0.0
-            })
+    records = [r for r in records if r["question"] in gold_by_question]
+    texts = [scored_text(r) for r in records]
+    cos = cosine_scores(model_embed, texts,
+                        gold_embs[[row_of[r["question"]] for r in records]])
+    for r, text, c in zip(records, texts, cos):
+        item = gold_by_question[r["question"]]
+        r["em"] = em_score(text, item["expected_answer"]) if text else 0
+        r["coverage"] = coverage_citations(r["citations"], item.get("references", []))
+        r["cosine_similarity"] = float(c)
+        r["cost"] = estimate_cost(r.get("tokens_prompt"), r.get("tokens_completion"), r["provider"]) or 0.0
+    return records
 
-    result_fields = ["question", "provider", "answer", "references"]
-    for pname, rows in detailed_results.items():
-        write_csv(f"eval/results_{pname}.csv", result_fields, rows)
 
+def write_reports(records, provider_names):
+    result_fields = ["question", "provider", "rep", "answer", "references", "prompt_tokens_raw", "prompt_tokens_packed"]
     metric_fields = [
         "question",
         "provider",
+        "samples",
         "em",
         "cosine_similarity",
         "citation_coverage",
+        "abstention_rate",
         "latency_avg_sec",
         "latency_p95_sec",
-        "estimated_cost_usd"
+        "estimated_cost_usd",
+        "prompt_tokens_raw",
+        "prompt_tokens_packed",
+        "latency_rerank_sec",
+        "prompt_tokens_saved"
     ]
-    for pname, questions_metrics in metrics_accum.items():
-        metrics_summary = []
-        for question, entries in questions_metrics.items():
-            latencies = [e["latency"] for e in entries]
-            ems = [e["em"] for e in entries]
-            coverages = [e["coverage"] for e in entries]
-            cos_sims = [e["cosine_similarity"] for e in entries]
-            costs = [e["cost"] for e in entries]
-
-            latency_avg = mean(latencies) if latencies else 0
-            latency_p95 = np.percentile(latencies, 95) if latencies else 0
-            em_avg = mean(ems) if ems else 0
-            coverage_avg = mean(coverages) if coverages else 0
-            cos_avg = mean(cos_sims) if cos_sims else 0
-            cost_avg = mean(costs) if costs else 0
+    summary = []
+    for pname in provider_names:
+        rows = [r for r in records if r["provider"] == pname]
+        ok = [r for r in rows if not r["error"]]
+        write_csv(f"eval/results_{pname}.csv", result_fields, [{
+            "question": r["question"],
+            "provider": pname,
+            "rep": r["rep"],
+            "answer": r["answer"],
+            "references": "; ".join(r["citations"]),
+            "prompt_tokens_raw": r.get("prompt_tokens_raw"),
+            "prompt_tokens_packed": r.get("prompt_tokens_packed")
+        } for r in sorted(rows, key=lambda r: (r["question"], r["rep"]))])
 
+        by_question = defaultdict(list)
+        for r in ok:
+            by_question[r["question"]].append(r)
+        metrics_summary = []
+        for question, entries in by_question.items():
+            latencies = [e["latency_total"] for e in entries]
             metrics_summary.append({
                 "question": question,
                 "provider": pname,
-                "em": round(em_avg, 3),
-                "cosine_similarity": round(cos_avg, 3),
-                "citation_coverage": round(coverage_avg, 3),
-                "latency_avg_sec": round(latency_avg, 3),
-                "latency_p95_sec": round(latency_p95, 3),
-                "estimated_cost_usd": round(cost_avg, 6)
+                "samples": len(entries),
+                "em": round(mean(e["em"] for e in entries), 3),
+                "cosine_similarity": round(mean(e["cosine_similarity"] for e in entries), 3),
+                "citation_coverage": round(mean(e["coverage"] for e in entries), 3),
+                "abstention_rate": round(mean(bool(e.get("abstained")) for e in entries), 3),
+                "latency_avg_sec": round(mean(latencies), 3),
+                "latency_p95_sec": round(percentiles(latencies)["p95"], 3),
+                "estimated_cost_usd": round(mean(e["cost"] for e in entries), 6),
+                "prompt_tokens_raw": round(mean(e.get("prompt_tokens_raw") or 0 for e in entries), 1),
+                "prompt_tokens_packed": round(mean(e.get("prompt_tokens_packed") or 0 for e in entries), 1),
+                "latency_rerank_sec": round(mean(e.get("latency_rerank") or 0 for e in entries), 3),
+                "prompt_tokens_saved": round(mean(e.get("prompt_tokens_saved") or 0 for e in entries), 1)
             })
         write_csv(f"eval/metrics_{pname}.csv", metric_fields, metrics_summary)
 
-    print("Evaluación finalizada. CSVs generados por proveedor en la carpeta eval/")
+        # Throughput: respuestas correctas / tiempo de pared entre la primera y la última llamada
+        wall = (max(r["t_end"] for r in rows) - min(r["t_start"] for r in rows)) if rows else 0.0
+        lat = percentiles([r["latency_total"] for r in ok])
+        summary.append({
+            "provider": pname,
+            "requests": len(rows),
+            "errors": len(rows) - len(ok),
+            "latency_p50_sec": round(lat["p50"], 3),
+            "latency_p95_sec": round(lat["p95"], 3),
+            "latency_p99_sec": round(lat["p99"], 3),
+            "throughput_rps": round(len(ok) / wall, 3) if wall > 0 else 0.0,
+            "em": round(mean(r["em"] for r in ok), 3) if ok else 0.0,
+            "cosine_similarity": round(mean(r["cosine_similarity"] for r in ok), 3) if ok else 0.0,
+            "abstention_rate": round(mean(bool(r.get("abstained")) for r in ok), 3) if ok else 0.0,
+        })
+    write_csv("eval/summary.csv", list(summary[0]) if summary else [], summary)
+    return summary
+
+
+@click.command()
+@click.option("--gold", default="eval/gold_set.jsonl", help="Archivo JSONL con las preguntas de referencia")
+@click.option("--providers", "provider_list", default=",".join(PROVIDERS), help="Proveedores separados por coma")
+@click.option("--reps", default=1, help="Repeticiones por pregunta y proveedor")
+@click.option("--workers", default=4, help="Llamadas concurrentes")
+@click.option("--rps", default="2", help='Límite de req/s: "2" o "chatgpt=2,deepseek=1"')
+@click.option("--k", "top_k", default=5, help="Fragmentos recuperados por pregunta")
+@click.option("--max-tokens", default=512)
+@click.option("--record", "record_path", default="eval/replay.jsonl", help="Archivo donde guardar las respuestas")
+@click.option("--replay", "replay_path", default=None, help="Recalcular métricas desde un archivo de replay (sin red)")
+@click.option("--rerank", is_flag=True, help="Reordenar candidatos con el cross-encoder (rag/rerank.py)")
+def main(gold, provider_list, reps, workers, rps, top_k, max_tokens, record_path, replay_path, rerank):
+    gold_set = load_gold(gold)
+    provider_names = [p.strip() for p in provider_list.split(",") if p.strip()]
+
+    start = time.time()
+    if replay_path:
+        records = load_replay(replay_path, provider_names)
+    else:
+        records = run_live(gold_set, provider_names, reps, workers, parse_rates(rps, provider_names),
+                           top_k, max_tokens, record_path, rerank)
+    records = score(records, gold_set)
+    summary = write_reports(records, provider_names)
+
+    print(f"{'proveedor':<10}{'req':>6}{'err':>5}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}{'req/s':>8}{'EM':>7}{'coseno':>8}"
+          f"{'abst.':>7}")
+    for s in summary:
+        print(f"{s['provider']:<10}{s['requests']:>6}{s['errors']:>5}{s['latency_p50_sec']:>8}"
+              f"{s['latency_p95_sec']:>8}{s['latency_p99_sec']:>8}{s['throughput_rps']:>8}"
+              f"{s['em']:>7}{s['cosine_similarity']:>8}{s['abstention_rate']:>7}")
+    print(f"Evaluación finalizada en {time.time() - start:.1f}s. CSVs generados por proveedor en la carpeta eval/")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,39 @@
+"""
+Configuración de gunicorn para web.py:
+
+    WEB_PRELOAD=1 gunicorn web:app
+
+Con WEB_PRELOAD=1 la app (modelo + índice) se carga en el master antes de crear los workers,
+que la comparten copy-on-write; sin preload cada worker la carga al iniciar.
+"""
+import os
+import sys
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:8081")
+workers = int(os.getenv("WEB_WORKERS", "4"))
+# Con WEB_THREADS > 1 los workers son gthread: varias peticiones por proceso, necesario para
+# que el coalescing y los cupos por proveedor de web.py actúen dentro de cada worker
+threads = int(os.getenv("WEB_THREADS", "1"))
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+preload_app = os.getenv("WEB_PRELOAD", "0") == "1"
+
+
+def post_fork(server, worker):
+    # Con preload el módulo ya está importado en el master
+    if "web" in sys.modules:
+        sys.modules["web"].after_fork()
+
+
+def post_worker_init(worker):
+    # Carga (o, con preload, reporta lo heredado) antes de atender la primera petición
+    web = sys.modules.get("web")
+    if web is not None:
+        web.init()
+        if web.startup.inherited_from:
+            web.startup.log()
+
+
+def child_exit(server, worker):
+    # Con PROMETHEUS_MULTIPROC_DIR, descarta los valores "live" del worker que terminó
+    from rag import metrics
+    metrics.mark_process_dead(worker.pid)
@@ -1,4 +1,4 @@
-from typing import List, Dict, Any, Protocol
+from typing import List, Dict, Any, Iterator, Protocol
 
 class Provider(Protocol):
     name: str
@@ -9,4 +9,13 @@ class Provider(Protocol):
         messages: [{"role": "system"|"user"|"assistant", "content": "..."}]
         kwargs: parámetros adicionales (temperature, max_tokens, etc.)
         return: {"text": str, "usage": dict, "meta": dict}
-        """
\ No newline at end of file
+        """
+
+    def chat_stream(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[str]:
+        """
+        Igual que chat, pero devuelve un iterador con los fragmentos de texto
+        a medida que el LLM los genera.
+        """
+
+    async def achat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        """Versión asíncrona de chat (modo de servicio asyncio)."""
@@ -1,14 +1,19 @@
 import os
-from openai import OpenAI
-from typing import List, Dict, Any
+from openai import OpenAI, AsyncOpenAI
+from typing import List, Dict, Any, Iterator
 from providers.base import Provider
+from providers.http_pool import get_async_http_client
 class DeepSeekProvider(Provider):
-    def __init__(self, model: str = "deepseek-chat"):
+    def __init__(self, model: str = "deepseek-chat", base_url: str = None, max_retries: int = None):
+        # max_retries=None usa los reintentos por defecto del SDK; RouterProvider usa 0
+        retries = {} if max_retries is None else {"max_retries": max_retries}
         self.client = OpenAI(
             api_key=os.getenv("DEEPSEEK_API_KEY"),
-            base_url="https://api.deepseek.com/v1"
+            base_url=base_url or os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1"),
+            **retries
         )
         self.model = model
+        self._aclient = None
     @property
     def name(self) -> str:
         return "deepseek"
@@ -29,4 +34,49 @@ class DeepSeekProvider(Provider):
         return {
             "text": response.choices[0].message.content,
             "usage": response.usage  # incluye tokens usados
-        }
\ No newline at end of file
+        }
+
+    def chat_stream(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[str]:
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            stream=True,
+            **kwargs
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+    @property
+    def aclient(self) -> AsyncOpenAI:
+        # Se crea perezosamente dentro del event loop, sobre el pool HTTP compartido
+        if self._aclient is None:
+            self._aclient = AsyncOpenAI(
+                api_key=self.client.api_key,
+                base_url=str(self.client.base_url),
+                max_retries=self.client.max_retries,
+                http_client=get_async_http_client()
+            )
+        return self._aclient
+
+    async def achat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        response = await self.aclient.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            **kwargs
+        )
+        return response.choices[0].message.content
+
+    async def achat_with_usage(self, messages: List[Dict[str, str]], **kwargs) -> dict:
+        response = await self.aclient.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            **kwargs
+        )
+        return {
+            "text": response.choices[0].message.content,
+            "usage": response.usage
+        }
@@ -0,0 +1,29 @@
+import os
+import httpx
+
+_async_http_client = None
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Cliente httpx asíncrono compartido por todos los providers del proceso.
+    El pool de conexiones está acotado (LLM_MAX_CONNECTIONS / LLM_MAX_KEEPALIVE) y las
+    conexiones se reutilizan entre peticiones (keep-alive).
+    """
+    global _async_http_client
+    if _async_http_client is None or _async_http_client.is_closed:
+        _async_http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "256")),
+                max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE", "64")),
+            ),
+            timeout=httpx.Timeout(float(os.getenv("LLM_TIMEOUT", "60")), connect=5.0),
+        )
+    return _async_http_client
+
+
+async def close_async_http_client():
+    global _async_http_client
+    if _async_http_client is not None:
+        await _async_http_client.aclose()
+        _async_http_client = None
@@ -0,0 +1,400 @@
+"""
+Proveedor enrutador sobre varios backends (ChatGPTProvider, DeepSeekProvider...).
+
+- Estadísticas móviles por backend (latencia p50/p95 y tasa de error en una ventana)
+- Elige el backend sano más rápido; los que no tienen muestras se prueban primero
+- Hedging: si el primario no responde en su p95, lanza una petición de respaldo al
+  siguiente backend; gana la primera respuesta y la otra se cancela
+- Circuit breaker por backend: se abre tras `failure_threshold` fallos seguidos y deja
+  pasar una sola petición de prueba después de `cooldown` segundos
+- Reintentos con backoff exponencial y jitter, todo dentro de un plazo total (`deadline`)
+
+Los backends deben crearse con max_retries=0 para que los reintentos del SDK de OpenAI no
+oculten errores ni latencias al enrutador.
+"""
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Iterator
+
+import numpy as np
+
+from providers.base import Provider
+
+logger = logging.getLogger(__name__)
+
+
+class BackendStats:
+    """Ventana móvil de latencias (solo éxitos) y resultados de un backend."""
+
+    def __init__(self, window=100):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self.lock:
+            self.outcomes.append(ok)
+            if ok:
+                self.latencies.append(latency)
+
+    def quantile(self, q):
+        with self.lock:
+            if not self.latencies:
+                return None
+            return float(np.quantile(list(self.latencies), q))
+
+    @property
+    def error_rate(self) -> float:
+        with self.lock:
+            if not self.outcomes:
+                return 0.0
+            return 1.0 - sum(self.outcomes) / len(self.outcomes)
+
+    def score(self) -> float:
+        """Menor es mejor: latencia p50 penalizada por la tasa de error."""
+        p50 = self.quantile(0.5)
+        if p50 is None:
+            return 0.0
+        return p50 * (1.0 + 4.0 * self.error_rate)
+
+    def snapshot(self) -> dict:
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        return {
+            "samples": len(self.outcomes),
+            "latency_p50": round(p50, 3) if p50 is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+            "error_rate": round(self.error_rate, 3),
+        }
+
+
+class CircuitBreaker:
+    """closed -> open (tras N fallos seguidos) -> half_open (una prueba tras cooldown) -> closed."""
+
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.lock = threading.Lock()
+
+    def available(self) -> bool:
+        """Si se podría enviar una petición ahora (sin reservar la prueba)."""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                return time.monotonic() - self.opened_at >= self.cooldown
+            return not self.probe_in_flight
+
+    def acquire(self) -> bool:
+        """Reserva el envío; en half_open solo pasa una petición de prueba a la vez."""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+            if self.state == "half_open" and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+
+    def release(self):
+        """La petición se canceló sin resultado: se libera la prueba."""
+        with self.lock:
+            self.probe_in_flight = False
+
+    def success(self):
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.probe_in_flight = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"Circuito abierto tras {self.failures} fallos")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class _Backend:
+    def __init__(self, provider, window, failure_threshold, cooldown):
+        self.provider = provider
+        self.name = provider.name
+        self.stats = BackendStats(window)
+        self.breaker = CircuitBreaker(failure_threshold, cooldown)
+
+
+class RouterProvider(Provider):
+    # RAGPipeline no debe reintentar por su cuenta: el enrutador ya lo hace
+    handles_retries = True
+
+    def __init__(self, providers: List[Provider], deadline=30.0, hedge=True, hedge_quantile=0.95,
+                 hedge_min_delay=0.2, hedge_max_delay=5.0, max_attempts=4, backoff_base=0.2, backoff_max=2.0,
+                 failure_threshold=5, cooldown=30.0, window=100):
+        self.backends = [_Backend(p, window, failure_threshold, cooldown) for p in providers]
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.model = "+".join(getattr(p, "model", p.name) for p in providers)
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="router")
+
+    @property
+    def name(self) -> str:
+        return "router"
+
+    # --- selección -------------------------------------------------------------------
+
+    def ranked(self) -> List[_Backend]:
+        """Backends con el circuito disponible, del más rápido al más lento."""
+        healthy = [b for b in self.backends if b.breaker.available()]
+        return sorted(healthy, key=lambda b: b.stats.score())
+
+    def hedge_delay(self, backend: _Backend) -> float:
+        q = backend.stats.quantile(self.hedge_quantile)
+        if q is None:
+            return self.hedge_max_delay
+        return min(max(q, self.hedge_min_delay), self.hedge_max_delay)
+
+    def _backoff(self, attempt) -> float:
+        # Full jitter: uniforme entre 0 y base * 2^intento (acotado)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def stats(self) -> dict:
+        return {b.name: dict(b.stats.snapshot(), circuit=b.breaker.state) for b in self.backends}
+
+    # --- modo síncrono -----------------------------------------------------------------
+
+    def _timed(self, backend: _Backend, method, messages, kwargs):
+        start = time.monotonic()
+        try:
+            result = getattr(backend.provider, method)(messages, **kwargs)
+        except Exception:
+            backend.stats.record(time.monotonic() - start, False)
+            backend.breaker.failure()
+            raise
+        backend.stats.record(time.monotonic() - start, True)
+        backend.breaker.success()
+        return result
+
+    def _hedged(self, method, ranked, messages, kwargs, deadline):
+        """
+        Un intento: primario + (opcional) respaldo tras el retardo de hedging. El perdedor se
+        abandona (sus hilos no se pueden interrumpir; el timeout de la petición lo acota).
+        """
+        candidates = list(ranked)
+        running = {}
+        errors = []
+        hedged = False
+
+        def start_next():
+            while candidates:
+                backend = candidates.pop(0)
+                if backend.breaker.acquire():
+                    kw = dict(kwargs, timeout=max(deadline - time.monotonic(), 0.1))
+                    running[self._executor.submit(self._timed, backend, method, messages, kw)] = backend
+                    return backend
+            return None
+
+        primary = start_next()
+        if primary is None:
+            raise RuntimeError("No hay backends disponibles (circuitos abiertos)")
+        hedge_at = time.monotonic() + self.hedge_delay(primary)
+
+        while running:
+            timeout = max(deadline - time.monotonic(), 0)
+            if self.hedge and not hedged and candidates:
+                timeout = min(timeout, max(hedge_at - time.monotonic(), 0))
+            done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Plazo de {self.deadline}s agotado")
+                hedged = True
+                backup = start_next()
+                if backup is not None:
+                    logger.info(f"Hedging: {primary.name} lento, respaldo en {backup.name}")
+                continue
+            for fut in done:
+                backend = running.pop(fut)
+                if fut.exception() is None:
+                    for other, other_backend in running.items():
+                        if other.cancel():  # aún no empezaba: se libera la prueba del circuito
+                            other_backend.breaker.release()
+                    return backend, fut.result()
+                errors.append(fut.exception())
+                logger.warning(f"Backend {backend.name} falló: {fut.exception()}")
+            if not running:
+                start_next()  # failover inmediato al siguiente backend
+        raise errors[-1] if errors else RuntimeError("Sin backends disponibles")
+
+    def _call(self, method, messages, kwargs):
+        deadline = time.monotonic() + self.deadline
+        last_error = None
+        for attempt in range(self.max_attempts):
+            ranked = self.ranked()
+            if ranked:
+                try:
+                    return self._hedged(method, ranked, messages, kwargs, deadline)
+                except TimeoutError:
+                    raise
+                except Exception as e:
+                    last_error = e
+            else:
+                last_error = RuntimeError("No hay backends disponibles (circuitos abiertos)")
+            wait_s = min(self._backoff(attempt), deadline - time.monotonic())
+            if wait_s <= 0:
+                break
+            time.sleep(wait_s)
+        raise last_error or TimeoutError(f"Plazo de {self.deadline}s agotado")
+
+    def chat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        return self._call("chat", messages, kwargs)[1]
+
+    def chat_with_usage(self, messages: List[Dict[str, str]], **kwargs) -> dict:
+        backend, result = self._call("chat_with_usage", messages, kwargs)
+        return dict(result, backend=backend.name)
+
+    def chat_stream(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[str]:
+        """Sin hedging: se elige el mejor backend y se cambia de backend solo antes del primer token."""
+        deadline = time.monotonic() + self.deadline
+        last_error = None
+        for attempt in range(self.max_attempts):
+            for backend in self.ranked():
+                if not backend.breaker.acquire():
+                    continue
+                start = time.monotonic()
+                started = False
+                try:
+                    kw = dict(kwargs, timeout=max(deadline - start, 0.1))
+                    for delta in backend.provider.chat_stream(messages, **kw):
+                        if not started:
+                            started = True
+                            backend.stats.record(time.monotonic() - start, True)
+                            backend.breaker.success()
+                        yield delta
+                    return
+                except Exception as e:
+                    if started:
+                        raise
+                    backend.stats.record(time.monotonic() - start, False)
+                    backend.breaker.failure()
+                    last_error = e
+                    logger.warning(f"Backend {backend.name} falló antes del primer token: {e}")
+                except BaseException:
+                    # Cancelado sin resultado (cliente desconectado: GeneratorExit): se libera la prueba
+                    if not started:
+                        backend.breaker.release()
+                    raise
+            wait_s = min(self._backoff(attempt), deadline - time.monotonic())
+            if wait_s <= 0:
+                break
+            time.sleep(wait_s)
+        raise last_error or RuntimeError("No hay backends disponibles (circuitos abiertos)")
+
+    # --- modo asyncio ------------------------------------------------------------------
+
+    async def _atimed(self, backend: _Backend, method, messages, kwargs):
+        start = time.monotonic()
+        try:
+            result = await getattr(backend.provider, method)(messages, **kwargs)
+        except asyncio.CancelledError:
+            backend.breaker.release()  # perdedor del hedging: no cuenta como fallo
+            raise
+        except Exception:
+            backend.stats.record(time.monotonic() - start, False)
+            backend.breaker.failure()
+            raise
+        backend.stats.record(time.monotonic() - start, True)
+        backend.breaker.success()
+        return result
+
+    async def _ahedged(self, method, ranked, messages, kwargs, deadline):
+        """Igual que _hedged, pero el perdedor sí se cancela (se cierra su petición HTTP)."""
+        candidates = list(ranked)
+        running = {}
+        errors = []
+        hedged = False
+
+        def start_next():
+            while candidates:
+                backend = candidates.pop(0)
+                if backend.breaker.acquire():
+                    kw = dict(kwargs, timeout=max(deadline - time.monotonic(), 0.1))
+                    task = asyncio.ensure_future(self._atimed(backend, method, messages, kw))
+                    running[task] = backend
+                    return backend
+            return None
+
+        primary = start_next()
+        if primary is None:
+            raise RuntimeError("No hay backends disponibles (circuitos abiertos)")
+        hedge_at = time.monotonic() + self.hedge_delay(primary)
+
+        try:
+            while running:
+                timeout = max(deadline - time.monotonic(), 0)
+                if self.hedge and not hedged and candidates:
+                    timeout = min(timeout, max(hedge_at - time.monotonic(), 0))
+                done, _ = await asyncio.wait(list(running), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if time.monotonic() >= deadline:
+                        raise TimeoutError(f"Plazo de {self.deadline}s agotado")
+                    hedged = True
+                    backup = start_next()
+                    if backup is not None:
+                        logger.info(f"Hedging: {primary.name} lento, respaldo en {backup.name}")
+                    continue
+                for task in done:
+                    backend = running.pop(task)
+                    if task.exception() is None:
+                        return backend, task.result()
+                    errors.append(task.exception())
+                    logger.warning(f"Backend {backend.name} falló: {task.exception()}")
+                if not running:
+                    start_next()
+        finally:
+            for task in running:
+                task.cancel()
+        raise errors[-1] if errors else RuntimeError("Sin backends disponibles")
+
+    async def _acall(self, method, messages, kwargs):
+        deadline = time.monotonic() + self.deadline
+        last_error = None
+        for attempt in range(self.max_attempts):
+            ranked = self.ranked()
+            if ranked:
+                try:
+                    return await self._ahedged(method, ranked, messages, kwargs, deadline)
+                except TimeoutError:
+                    raise
+                except Exception as e:
+                    last_error = e
+            else:
+                last_error = RuntimeError("No hay backends disponibles (circuitos abiertos)")
+            wait_s = min(self._backoff(attempt), deadline - time.monotonic())
+            if wait_s <= 0:
+                break
+            await asyncio.sleep(wait_s)
+        raise last_error or TimeoutError(f"Plazo de {self.deadline}s agotado")
+
+    async def achat(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        return (await self._acall("achat", messages, kwargs))[1]
+
+    async def achat_with_usage(self, messages: List[Dict[str, str]], **kwargs) -> dict:
+        backend, result = await self._acall("achat_with_usage", messages, kwargs)
+        return dict(result, backend=backend.name)
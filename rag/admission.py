@@ -0,0 +1,184 @@
+"""
+Protección de la API ante ráfagas (web.py):
+
+  - SingleFlight: preguntas idénticas en vuelo (mismo proveedor, top_k, modo y filtros)
+    comparten una sola ejecución del pipeline; las que llegan mientras tanto esperan su resultado.
+  - AdmissionController: token bucket de entrada (429 inmediato si no hay token),
+    máximo de ejecuciones concurrentes por proveedor y una cola acotada para el resto
+    (503 si la cola está llena o la espera se agota). Ambos rechazos llevan Retry-After.
+
+Los límites son por proceso: con N workers de gunicorn, el total es N veces lo configurado.
+"""
+import os
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+from rag.ratelimit import TokenBucket
+from rag.cache import normalize_query
+from rag.shards import filter_key
+from rag import metrics
+
+
+class Overloaded(Exception):
+    """Petición rechazada por el control de admisión (status 429 o 503, con Retry-After en segundos)."""
+
+    def __init__(self, status, retry_after, reason):
+        super().__init__(f"{reason} (reintentar en {retry_after}s)")
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def parse_limits(spec: str) -> dict:
+    """'16' -> {'*': 16}; 'chatgpt=16,deepseek=8' -> por proveedor ('*' = resto)."""
+    limits = {}
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, value = part.rpartition("=")
+        limits[name.strip() or "*"] = int(value)
+    return limits
+
+
+def coalesce_key(provider, question, top_k, mode=None, filters=None) -> tuple:
+    return provider, top_k, mode or "", filter_key(filters), normalize_query(question)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplica llamadas concurrentes con la misma clave (thread-safe)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """Ejecuta fn() o espera la ejecución en curso con la misma clave. Devuelve (resultado, compartido)."""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = _Flight()
+                self.leaders += 1
+                leader = True
+            else:
+                flight.waiters += 1
+                self.shared += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result, False
+
+    def stats(self) -> dict:
+        with self.lock:
+            in_flight = len(self.flights)
+        total = self.leaders + self.shared
+        return {"executions": self.leaders, "coalesced": self.shared, "in_flight": in_flight,
+                "coalesced_ratio": round(self.shared / total, 4) if total else 0.0}
+
+
+class AdmissionController:
+    """
+    rate / burst: peticiones por segundo admitidas y tamaño de ráfaga (rate 0 = sin límite de tasa).
+    concurrency: {proveedor: máximo en ejecución} ('*' = por defecto; sin entrada = sin límite).
+    max_queue: peticiones esperando un cupo por proveedor; queue_timeout: segundos de espera máxima.
+    """
+
+    def __init__(self, rate=0.0, burst=None, concurrency=None, max_queue=64, queue_timeout=5.0):
+        self.bucket = TokenBucket(rate, capacity=burst) if rate else None
+        self.concurrency = dict(concurrency or {})
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.cond = threading.Condition()
+        self.running = {}
+        self.waiting = {}
+        self.rejected = {"rate": 0, "queue_full": 0, "queue_timeout": 0}
+        self.admitted = 0
+
+    @classmethod
+    def from_env(cls):
+        """ADMISSION_RPS, ADMISSION_BURST, PROVIDER_CONCURRENCY, ADMISSION_QUEUE, ADMISSION_QUEUE_TIMEOUT."""
+        return cls(
+            rate=float(os.getenv("ADMISSION_RPS", "0") or 0),
+            burst=float(os.getenv("ADMISSION_BURST", "0") or 0) or None,
+            concurrency=parse_limits(os.getenv("PROVIDER_CONCURRENCY", "")),
+            max_queue=int(os.getenv("ADMISSION_QUEUE", "64")),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5")),
+        )
+
+    def _limit(self, provider):
+        return self.concurrency.get(provider, self.concurrency.get("*"))
+
+    def _reject(self, provider, status, retry_after, reason):
+        self.rejected[reason] += 1
+        metrics.REJECTED.labels(provider, reason).inc()
+        raise Overloaded(status, max(1, math.ceil(retry_after)), reason)
+
+    def acquire(self, provider):
+        """Reserva un cupo para el proveedor o lanza Overloaded. Liberar con release(provider)."""
+        # Sin token no se espera: un hilo dormido en el bucket no cuenta en waiting ni en max_queue
+        if self.bucket is not None and not self.bucket.try_acquire():
+            with self.cond:
+                self._reject(provider, 429, self.bucket.wait_time(), "rate")
+
+        limit = self._limit(provider)
+        with self.cond:
+            if limit is not None and self.running.get(provider, 0) >= limit:
+                if self.waiting.get(provider, 0) >= self.max_queue:
+                    self._reject(provider, 503, self.queue_timeout, "queue_full")
+                self.waiting[provider] = self.waiting.get(provider, 0) + 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self.running.get(provider, 0) >= limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject(provider, 503, self.queue_timeout, "queue_timeout")
+                        self.cond.wait(remaining)
+                finally:
+                    self.waiting[provider] -= 1
+            self.running[provider] = self.running.get(provider, 0) + 1
+            self.admitted += 1
+
+    def release(self, provider):
+        with self.cond:
+            self.running[provider] -= 1
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self, provider):
+        self.acquire(provider)
+        try:
+            yield
+        finally:
+            self.release(provider)
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {"admitted": self.admitted, "rejected": dict(self.rejected),
+                    "running": dict(self.running), "waiting": dict(self.waiting),
+                    "concurrency": dict(self.concurrency)}
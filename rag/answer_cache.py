@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from rag.cache import normalize_query
+from rag.snapshots import index_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class AnswerCache:
+    """
+    Caché de respuestas del LLM delante de RAGPipeline.synthesize.
+
+    - Modo exacto: clave = contexto (proveedor, modelo, top_k, temperatura, IDs de los chunks
+      recuperados, ...) + pregunta normalizada.
+    - Modo semántico (semantic_threshold): si no hay acierto exacto, busca en un índice FAISS
+      local de preguntas ya respondidas y reutiliza la respuesta si la similitud coseno supera
+      el umbral y el contexto coincide.
+    - Desalojo LRU (max_entries) y por TTL (segundos).
+    - Persistencia en disco (directorio `path`) e invalidación automática cuando cambia la
+      versión del índice: version() si se indica (p. ej. la que sirve el Retriever), si no la
+      del snapshot vigente o la huella de `index_path` (ver rag/snapshots.py).
+    """
+
+    def __init__(self, path="data/cache/answers", index_path=None,
+                 max_entries=2000, ttl=24 * 3600, semantic_threshold=None, save_every=20, version=None):
+        self.path = Path(path) if path else None
+        self.index_path = index_path
+        self.version = version or (lambda: index_fingerprint(self.index_path))
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self.save_every = save_every
+
+        self._entries = OrderedDict()  # key -> entry
+        self._key_by_id = {}           # id del índice semántico -> key
+        self._side_index = None
+        self._next_id = 0
+        self._dirty = 0
+        self._lock = threading.RLock()
+        self._fingerprint = self.version()
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self.load()
+
+    @classmethod
+    def from_env(cls, index_path=None, version=None):
+        """Crea la caché según las variables ANSWER_CACHE_* (None si ANSWER_CACHE=0)."""
+        if os.getenv("ANSWER_CACHE", "1") != "1":
+            return None
+        semantic_threshold = os.getenv("ANSWER_CACHE_SEMANTIC_THRESHOLD")
+        return cls(
+            path=os.getenv("ANSWER_CACHE_DIR", "data/cache/answers"),
+            index_path=index_path,
+            max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "2000")),
+            ttl=float(os.getenv("ANSWER_CACHE_TTL", "86400")),
+            semantic_threshold=float(semantic_threshold) if semantic_threshold else None,
+            version=version
+        )
+
+    @property
+    def semantic(self) -> bool:
+        return self.semantic_threshold is not None
+
+    @staticmethod
+    def make_context(**params) -> str:
+        """Hash estable de los parámetros que determinan la respuesta (sin la pregunta)."""
+        raw = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _key(question: str, context: str) -> str:
+        raw = f"{context}|{normalize_query(question)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    # --- Consulta / inserción ---
+
+    def get(self, question: str, context: str, embedding=None):
+        """Devuelve el resultado cacheado o None."""
+        with self._lock:
+            self._check_index()
+            key = self._key(question, context)
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry["result"]
+            if entry is not None:
+                self._remove(key)
+
+            if self.semantic and embedding is not None and self._side_index is not None \
+                    and self._side_index.ntotal:
+                q = np.asarray(embedding, dtype="float32").reshape(1, -1)
+                k = min(8, self._side_index.ntotal)
+                D, I = self._side_index.search(q, k)
+                for sim, idx in zip(D[0], I[0]):
+                    if idx < 0 or sim < self.semantic_threshold:
+                        break
+                    cand_key = self._key_by_id.get(int(idx))
+                    cand = self._entries.get(cand_key)
+                    if cand is None or cand["context"] != context or self._expired(cand):
+                        continue
+                    self._entries.move_to_end(cand_key)
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    return cand["result"]
+
+            self.misses += 1
+            return None
+
+    def put(self, question: str, context: str, result: dict, embedding=None):
+        with self._lock:
+            self._check_index()
+            key = self._key(question, context)
+            if key in self._entries:
+                self._remove(key)
+            entry = {
+                "key": key,
+                "context": context,
+                "question": question,
+                "result": result,
+                "created": time.time(),
+                "id": None,
+                "embedding": None,
+            }
+            if embedding is not None:
+                emb = np.asarray(embedding, dtype="float32").reshape(1, -1)
+                if self.semantic:
+                    self._add_vector(entry, emb)
+                else:
+                    entry["embedding"] = emb[0]
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            self._dirty += 1
+            if self.save_every and self._dirty >= self.save_every:
+                self.save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._key_by_id.clear()
+            self._side_index = None
+            self._dirty += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    # --- Internos ---
+
+    def _expired(self, entry) -> bool:
+        return bool(self.ttl) and entry["created"] + self.ttl < time.time()
+
+    def _check_index(self):
+        fp = self.version()
+        if fp != self._fingerprint:
+            logger.info(f"Índice FAISS reconstruido (versión {fp}): invalidando caché de respuestas.")
+            self.clear()
+            self._fingerprint = fp
+            self.invalidations += 1
+
+    def _add_vector(self, entry, emb):
+        if self._side_index is None:
+            self._side_index = faiss.IndexIDMap2(faiss.IndexFlatIP(emb.shape[1]))
+        entry_id = self._next_id
+        self._next_id += 1
+        self._side_index.add_with_ids(emb, np.array([entry_id], dtype="int64"))
+        self._key_by_id[entry_id] = entry["key"]
+        entry["id"] = entry_id
+        entry["embedding"] = emb[0]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None or entry["id"] is None:
+            return
+        self._key_by_id.pop(entry["id"], None)
+        if self._side_index is not None:
+            self._side_index.remove_ids(np.array([entry["id"]], dtype="int64"))
+
+    # --- Persistencia ---
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            self.path.mkdir(parents=True, exist_ok=True)
+            entries = []
+            vectors = []
+            for entry in self._entries.values():
+                row = {k: entry[k] for k in ("key", "context", "question", "result", "created")}
+                row["has_embedding"] = entry["embedding"] is not None
+                if row["has_embedding"]:
+                    vectors.append(entry["embedding"])
+                entries.append(row)
+            data = {"fingerprint": self._fingerprint, "entries": entries}
+
+            tmp = self.path / "entries.json.tmp"
+            tmp.write_text(json.dumps(data, ensure_ascii=False, default=str), encoding="utf-8")
+            if vectors:
+                tmp_vec = self.path / "embeddings.tmp.npy"
+                np.save(tmp_vec, np.vstack(vectors).astype("float32"))
+                os.replace(tmp_vec, self.path / "embeddings.npy")
+            os.replace(tmp, self.path / "entries.json")
+            self._dirty = 0
+
+    def load(self):
+        if self.path is None or not (self.path / "entries.json").exists():
+            return
+        try:
+            data = json.loads((self.path / "entries.json").read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudo leer la caché de respuestas: {e}")
+            return
+        if data.get("fingerprint") != self._fingerprint:
+            logger.info("Caché de respuestas obsoleta (índice reconstruido), se descarta.")
+            self.invalidations += 1
+            return
+
+        vectors = None
+        vec_path = self.path / "embeddings.npy"
+        if any(r.get("has_embedding") for r in data["entries"]) and vec_path.exists():
+            vectors = np.load(vec_path)
+
+        v = 0
+        with self._lock:
+            for row in data["entries"]:
+                entry = dict(row, id=None, embedding=None)
+                has_embedding = entry.pop("has_embedding", False)
+                if has_embedding and vectors is not None and v < len(vectors):
+                    # Sin modo semántico el vector se conserva (y se vuelve a guardar) sin indexarlo
+                    if self.semantic:
+                        self._add_vector(entry, vectors[v:v + 1])
+                    else:
+                        entry["embedding"] = vectors[v]
+                    v += 1
+                if not self._expired(entry):
+                    self._entries[entry["key"]] = entry
+                elif entry["id"] is not None:
+                    self._key_by_id.pop(entry["id"], None)
+                    self._side_index.remove_ids(np.array([entry["id"]], dtype="int64"))
+        logger.info(f"Caché de respuestas cargada: {len(self._entries)} entradas.")
@@ -0,0 +1,226 @@
+"""
+Respuestas en lote para un archivo de preguntas (JSONL o CSV), p. ej. pre-generar las FAQ cada noche.
+
+  1. Se leen las preguntas y se eliminan duplicadas (misma pregunta normalizada y mismos filtros).
+  2. Se recupera para todas con Retriever.query_batch: un encode y un index.search por bloque.
+  3. Las llamadas al LLM corren en paralelo con un máximo de `concurrency` en vuelo y, si se
+     indica, un presupuesto de tokens por minuto (TokenBucket con la estimación del prompt
+     empaquetado + max_tokens, corregida con el uso real al terminar).
+  4. Cada resultado se agrega al JSONL de salida apenas termina (una línea por pregunta única).
+     Al volver a ejecutar se saltan las preguntas que ya tienen una línea con status "ok", así que
+     un lote interrumpido se retoma donde quedó.
+"""
+import csv
+import json
+import time
+import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from rag.cache import normalize_query
+from rag.ratelimit import TokenBucket
+from rag.shards import normalize_filters, filter_key
+
+logger = logging.getLogger(__name__)
+
+RETRIEVE_BATCH = 256   # preguntas por llamada a query_batch
+
+
+def read_questions(path):
+    """
+    Lee las preguntas de un JSONL ({"question", "id"?, "filters"?} por línea) o de un CSV con
+    columna "question" (e "id" opcional). Devuelve [{"id", "question", "filters"}].
+    """
+    path = Path(path)
+    items = []
+    if path.suffix.lower() == ".csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for n, row in enumerate(csv.DictReader(f), start=1):
+                items.append({"id": row.get("id") or str(n), "question": row.get("question") or "",
+                              "filters": None})
+    else:
+        with open(path, encoding="utf-8") as f:
+            for n, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                items.append({"id": row.get("id") or str(n), "question": row.get("question") or "",
+                              "filters": normalize_filters(row.get("filters"))})
+    return [item for item in items if item["question"].strip()]
+
+
+def question_key(question, filters) -> str:
+    """Clave de deduplicación y de reanudación: pregunta normalizada + filtros."""
+    fkey = filter_key(filters)
+    return normalize_query(question) + (f" | {fkey}" if fkey else "")
+
+
+def dedupe(items):
+    """Agrupa las preguntas repetidas; cada pregunta única conserva los id de todas sus apariciones."""
+    unique = {}
+    for item in items:
+        key = question_key(item["question"], item["filters"])
+        if key in unique:
+            unique[key]["ids"].append(item["id"])
+        else:
+            unique[key] = {"key": key, "question": item["question"].strip(), "filters": item["filters"],
+                           "ids": [item["id"]]}
+    return list(unique.values())
+
+
+def completed_keys(out_path) -> set:
+    """Claves ya respondidas en un archivo de salida previo (se ignoran errores y líneas truncadas)."""
+    done = set()
+    path = Path(out_path)
+    if not path.exists():
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") == "ok":
+                done.add(record["key"])
+    return done
+
+
+class BatchRunner:
+    """
+    Ejecuta un lote de preguntas sobre un RAGPipeline.
+    concurrency: llamadas al LLM en vuelo; tpm: tokens por minuto (prompt + respuesta, 0/None = sin límite).
+    """
+
+    def __init__(self, pipeline, concurrency=8, tpm=None, top_k=4, max_tokens=512, temperature=0.0,
+                 retrieve_batch=RETRIEVE_BATCH):
+        self.pipeline = pipeline
+        self.concurrency = max(1, concurrency)
+        self.limiter = TokenBucket(tpm / 60.0, capacity=tpm) if tpm else None
+        self.top_k = top_k
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.retrieve_batch = retrieve_batch
+
+    def retrieve(self, items):
+        """Recupera para todas las preguntas: agrupa por filtros y llama a query_batch por bloques."""
+        groups = {}
+        for item in items:
+            groups.setdefault(filter_key(item["filters"]), []).append(item)
+        # Con reranking se recuperan los candidatos y synthesize_hits los reordena
+        depth, expand = self.pipeline.retrieval_depth(self.top_k)
+        for group in groups.values():
+            for i in range(0, len(group), self.retrieve_batch):
+                chunk = group[i:i + self.retrieve_batch]
+                start = time.time()
+                hits = self.pipeline.retriever.query_batch(
+                    [self.pipeline.rewrite_query(item["question"]) for item in chunk],
+                    top_k=depth, filters=chunk[0]["filters"], expand=expand
+                )
+                latency = (time.time() - start) / len(chunk)
+                for item, item_hits in zip(chunk, hits):
+                    yield item, item_hits, latency
+
+    def answer(self, item, hits, latency_retrieve):
+        """Genera la respuesta de una pregunta ya recuperada y devuelve su registro de salida."""
+        record = {"key": item["key"], "question": item["question"], "ids": item["ids"]}
+        if item["filters"]:
+            record["filters"] = item["filters"]
+        reserved = []
+
+        def reserve(pack_stats):
+            # Reserva del presupuesto: prompt empaquetado + máximo de la respuesta
+            if self.limiter is not None:
+                n = (pack_stats.get("prompt_tokens_packed") or 0) + self.max_tokens
+                self.limiter.acquire(n)
+                reserved.append(n)
+
+        try:
+            res = self.pipeline.synthesize_hits(
+                item["question"], hits, top_k=self.top_k, max_tokens=self.max_tokens,
+                temperature=self.temperature, with_usage=True, latency_retrieve=latency_retrieve,
+                before_llm=reserve
+            )
+        except Exception as e:
+            logger.warning(f"Error en la pregunta {item['ids'][0]}: {e}")
+            if reserved:
+                self.limiter.adjust(-reserved[0])
+            record.update({"status": "error", "error": str(e)})
+            return record
+
+        if reserved and res.get("tokens_total") is not None:
+            self.limiter.adjust(res["tokens_total"] - reserved[0])
+        record.update({
+            "status": "ok",
+            "answer": res["answer"],
+            "citations": res["citations"],
+            "sources": [{"doc_id": h.get("doc_id"), "title": h.get("title"), "page": h.get("page"),
+                         "score": h.get("score")} for h in res["hits"]],
+            "abstained": res.get("abstained", False),
+            "cache_hit": res.get("cache_hit", False),
+            "backend": res.get("backend"),
+            "tokens_prompt": res.get("tokens_prompt"),
+            "tokens_completion": res.get("tokens_completion"),
+            "latency_retrieve": res["latency_retrieve"],
+            "latency_llm": res["latency_llm"],
+            "latency_total": res["latency_total"],
+        })
+        if "latency_rerank" in res:
+            record.update({k: res[k] for k in ("latency_rerank", "rerank_fallback", "prompt_tokens_saved")})
+        return record
+
+    def run(self, input_path, out_path, restart=False):
+        """Procesa input_path y agrega los resultados a out_path; devuelve un resumen."""
+        start = time.time()
+        items = read_questions(input_path)
+        unique = dedupe(items)
+        out_path = Path(out_path)
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        if restart and out_path.exists():
+            out_path.unlink()
+        done = completed_keys(out_path)
+        truncated = False
+        if out_path.exists() and out_path.stat().st_size:
+            with open(out_path, "rb") as f:
+                f.seek(-1, 2)
+                truncated = f.read(1) != b"\n"
+        pending = [item for item in unique if item["key"] not in done]
+        print(f"{len(items)} preguntas, {len(unique)} únicas, {len(unique) - len(pending)} ya respondidas, "
+              f"{len(pending)} pendientes.")
+
+        stats = {"questions": len(items), "unique": len(unique), "skipped": len(unique) - len(pending),
+                 "ok": 0, "errors": 0, "cache_hits": 0, "tokens": 0}
+        with open(out_path, "a", encoding="utf-8") as out, \
+                ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch") as pool:
+            if truncated:
+                out.write("\n")  # última línea cortada por una interrupción
+            in_flight = set()
+
+            def drain(block):
+                finished, rest = wait(in_flight, return_when=FIRST_COMPLETED) if block else (
+                    {f for f in in_flight if f.done()}, None)
+                for fut in finished:
+                    in_flight.discard(fut)
+                    record = fut.result()
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+                    if record["status"] == "ok":
+                        stats["ok"] += 1
+                        stats["cache_hits"] += int(record["cache_hit"])
+                        stats["tokens"] += (record["tokens_prompt"] or 0) + (record["tokens_completion"] or 0)
+                    else:
+                        stats["errors"] += 1
+                    n = stats["ok"] + stats["errors"]
+                    if n % 50 == 0 or n == len(pending):
+                        print(f"  {n}/{len(pending)} respondidas ({time.time() - start:.1f}s)")
+
+            # La recuperación avanza por bloques mientras hay llamadas al LLM en vuelo
+            for item, hits, latency in self.retrieve(pending):
+                while len(in_flight) >= 2 * self.concurrency:
+                    drain(block=True)
+                in_flight.add(pool.submit(self.answer, item, hits, latency))
+                drain(block=False)
+            while in_flight:
+                drain(block=True)
+
+        stats["seconds"] = round(time.time() - start, 1)
+        return stats
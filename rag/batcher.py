@@ -0,0 +1,103 @@
+import os
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _Pending:
+    __slots__ = ("item", "event", "result", "error", "enqueued")
+
+    def __init__(self, item):
+        self.item = item
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.enqueued = time.perf_counter()
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batching de consultas concurrentes: los hilos llaman submit(item) y esperan; un hilo
+    de fondo junta lo que llega durante a lo más `max_wait_ms` (o hasta `max_batch` items),
+    llama una sola vez a `fn(items) -> resultados` y entrega a cada hilo su resultado.
+
+    En Retriever, fn hace un solo encode y un solo index.search para todo el lote.
+    """
+
+    def __init__(self, fn, max_batch=32, max_wait_ms=5.0, name="embedding-batcher"):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        self.batches = 0
+        self.items = 0
+        self.max_seen = 0
+
+    def _ensure_started(self):
+        # El hilo se crea en el primer uso y se recrea tras un fork (no sobrevive en el hijo)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def submit(self, item):
+        """Encola `item`, espera el lote y devuelve su resultado (o relanza el error del lote)."""
+        self._ensure_started()
+        pending = _Pending(item)
+        self._queue.put(pending)
+        pending.event.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self.fn([p.item for p in batch], [p.enqueued for p in batch])
+                for p, r in zip(batch, results):
+                    p.result = r
+            except Exception as e:
+                logger.exception("Error procesando lote de consultas")
+                for p in batch:
+                    p.error = e
+            finally:
+                self.batches += 1
+                self.items += len(batch)
+                self.max_seen = max(self.max_seen, len(batch))
+                for p in batch:
+                    p.event.set()
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch_seen": self.max_seen,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+        }
@@ -0,0 +1,136 @@
+import re
+import json
+import unicodedata
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Palabras vacías del español (ya sin tildes, tras fold_accents)
+STOPWORDS = set("""
+a al algo algunas algunos ante antes como con contra cual cuales cuando de del desde donde
+durante e el ella ellas ellos en entre era es esa esas ese eso esos esta estas este esto estos
+fue fueron ha han hasta hay la las le les lo los mas me mi mis muy ni no nos o os otra otras
+otro otros para pero por porque que quien quienes se sea segun ser si sin sobre son su sus
+tambien te tiene tienen todo todos tu tus u un una unas uno unos y ya
+""".split())
+
+
+def fold_accents(text: str) -> str:
+    """Minúsculas y sin tildes: "Artículo" -> "articulo", "Año" -> "ano"."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _stem(token: str) -> str:
+    # Stemming liviano: solo plurales (reglamentos -> reglamento, sanciones -> sancion)
+    if token.isdigit() or len(token) <= 4:
+        return token
+    if token.endswith("ones"):
+        return token[:-2]
+    if token.endswith("es") and len(token) > 5 and token[-3] in "rlnd":
+        return token[:-2]
+    if token.endswith("s"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str):
+    """Tokenizador para español: sin tildes, sin palabras vacías; conserva números (artículos, fechas)."""
+    return [_stem(t) for t in TOKEN_RE.findall(fold_accents(text or "")) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Índice invertido BM25 guardado como arreglos compactos (formato CSR):
+      offsets[t]:offsets[t+1] delimita las postings del término t en docs/tfs.
+    Los documentos son las posiciones del almacén de chunks; `ids` las traduce a chunk_id.
+    Los arreglos se guardan como .npy y se cargan con memory-map.
+    """
+
+    FILES = ("offsets", "docs", "tfs", "idf", "doc_len", "ids")
+
+    def __init__(self, terms, offsets, docs, tfs, idf, doc_len, ids, k1=1.2, b=0.75):
+        self.vocab = {t: i for i, t in enumerate(terms)}
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.idf = idf
+        self.doc_len = doc_len
+        self.ids = ids
+        self.k1 = k1
+        self.b = b
+        avgdl = float(doc_len.mean()) if len(doc_len) else 1.0
+        # Parte del denominador de BM25 que solo depende del documento
+        self._norm = (k1 * (1 - b + b * doc_len / max(avgdl, 1e-9))).astype("float32")
+
+    @classmethod
+    def build(cls, texts, ids, k1=1.2, b=0.75):
+        postings = {}
+        doc_len = np.zeros(len(texts), dtype="float32")
+        for doc, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_len[doc] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc, tf))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype="int64")
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(postings[term])
+        docs = np.empty(offsets[-1], dtype="int32")
+        tfs = np.empty(offsets[-1], dtype="float32")
+        for i, term in enumerate(terms):
+            plist = postings[term]
+            docs[offsets[i]:offsets[i + 1]] = [d for d, _ in plist]
+            tfs[offsets[i]:offsets[i + 1]] = [tf for _, tf in plist]
+
+        n = len(texts)
+        df = np.diff(offsets).astype("float32")
+        idf = np.log(1 + (n - df + 0.5) / (df + 0.5)).astype("float32")
+        return cls(terms, offsets, docs, tfs, idf, doc_len, np.asarray(ids, dtype="int64"), k1, b)
+
+    def save(self, path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        for name in self.FILES:
+            np.save(path / f"{name}.npy", getattr(self, name))
+        terms = sorted(self.vocab, key=self.vocab.get)
+        (path / "vocab.json").write_text(json.dumps({"terms": terms, "k1": self.k1, "b": self.b},
+                                                    ensure_ascii=False), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        meta = json.loads((path / "vocab.json").read_text(encoding="utf-8"))
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in cls.FILES}
+        return cls(meta["terms"], k1=meta["k1"], b=meta["b"], **arrays)
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def search(self, query: str, top_k=5, mask=None):
+        """
+        Devuelve (scores, chunk_ids) de los top_k documentos con puntaje > 0.
+        mask (bool por documento) restringe la búsqueda a un subconjunto.
+        """
+        scores = np.zeros(len(self.doc_len), dtype="float32")
+        for term in set(tokenize(query)):
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            s, e = self.offsets[t], self.offsets[t + 1]
+            d = self.docs[s:e]
+            tf = self.tfs[s:e]
+            scores[d] += self.idf[t] * tf * (self.k1 + 1) / (tf + self._norm[d])
+        if mask is not None:
+            scores[~mask] = 0.0
+
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > top_k:
+            part = np.argpartition(-scores[candidates], top_k - 1)[:top_k]
+            candidates = candidates[part]
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return scores[order], np.asarray(self.ids[order])
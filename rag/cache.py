@@ -0,0 +1,77 @@
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normaliza una consulta para usarla como clave de caché:
+    Unicode NFC, minúsculas y espacios colapsados.
+    """
+    text = unicodedata.normalize("NFC", text or "")
+    text = re.sub(r"\s+", " ", text)
+    return text.strip().lower()
+
+
+class LRUCache:
+    """
+    Caché LRU acotada y thread-safe con expiración opcional por TTL (segundos).
+    Lleva contadores de aciertos, fallos y desalojos para exponerlos como métricas.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.evictions += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
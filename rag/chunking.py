@@ -0,0 +1,207 @@
+"""
+Chunking por estructura de la normativa (small-to-big).
+
+Cada página se divide en secciones (Título/Capítulo y Artículo) y, dentro de cada sección,
+en unidades: párrafos y entradas de calendario (líneas que comienzan con una fecha).
+Las unidades se agrupan en chunks hijos de a lo más CHILD_MAX_TOKENS word-pieces del
+modelo de embeddings (MiniLM trunca en 256), que son los que se indexan. Cada hijo apunta
+con parent_id a su sección (el padre, en parents.parquet), que es lo que recibe el LLM.
+"""
+import re
+import hashlib
+import logging
+import functools
+from pathlib import Path
+
+from rag.encoder import MODEL, ONNX_DIR, hub_id
+from rag.packing import count_tokens
+
+logger = logging.getLogger(__name__)
+
+CHILD_MAX_TOKENS = 200      # word-pieces por hijo; con el encabezado antepuesto sigue bajo 256
+PARENT_MAX_TOKENS = 800     # word-pieces por padre; las secciones más largas se parten
+HEADING_MAX_WORDS = 8       # palabras de un encabezado de Título que se anteponen a cada hijo
+WORDPIECES_PER_WORD = 1.6   # estimación sin tokenizer (vocabulario inglés sobre texto en español)
+
+MONTHS = r"(?:enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|setiembre|octubre|noviembre|diciembre)"
+WEEKDAYS = r"(?:lunes|martes|mi[ée]rcoles|jueves|viernes|s[áa]bado|domingo)"
+TITLE_RE = re.compile(r"^(?:T[ÍI]TULO|CAP[ÍI]TULO)\s+(?:[IVXLC]+|\d+|[ÚU]NICO)\b", re.IGNORECASE)
+ARTICLE_RE = re.compile(r"^(?:ART[ÍI]CULO|ART\.)\s*(?:\d+|[ÚU]NICO)\s*[°º]?", re.IGNORECASE)
+DATE_RE = re.compile(
+    rf"^(?:{WEEKDAYS},?\s+)?(?:\d{{1,2}}(?:\s*(?:al|a|-|y)\s*\d{{1,2}})?\s+de\s+{MONTHS}"
+    rf"|\d{{1,2}}[/-]\d{{1,2}}(?:[/-]\d{{2,4}})?|{MONTHS}\s+\d{{1,2}})\b",
+    re.IGNORECASE
+)
+SENTENCE_RE = re.compile(r"(?<=[.;:!?])\s+(?=[\"«¿¡(A-ZÁÉÍÓÚÑ0-9])")
+
+
+@functools.lru_cache(maxsize=1)
+def _tokenizer():
+    """Tokenizer del modelo de embeddings (el exportado a ONNX o el del Hub); None si no está."""
+    try:
+        from tokenizers import Tokenizer
+        local = Path(ONNX_DIR) / MODEL.replace("/", "__") / "tokenizer.json"
+        if local.exists():
+            return Tokenizer.from_file(str(local))
+        return Tokenizer.from_pretrained(hub_id(MODEL))
+    except Exception as e:
+        logger.warning(f"Tokenizer de {MODEL} no disponible ({e}); se estiman word-pieces por palabras.")
+        return None
+
+
+def embedding_tokens(text: str) -> int:
+    """Word-pieces que ve el modelo de embeddings (sin [CLS]/[SEP])."""
+    tokenizer = _tokenizer()
+    if tokenizer is None:
+        return int(len(text.split()) * WORDPIECES_PER_WORD) + 1
+    return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def _clean(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _heading(line: str) -> str:
+    return " ".join(line.split()[:HEADING_MAX_WORDS])
+
+
+def split_sections(text: str, title_heading=None):
+    """
+    Secciones de una página como (encabezado, [unidades]). El texto debe conservar los saltos
+    de línea de la extracción. title_heading: Título vigente que viene de la página anterior.
+    """
+    sections = []
+    heading, units, buf = title_heading, [], []
+
+    def end_unit():
+        if buf:
+            units.append(_clean(" ".join(buf)))
+            buf.clear()
+
+    def end_section():
+        end_unit()
+        if units:
+            sections.append((heading, list(units)))
+            units.clear()
+
+    current_title = title_heading
+    for line in text.replace("\x0c", "\n").splitlines():
+        line = line.strip()
+        if not line:
+            end_unit()
+        elif TITLE_RE.match(line):
+            # El Título no forma unidad propia: queda como encabezado de lo que sigue
+            end_section()
+            current_title = heading = _heading(line)
+        elif ARTICLE_RE.match(line):
+            end_section()
+            article = ARTICLE_RE.match(line).group(0).strip()
+            heading = " · ".join(h for h in (current_title, article) if h)
+            buf.append(line)
+        elif DATE_RE.match(line):
+            # Entrada de calendario: una unidad por fecha
+            end_unit()
+            buf.append(line)
+        else:
+            buf.append(line)
+    end_section()
+    return sections, current_title
+
+
+def _pieces(unit: str, max_tokens: int):
+    """Parte una unidad demasiado larga en oraciones y, si hace falta, en ventanas de palabras."""
+    if embedding_tokens(unit) <= max_tokens:
+        yield unit
+        return
+    for sentence in SENTENCE_RE.split(unit):
+        if embedding_tokens(sentence) <= max_tokens:
+            yield sentence
+            continue
+        words = sentence.split()
+        step = max(1, int(max_tokens / WORDPIECES_PER_WORD))
+        for i in range(0, len(words), step):
+            yield " ".join(words[i:i + step])
+
+
+def pack_units(units, max_tokens=CHILD_MAX_TOKENS):
+    """Agrupa unidades consecutivas en textos de a lo más max_tokens word-pieces."""
+    out, current, size = [], [], 0
+    for unit in units:
+        for piece in _pieces(unit, max_tokens):
+            n = embedding_tokens(piece)
+            if current and size + n > max_tokens:
+                out.append(" ".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += n
+    if current:
+        out.append(" ".join(current))
+    return out
+
+
+def _group(children, max_tokens):
+    group, size = [], 0
+    for child in children:
+        n = embedding_tokens(child)
+        if group and size + n > max_tokens:
+            yield group
+            group, size = [], 0
+        group.append(child)
+        size += n
+    if group:
+        yield group
+
+
+def _with_heading(text: str, heading) -> str:
+    """Antepone el encabezado de la sección, sin repetir el Artículo si el texto ya empieza con él."""
+    if not heading:
+        return text
+    parts = heading.split(" · ")
+    if text.startswith(parts[-1]):
+        parts = parts[:-1]
+    return f"{' · '.join(parts)}: {text}" if parts else text
+
+
+def _parent_id(doc_id, page, text, occurrence) -> int:
+    th = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    digest = hashlib.blake2b(f"parent|{doc_id}|{page}|{th}|{occurrence}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") & 0x7FFFFFFFFFFFFFFF
+
+
+def structure_chunks(text: str, doc_id: str, title: str, page=None, title_heading=None,
+                     child_tokens=CHILD_MAX_TOKENS, parent_tokens=PARENT_MAX_TOKENS):
+    """
+    Chunks hijos y padres de una página. Devuelve (hijos, padres, Título vigente).
+    Los hijos llevan el encabezado de su sección al inicio, para que el embedding sepa
+    de qué artículo son; los padres guardan el texto completo de la sección.
+    """
+    sections, current_title = split_sections(text, title_heading)
+    children, parents = [], []
+    seen = {}
+    for heading, units in sections:
+        # Secciones largas: varios padres consecutivos, cada uno con hijos completos
+        for parent_units in _group(pack_units(units, child_tokens), parent_tokens):
+            parent_text = _with_heading(" ".join(parent_units), heading)
+            occurrence = seen.get(parent_text, 0)
+            seen[parent_text] = occurrence + 1
+            parent_id = _parent_id(doc_id, page, parent_text, occurrence)
+            parents.append({
+                "doc_id": doc_id,
+                "title": title,
+                "page": page,
+                "section": heading,
+                "text": parent_text,
+                "n_tokens": count_tokens(parent_text),
+                "parent_id": parent_id,
+            })
+            for child in parent_units:
+                children.append({
+                    "doc_id": doc_id,
+                    "title": title,
+                    "page": page,
+                    "section": heading,
+                    "text": _with_heading(child, heading),
+                    "parent_id": parent_id,
+                })
+    return children, parents, current_title
+
@@ -1,28 +1,247 @@
+import os
+import shutil
 from pathlib import Path
+import json
+import time
 import pandas as pd
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
-MODEL = "all-MiniLM-L6-v2"
+from rag.ingest import assign_chunk_ids
+from rag.store import write_store, store_path, parents_path, ChunkStore
+from rag.bm25 import BM25Index
+from rag.encoder import MODEL, get_engine, engine_config, manifest_config
+from rag.shards import build_shards, shards_path
+from rag.embed_build import EmbeddingBuild
+from rag import snapshots as snap
+INDEX_TYPES = ("flat", "ivf", "ivfpq", "hnsw")
+TRAIN_SIZE = 50000
+ADD_BLOCK = 65536  # vectores por llamada a index.add_with_ids desde el archivo de embeddings
+
+def index_manifest_path(index_path) -> Path:
+    """Manifiesto lateral del índice (data/index.faiss -> data/index.json)."""
+    return Path(index_path).with_suffix(".json")
+
+def bm25_path(index_path) -> Path:
+    """Directorio del índice BM25 junto al índice FAISS (data/index.faiss -> data/bm25/)."""
+    return Path(index_path).with_name("bm25")
+
+def load_index_manifest(index_path) -> dict:
+    p = index_manifest_path(index_path)
+    if not p.exists():
+        return None
+    return json.loads(p.read_text(encoding="utf-8"))
+
+def make_index(index_type: str, dim: int, n: int, nlist=None, pq_m=16, pq_nbits=8,
+               hnsw_m=32, ef_construction=200):
+    """
+    Crea un índice vacío (producto interno sobre vectores normalizados = coseno).
+      flat  -> exacto (IndexFlatIP)
+      ivf   -> IVF-Flat: nlist listas, se busca en nprobe de ellas
+      ivfpq -> IVF con Product Quantization (pq_m subvectores de pq_nbits bits): menos memoria
+      hnsw  -> grafo HNSW (hnsw_m vecinos por nodo), se ajusta con efSearch
+    Devuelve (índice, parámetros usados). Los IVF usan directamente el chunk_id como ID;
+    flat y hnsw se envuelven en IndexIDMap2.
+    """
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dim)), {}
+    if index_type in ("ivf", "ivfpq"):
+        # ~4*sqrt(n) listas, con al menos ~39 puntos de entrenamiento por lista
+        nlist = nlist or int(4 * np.sqrt(n))
+        nlist = max(1, min(nlist, n // 39 or 1))
+        quantizer = faiss.IndexFlatIP(dim)
+        if index_type == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            params = {"nlist": nlist}
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+            params = {"nlist": nlist, "pq_m": pq_m, "pq_nbits": pq_nbits}
+        params["nprobe"] = min(nlist, max(8, min(64, nlist // 16)))
+        index.nprobe = params["nprobe"]
+        return index, params
+    if index_type == "hnsw":
+        inner = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        inner.hnsw.efConstruction = ef_construction
+        inner.hnsw.efSearch = 64
+        return faiss.IndexIDMap2(inner), {"hnsw_m": hnsw_m, "ef_construction": ef_construction, "ef_search": 64}
+    raise ValueError(f"Tipo de índice desconocido: {index_type} (opciones: {', '.join(INDEX_TYPES)})")
+
+def train_index(index, embeddings, train_size=TRAIN_SIZE, seed=0):
+    """Entrena el índice (IVF/PQ) con una muestra aleatoria de a lo más train_size vectores."""
+    if index.is_trained:
+        return
+    if len(embeddings) > train_size:
+        rng = np.random.default_rng(seed)
+        sample = embeddings[rng.choice(len(embeddings), train_size, replace=False)]
+    else:
+        sample = embeddings
+    index.train(np.ascontiguousarray(sample, dtype="float32"))
+
+def _encode(engine, texts):
+    return np.ascontiguousarray(engine.encode(texts, show_progress_bar=True), dtype="float32")
+
+def _add(index, vecs, ids, block=ADD_BLOCK):
+    """add_with_ids por bloques: con embeddings mapeados en memoria (float16/32) solo un bloque pasa a float32."""
+    for start in range(0, len(ids), block):
+        index.add_with_ids(np.ascontiguousarray(vecs[start:start + block], dtype="float32"),
+                           ids[start:start + block])
+
+def _write_index(index, path):
+    """faiss.write_index a un temporal + os.replace: un lector nunca ve el archivo a medias."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    faiss.write_index(index, tmp)
+    os.replace(tmp, path)
 
 def build_index(chunks_parquet="data/processed/chunks.parquet",
-                index_path="data/index.faiss",
-                meta_path="data/processed/chunks.parquet"):
-    df = pd.read_parquet(chunks_parquet)
-    texts = df["text"].tolist()
-    model = SentenceTransformer(MODEL)
-    embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar=True)
-    faiss.normalize_L2(embeddings)
+                index_path=snap.LEGACY_INDEX,
+                meta_path=snap.LEGACY_META,
+                incremental=True, index_type="flat", backend=None, shards=True,
+                snapshots=snap.SNAPSHOT_ROOT, keep=snap.KEEP, workers=None, dtype="float32", **index_params):
+    """
+    Construye el índice FAISS con chunk_id como ID. index_type: flat | ivf | ivfpq | hnsw
+    (ver make_index para index_params). El tipo y sus parámetros quedan en el manifiesto
+    lateral (index.json), que Retriever lee al cargar.
+
+    snapshots: directorio de versiones (rag/snapshots.py). Cada build escribe una versión nueva
+    y la publica moviendo CURRENT; los Retriever en servicio la cargan sin reiniciar. Se
+    conservan `keep` versiones. Con snapshots=None se escribe en index_path / meta_path.
 
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(embeddings)
-    faiss.write_index(index, index_path)
+    En modo incremental reutiliza el índice vigente si es del mismo modelo y tipo:
+    elimina los IDs que ya no están en el parquet y solo codifica los chunks nuevos o
+    modificados. HNSW no admite eliminar vectores, así que en ese caso se reconstruye.
+    backend: motor de embeddings ("st" u "onnx", ver rag/encoder.py; por defecto EMBED_BACKEND).
+    shards: escribe también los sub-índices por documento para búsquedas filtradas (rag/shards.py).
+    workers: codifica por row groups en ese número de procesos (0 = todos los núcleos), con los
+    vectores en un archivo mapeado en memoria (dtype float32 o float16) y checkpoints para retomar
+    un build interrumpido (rag/embed_build.py). None = una sola llamada a encode en este proceso.
+    """
+    start = time.time()
+    if snapshots is not None:
+        prev_index, _, prev_version = snap.resolve(root=snapshots)
+        version = snap.new_version()
+        staging = snap.staging_dir(snapshots, version)
+        index_path, meta_path = str(staging / snap.INDEX_FILE), str(staging / snap.META_FILE)
+    else:
+        prev_index, prev_version = index_path, None
+    try:
+        if snapshots is not None and shards and shards_path(prev_index).exists():
+            # Los sub-índices de documentos sin cambios se reutilizan (enlaces duros)
+            snap.link_tree(shards_path(prev_index), shards_path(index_path))
+        _build(chunks_parquet, prev_index, index_path, meta_path, incremental, index_type, backend, shards,
+               index_params, workers, dtype)
+    except BaseException:
+        if snapshots is not None:
+            shutil.rmtree(staging, ignore_errors=True)
+        raise
 
+    if snapshots is not None:
+        manifest = load_index_manifest(index_path)
+        df = pd.read_parquet(meta_path, columns=["doc_id"])
+        snap.publish(snapshots, staging, version, {
+            "model": manifest["model"], "backend": manifest["backend"], "quantize": manifest["quantize"],
+            "index_type": index_type,
+            "params": manifest["params"], "ntotal": manifest["ntotal"], "chunks": len(df),
+            "documents": int(df["doc_id"].nunique()), "source": str(chunks_parquet), "previous": prev_version,
+        }, keep=keep)
+        print(f"Snapshot {version} publicado en {snapshots}/ ({time.time() - start:.1f}s).")
+
+def _build(chunks_parquet, prev_index, index_path, meta_path, incremental, index_type, backend, shards,
+           index_params, workers=None, dtype="float32"):
+    start = time.time()
+    df = pd.read_parquet(chunks_parquet)
+    if "chunk_id" not in df.columns:
+        df = pd.DataFrame(assign_chunk_ids(df.to_dict("records")))
+        if workers is not None:
+            print("chunks.parquet sin chunk_id (ingesta antigua): se codifica en una sola llamada.")
+            workers = None
+    if "parent_id" in df.columns:
+        df["parent_id"] = df["parent_id"].astype("Int64")  # nullable: sin perder precisión con nulos
     df.reset_index(drop=True, inplace=True)
+    ids = df["chunk_id"].to_numpy(dtype="int64")
+
+    def encode_rows(mask=None):
+        """Embeddings de las filas de df (todas o las de mask): una llamada a encode o EmbeddingBuild."""
+        if workers is None:
+            texts = df["text"] if mask is None else df.loc[mask, "text"]
+            return _encode(get_engine(backend), texts.tolist()), None
+        job = EmbeddingBuild(chunks_parquet, select=mask, backend=backend, workers=workers, dtype=dtype)
+        return job.run(), job
+
+    manifest = load_index_manifest(prev_index)
+    index = None
+    job = None
+    params = None
+    backend, quantize = engine_config(backend)
+    same_encoder = bool(manifest) and manifest.get("model") == MODEL \
+        and manifest_config(manifest) == (backend, quantize)
+    if incremental and manifest and not same_encoder:
+        print(f"El índice anterior usa otro motor de embeddings {manifest_config(manifest)} que "
+              f"{(backend, quantize)}: se codifican todos los chunks.")
+        if shards_path(index_path).exists():
+            shutil.rmtree(shards_path(index_path))  # sus vectores tampoco sirven
+    if incremental and same_encoder \
+            and manifest.get("index_type", "flat") == index_type and Path(prev_index).exists():
+        old_ids = np.array(manifest["ids"], dtype="int64")
+        to_remove = np.setdiff1d(old_ids, ids)
+        if not (index_type == "hnsw" and len(to_remove)):
+            index = faiss.read_index(str(prev_index))
+            params = manifest.get("params", {})
+
+    if index is not None:
+        new_mask = ~np.isin(ids, old_ids)
+        if len(to_remove):
+            index.remove_ids(to_remove)
+        fresh_ids = ids[new_mask]
+        fresh_vecs = np.zeros((0, index.d), dtype="float32")
+        if new_mask.any():
+            fresh_vecs, job = encode_rows(new_mask)
+            _add(index, fresh_vecs, fresh_ids)
+        print(f"Actualización incremental: {int(new_mask.sum())} chunks nuevos codificados, "
+              f"{len(to_remove)} eliminados, {int((~new_mask).sum())} vectores reutilizados.")
+    else:
+        embeddings, job = encode_rows()
+        index, params = make_index(index_type, embeddings.shape[1], len(embeddings), **index_params)
+        train_index(index, embeddings)
+        _add(index, embeddings, ids)
+        fresh_ids, fresh_vecs = ids, embeddings
+
+    _write_index(index, index_path)
+    index_manifest_path(index_path).write_text(json.dumps({
+        "model": MODEL,
+        "backend": backend,
+        "quantize": quantize,
+        "dim": index.d,
+        "ntotal": int(index.ntotal),
+        "index_type": index_type,
+        "params": params,
+        "ids": ids.tolist(),
+    }), encoding="utf-8")
+
+    if shards:
+        _, rebuilt = build_shards(shards_path(index_path), df, index.d, fresh_ids, fresh_vecs,
+                                  lambda texts: _encode(get_engine(backend), texts))
+        print(f"Sub-índices por documento: {rebuilt} reescritos en {shards_path(index_path)}.")
+    elif shards_path(index_path).exists():
+        shutil.rmtree(shards_path(index_path))  # quedarían desactualizados respecto del índice
+
     df.to_parquet(meta_path, index=False)
-    print(f"Índice FAISS guardado en {index_path} con {len(df)} vectores.")
+    store = write_store(df, store_path(meta_path))
+
+    # Secciones padre (chunking por estructura): almacén Arrow para la expansión small-to-big
+    parents = parents_path(chunks_parquet)
+    if parents.exists():
+        if parents_path(meta_path) != parents:
+            shutil.copyfile(parents, parents_path(meta_path))
+        write_store(pd.read_parquet(parents), store_path(parents_path(meta_path)), id_column="parent_id")
+
+    # Índice léxico BM25 sobre los mismos chunks, en el orden del almacén Arrow.
+    # Se reconstruye completo (solo tokenización, sin modelo) también en modo incremental.
+    table = ChunkStore(store).table
+    BM25Index.build(table.column("text").to_pylist(), table.column("chunk_id").to_numpy()).save(bm25_path(index_path))
+    if job is not None:
+        job.cleanup()  # índice escrito: el checkpoint de embeddings ya no hace falta
+    print(f"Índice FAISS ({index_type}) guardado en {index_path} con {len(df)} vectores "
+          f"({time.time() - start:.1f}s).")
 
 if __name__ == "__main__":
-    build_index()
\ No newline at end of file
+    build_index()
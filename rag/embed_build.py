@@ -0,0 +1,219 @@
+"""
+Codificación de chunks en varios procesos y con checkpoints, para corpus grandes
+(`python app.py index --workers N`).
+
+En vez de una sola llamada a encode con todos los textos en memoria:
+
+  - Los textos se leen de chunks.parquet por row group (pyarrow), no como una lista completa.
+  - Dentro de cada row group se ordenan por longitud y se cortan en lotes de batch_size (menos
+    padding). Los lotes se reparten entre `workers` procesos, cada uno con su propio motor
+    (rag/encoder.py, st u onnx) y los hilos de la máquina divididos entre ellos.
+  - Los vectores se escriben en un .npy mapeado en memoria (float32 o float16) en
+    data/embed_build/<clave>/, junto con progress.json: los row groups terminados. Cada
+    `checkpoint_seconds` se hace flush del archivo y se reescribe progress.json (temporal +
+    os.replace).
+
+La clave depende de los chunk_id a codificar, el modelo, el backend (y su cuantización) y el dtype. Si el build se
+interrumpe, la siguiente ejecución con el mismo chunks.parquet retoma desde los row groups
+pendientes. build_index borra el directorio cuando el índice queda escrito.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pyarrow.parquet as pq
+
+from rag.encoder import MODEL, get_engine, engine_config
+
+logger = logging.getLogger(__name__)
+
+WORK_DIR = "data/embed_build"
+DTYPES = ("float32", "float16")
+BATCH_SIZE = 64
+CHECKPOINT_SECONDS = 30.0
+
+_engine = None
+
+
+def _init_worker(backend, model_name, threads, batch_size):
+    global _engine
+    _engine = get_engine(backend, model_name, threads=threads, batch_size=batch_size)
+
+
+def _encode_batch(positions, texts):
+    """Tarea de un worker: (posiciones en el archivo de vectores, embeddings normalizados)."""
+    return positions, _engine.encode(texts)
+
+
+def workers_count(workers) -> int:
+    return workers or os.cpu_count() or 1
+
+
+class EmbeddingBuild:
+    """
+    Embeddings de los chunks de `chunks_parquet` (solo las filas con select=True, si se indica)
+    en un archivo mapeado en memoria de forma (filas seleccionadas, dim), en el orden del parquet.
+    """
+
+    def __init__(self, chunks_parquet, select=None, backend=None, model_name=MODEL, workers=0,
+                 batch_size=BATCH_SIZE, dtype="float32", work_dir=WORK_DIR,
+                 checkpoint_seconds=CHECKPOINT_SECONDS):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype de embeddings no soportado: {dtype} (opciones: {', '.join(DTYPES)})")
+        self.source = str(chunks_parquet)
+        self.backend, self.quantize = engine_config(backend)
+        self.model_name = model_name
+        self.workers = workers_count(workers)
+        self.batch_size = batch_size
+        self.dtype = dtype
+        self.checkpoint_seconds = checkpoint_seconds
+
+        self.file = pq.ParquetFile(self.source)
+        ids = self.file.read(columns=["chunk_id"]).column("chunk_id").to_numpy()
+        self.select = np.ones(len(ids), dtype=bool) if select is None else np.asarray(select, dtype=bool)
+        # Posición de la primera fila de cada row group en el parquet y en el archivo de vectores
+        sizes = [self.file.metadata.row_group(i).num_rows for i in range(self.file.num_row_groups)]
+        self.group_start = np.concatenate([[0], np.cumsum(sizes)]).astype("int64")
+        self.out_pos = np.concatenate([[0], np.cumsum(self.select)]).astype("int64")
+        self.rows = int(self.select.sum())
+
+        key = hashlib.sha1(np.ascontiguousarray(ids[self.select], dtype="int64").tobytes())
+        key.update(f"{model_name}|{self.backend}|{self.quantize}|{dtype}".encode("utf-8"))
+        self.dir = Path(work_dir) / key.hexdigest()[:16]
+        self.vectors_path = self.dir / "embeddings.npy"
+        self.progress_path = self.dir / "progress.json"
+        self.vecs = None
+        self.done = set()
+        self.dim = None
+
+    # --- Checkpoints ---
+
+    def _load_progress(self):
+        if not (self.progress_path.exists() and self.vectors_path.exists()):
+            return
+        progress = json.loads(self.progress_path.read_text(encoding="utf-8"))
+        self.done = set(progress["done"])
+        self.dim = progress["dim"]
+        self.vecs = np.lib.format.open_memmap(self.vectors_path, mode="r+")
+        logger.info(f"Retomando embeddings desde {self.dir}: {len(self.done)}/{self.file.num_row_groups} "
+                    f"row groups ya codificados.")
+
+    def _open(self, dim):
+        if self.vecs is None:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            self.dim = int(dim)
+            self.vecs = np.lib.format.open_memmap(self.vectors_path, mode="w+", dtype=self.dtype,
+                                                  shape=(self.rows, self.dim))
+
+    def checkpoint(self):
+        """Baja los vectores a disco y después registra los row groups terminados."""
+        if self.vecs is None:
+            return
+        self.vecs.flush()
+        tmp = self.progress_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({
+            "source": self.source, "model": self.model_name, "backend": self.backend, "dtype": self.dtype,
+            "rows": self.rows, "dim": self.dim, "row_groups": self.file.num_row_groups,
+            "done": sorted(self.done),
+        }), encoding="utf-8")
+        os.replace(tmp, self.progress_path)
+
+    def cleanup(self):
+        self.vecs = None
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    # --- Codificación ---
+
+    def _batches(self, pending):
+        """(row group, posiciones, textos) de los lotes pendientes, ordenados por longitud dentro del row group."""
+        for group in pending:
+            start = self.group_start[group]
+            mask = self.select[start:self.group_start[group + 1]]
+            if not mask.any():
+                yield group, None, []
+                continue
+            texts = self.file.read_row_group(group, columns=["text"]).column("text").to_pylist()
+            local = np.flatnonzero(mask)
+            texts = [texts[i] for i in local]
+            positions = self.out_pos[start + local]
+            order = np.argsort([len(t) for t in texts], kind="stable")
+            for b in range(0, len(order), self.batch_size):
+                idx = order[b:b + self.batch_size]
+                yield group, positions[idx], [texts[i] for i in idx]
+
+    def _results(self, batches):
+        """
+        Codifica los lotes (en proceso o en el pool) y entrega (row group, posiciones, vectores)
+        en el mismo orden en que llegaron; un row group sin filas a codificar trae vectores None.
+        """
+        if self.workers <= 1:
+            engine = get_engine(self.backend, self.model_name, batch_size=self.batch_size)
+            for group, positions, texts in batches:
+                yield group, positions, engine.encode(texts) if texts else None
+            return
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        # spawn: PyTorch / ONNX Runtime no son seguros tras fork() con hilos ya creados
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker,
+                                 initargs=(self.backend, self.model_name, threads, self.batch_size)) as executor:
+            # Ventana acotada de lotes en vuelo: la memoria no crece con el corpus
+            pending = deque()
+            window = self.workers * 4
+            for group, positions, texts in batches:
+                pending.append((group, executor.submit(_encode_batch, positions, texts) if texts else None))
+                while len(pending) >= window:
+                    yield self._resolve(*pending.popleft())
+            while pending:
+                yield self._resolve(*pending.popleft())
+
+    @staticmethod
+    def _resolve(group, future):
+        return (group, None, None) if future is None else (group, *future.result())
+
+    def run(self):
+        """Codifica lo pendiente y devuelve los vectores (np.memmap de solo lectura, forma (filas, dim))."""
+        start = time.time()
+        self._load_progress()
+        pending = [g for g in range(self.file.num_row_groups) if g not in self.done]
+        resumed = self.rows - sum(int(self.out_pos[self.group_start[g + 1]] - self.out_pos[self.group_start[g]])
+                                  for g in pending)
+        encoded = 0
+        last_checkpoint = time.time()
+
+        # Los resultados llegan en orden: un row group está completo cuando aparece el siguiente
+        current = None
+        for group, positions, vecs in self._results(self._batches(pending)):
+            if group != current:
+                if current is not None:
+                    self.done.add(current)
+                current = group
+            if vecs is not None:
+                self._open(vecs.shape[1])
+                self.vecs[positions] = vecs
+                encoded += len(positions)
+            if time.time() - last_checkpoint >= self.checkpoint_seconds:
+                self.checkpoint()
+                last_checkpoint = time.time()
+                rate = encoded / max(time.time() - start, 1e-9)
+                logger.info(f"Embeddings: {resumed + encoded}/{self.rows} chunks ({rate:.1f} chunks/s).")
+        if current is not None:
+            self.done.add(current)
+
+        if self.vecs is None:
+            # Nada que codificar en esta ejecución (no hay filas seleccionadas)
+            self._open(get_engine(self.backend, self.model_name).dim)
+        self.checkpoint()
+        seconds = time.time() - start
+        self.chunks_per_second = encoded / seconds if seconds > 0 else 0.0
+        print(f"Embeddings: {encoded} chunks codificados en {seconds:.1f}s con {self.workers} procesos "
+              f"({self.chunks_per_second:.1f} chunks/s), {resumed} retomados del checkpoint.")
+        self.vecs = None
+        return np.load(self.vectors_path, mmap_mode="r")
@@ -0,0 +1,259 @@
+"""
+Motor de embeddings compartido por la indexación (rag/embed.py), la recuperación
+(rag/retrieve.py) y la evaluación (eval/evaluate.py).
+
+Backends:
+  - "st":   sentence-transformers (PyTorch fp32), el comportamiento original
+  - "onnx": ONNX Runtime en CPU con cuantización dinámica int8. El modelo se exporta una vez
+            a data/onnx/<modelo>/ y después solo se necesitan onnxruntime y tokenizers (sin PyTorch)
+
+Las dependencias pesadas se importan al crear el backend, no al importar este módulo.
+"""
+import os
+import time
+import logging
+import threading
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MODEL = "all-MiniLM-L6-v2"
+BACKENDS = ("st", "onnx")
+ONNX_DIR = "data/onnx"
+MAX_LENGTH = 256  # max_seq_length de all-MiniLM-L6-v2 en sentence-transformers
+ONNX_INPUTS = ("input_ids", "attention_mask", "token_type_ids")
+
+# Tolerancias de la verificación de paridad entre backends
+PARITY_MIN_COSINE = 0.98
+PARITY_MIN_OVERLAP = 0.9
+
+
+def hub_id(model_name: str) -> str:
+    """Id del modelo en el Hub de Hugging Face (los nombres cortos son de sentence-transformers)."""
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype="float32")
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerBackend:
+    name = "st"
+
+    def __init__(self, model_name=MODEL, threads=None):
+        if threads:
+            import torch
+            torch.set_num_threads(int(threads))
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def after_fork(self):
+        pass
+
+    def encode(self, texts, batch_size=64, show_progress_bar=False):
+        return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                                 show_progress_bar=show_progress_bar).astype("float32")
+
+
+def export_onnx(model_name=MODEL, out_dir=ONNX_DIR, quantize=True) -> Path:
+    """
+    Exporta el transformer a ONNX (una vez) y, si quantize=True, genera la versión con
+    cuantización dinámica int8 de los pesos. Guarda también tokenizer.json.
+    Devuelve la ruta del modelo a cargar.
+    """
+    out = Path(out_dir) / model_name.replace("/", "__")
+    fp32_path, int8_path = out / "model.onnx", out / "model_int8.onnx"
+    target = int8_path if quantize else fp32_path
+    if target.exists() and (out / "tokenizer.json").exists():
+        return target
+
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    out.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(hub_id(model_name))
+    model = AutoModel.from_pretrained(hub_id(model_name)).eval()
+    tokenizer.save_pretrained(str(out))
+
+    if not fp32_path.exists():
+        logger.info(f"Exportando {model_name} a ONNX en {fp32_path}...")
+        dummy = tokenizer(["consulta de ejemplo"], return_tensors="pt")
+        axes = {"input_ids": {0: "batch", 1: "seq"}, "attention_mask": {0: "batch", 1: "seq"},
+                "token_type_ids": {0: "batch", 1: "seq"}, "last_hidden_state": {0: "batch", 1: "seq"}}
+        with torch.no_grad():
+            torch.onnx.export(model, tuple(dummy[name] for name in ONNX_INPUTS), str(fp32_path),
+                              input_names=list(ONNX_INPUTS), output_names=["last_hidden_state"],
+                              dynamic_axes=axes, opset_version=14)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        logger.info(f"Cuantizando a int8 en {int8_path}...")
+        quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+    return target
+
+
+class OnnxBackend:
+    """
+    Transformer en ONNX Runtime + mean pooling (igual que el módulo Pooling de
+    sentence-transformers). Los textos se agrupan por longitud para minimizar el padding.
+    """
+    name = "onnx"
+
+    def __init__(self, model_name=MODEL, threads=None, quantize=True, onnx_dir=ONNX_DIR):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        path = export_onnx(model_name, onnx_dir, quantize)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = int(threads or 0)  # 0 = todos los núcleos
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+        self.tokenizer = Tokenizer.from_file(str(path.parent / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_LENGTH)
+        self.tokenizer.enable_padding()
+        self.dim = int(self.session.get_outputs()[0].shape[-1])
+        self._session_args = (str(path), options)
+
+    def after_fork(self):
+        # Los hilos de ONNX Runtime no sobreviven a fork(): cada worker crea su propia sesión
+        path, options = self._session_args
+        import onnxruntime as ort
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def _run(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype="int64"),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype="int64"),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype="int64"),
+        }
+        hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        mask = feeds["attention_mask"][..., None].astype("float32")
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+    def encode(self, texts, batch_size=64, show_progress_bar=False):
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        order = np.argsort([len(t) for t in texts], kind="stable")
+        n_batches = (len(texts) + batch_size - 1) // batch_size
+        for b, start in enumerate(range(0, len(texts), batch_size)):
+            idx = order[start:start + batch_size]
+            out[idx] = self._run([texts[i] for i in idx])
+            if show_progress_bar and (b + 1) % 20 == 0:
+                logger.info(f"Embeddings: lote {b + 1}/{n_batches}")
+        return out
+
+
+class EmbeddingEngine:
+    """Fachada sobre un backend: devuelve embeddings float32 normalizados (L2)."""
+
+    def __init__(self, backend="st", model_name=MODEL, threads=None, batch_size=64, quantize=True):
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend de embeddings desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+        self.model_name = model_name
+        self.batch_size = batch_size
+        # Cuantización int8: solo aplica al backend onnx
+        self.quantize = bool(quantize) and backend == "onnx"
+        t0 = time.perf_counter()
+        if backend == "onnx":
+            self.backend = OnnxBackend(model_name, threads=threads, quantize=quantize)
+        else:
+            self.backend = SentenceTransformerBackend(model_name, threads=threads)
+        logger.info(f"Motor de embeddings '{backend}' cargado en {time.perf_counter() - t0:.2f}s.")
+
+    @property
+    def name(self) -> str:
+        return self.backend.name
+
+    @property
+    def dim(self) -> int:
+        return self.backend.dim
+
+    def after_fork(self):
+        """Llamar en cada worker tras fork() cuando el motor se cargó en el master (preload)."""
+        self.backend.after_fork()
+
+    def encode(self, texts, batch_size=None, show_progress_bar=False) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dim), dtype="float32")
+        return normalize(self.backend.encode(texts, batch_size=batch_size or self.batch_size,
+                                             show_progress_bar=show_progress_bar))
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def engine_config(backend=None, quantize=None):
+    """
+    (backend, quantize) efectivos, como los resuelve get_engine (EMBED_BACKEND, EMBED_QUANTIZE),
+    sin cargar el modelo. Los vectores de dos configuraciones distintas no son comparables.
+    """
+    backend = backend or os.getenv("EMBED_BACKEND", "st")
+    if quantize is None:
+        quantize = os.getenv("EMBED_QUANTIZE", "1") == "1"
+    return backend, bool(quantize) and backend == "onnx"
+
+
+def manifest_config(manifest) -> tuple:
+    """(backend, quantize) con que se construyó un índice (manifiestos antiguos: los valores por defecto)."""
+    backend = manifest.get("backend") or "st"
+    return backend, bool(manifest.get("quantize", backend == "onnx"))
+
+
+def get_engine(backend=None, model_name=MODEL, threads=None, batch_size=None, quantize=None) -> EmbeddingEngine:
+    """
+    Motor compartido por proceso (uno por configuración). Los valores no indicados salen de
+    EMBED_BACKEND, EMBED_THREADS, EMBED_BATCH_SIZE y EMBED_QUANTIZE.
+    """
+    backend = backend or os.getenv("EMBED_BACKEND", "st")
+    threads = threads or int(os.getenv("EMBED_THREADS", "0")) or None
+    batch_size = batch_size or int(os.getenv("EMBED_BATCH_SIZE", "64"))
+    if quantize is None:
+        quantize = os.getenv("EMBED_QUANTIZE", "1") == "1"
+    key = (backend, model_name, threads, batch_size, quantize)
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = EmbeddingEngine(backend, model_name, threads=threads, batch_size=batch_size,
+                                            quantize=quantize)
+        return _engines[key]
+
+
+def after_fork():
+    """Reinicia lo que no es seguro tras fork() en todos los motores cargados."""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.after_fork()
+
+
+def parity_check(reference: EmbeddingEngine, candidate: EmbeddingEngine, corpus, queries, k=10):
+    """
+    Compara dos motores sobre el mismo corpus: coseno entre vectores pareados y solapamiento
+    del top-k (búsqueda exacta) de cada consulta. ok=True si se mantienen las tolerancias.
+    """
+    ref_docs, cand_docs = reference.encode(corpus), candidate.encode(corpus)
+    ref_q, cand_q = reference.encode(queries), candidate.encode(queries)
+    cosines = np.concatenate([np.sum(ref_docs * cand_docs, axis=1), np.sum(ref_q * cand_q, axis=1)])
+
+    k = min(k, len(corpus))
+    ref_top = np.argsort(-(ref_q @ ref_docs.T), axis=1)[:, :k]
+    cand_top = np.argsort(-(cand_q @ cand_docs.T), axis=1)[:, :k]
+    overlaps = [len(set(a) & set(b)) / k for a, b in zip(ref_top, cand_top)]
+    top1 = float(np.mean(ref_top[:, 0] == cand_top[:, 0])) if len(queries) else 1.0
+
+    report = {
+        "cosine_min": float(cosines.min()),
+        "cosine_mean": float(cosines.mean()),
+        f"overlap@{k}": float(np.mean(overlaps)) if overlaps else 1.0,
+        "top1_agreement": top1,
+    }
+    report["ok"] = report["cosine_min"] >= PARITY_MIN_COSINE and report[f"overlap@{k}"] >= PARITY_MIN_OVERLAP
+    return report
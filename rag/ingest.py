@@ -1,13 +1,50 @@
 from pathlib import Path
+import os
 import re
+import json
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from pypdf import PdfReader
 
+from rag.chunking import structure_chunks
+from rag.store import parents_path
+
 CHUNK_SIZE = 900
 OVERLAP = 120
+MANIFEST_PATH = "data/processed/manifest.json"
+PAGES_PER_TASK = 8      # páginas por tarea de extracción
+BATCH_ROWS = 5000       # filas por row group del parquet
+CHUNKERS = ("structure", "window")  # por estructura (hijos + padres) o ventanas de CHUNK_SIZE palabras
+
+CHUNK_SCHEMA = pa.schema([
+    ("doc_id", pa.string()),
+    ("title", pa.string()),
+    ("page", pa.int64()),
+    ("text", pa.string()),
+    ("text_hash", pa.string()),
+    ("chunk_id", pa.int64()),
+    ("section", pa.string()),
+    ("parent_id", pa.int64()),
+])
+
+# Secciones completas (padres) de los chunks hijos: data/processed/parents.parquet
+PARENT_SCHEMA = pa.schema([
+    ("doc_id", pa.string()),
+    ("title", pa.string()),
+    ("page", pa.int64()),
+    ("section", pa.string()),
+    ("text", pa.string()),
+    ("n_tokens", pa.int64()),
+    ("parent_id", pa.int64()),
+])
 
 def clean_text(text: str) -> str:
-    text = text.replace("\x0c", " ") 
+    text = text.replace("\x0c", " ")
     text = re.sub(r"\s+", " ", text)
     return text.strip()
 
@@ -20,47 +57,248 @@ def chunk_text(text: str, chunk_size=CHUNK_SIZE, overlap=OVERLAP):
         if end == len(words):
             break
         start = end - overlap
-def pdf_to_chunks(path: Path, doc_id: str, title: str):
+def text_to_chunks(raw: str, doc_id: str, title: str, page=None, chunker="structure", title_heading=None):
+    """
+    Chunks de un texto extraído (con sus saltos de línea). Devuelve (chunks, padres, Título vigente);
+    con chunker="window" no hay padres.
+    """
+    if chunker == "structure":
+        return structure_chunks(raw, doc_id, title, page, title_heading)
+    text = clean_text(raw)
+    chunks = [{"doc_id": doc_id, "title": title, "page": page, "text": chunk, "section": None, "parent_id": None}
+              for chunk in chunk_text(text)] if text else []
+    return chunks, [], title_heading
+
+def pdf_pages_to_chunks(path: Path, doc_id: str, title: str, first_page=1, last_page=None, chunker="structure"):
+    """Chunks y padres de las páginas first_page..last_page (1-indexadas, inclusive) de un PDF."""
     reader = PdfReader(str(path))
-    chunks = []
-    for page_num, page in enumerate(reader.pages, start=1):
-        text = clean_text(page.extract_text() or "")
-        if not text:
-            continue
-        for chunk in chunk_text(text):
-            chunks.append({
-                "doc_id": doc_id,
-                "title": title,
-                "page": page_num,
-                "text": chunk
-            })
-    return chunks
-
-def txt_to_chunks(path: Path, doc_id: str, title: str):
-    text = clean_text(path.read_text(encoding="utf-8"))
-    chunks = []
-    for chunk in chunk_text(text):
-        chunks.append({
-            "doc_id": doc_id,
-            "title": title,
-            "page": None,
-            "text": chunk
-        })
-    return chunks
-
-def ingest_raw(raw_dir="data/raw", out_parquet="data/processed/chunks.parquet"):
+    pages = reader.pages
+    last_page = min(last_page or len(pages), len(pages))
+    chunks, parents = [], []
+    title_heading = None  # el Título vigente pasa de una página a la siguiente
+    for page_num in range(first_page, last_page + 1):
+        raw = pages[page_num - 1].extract_text() or ""
+        page_chunks, page_parents, title_heading = text_to_chunks(raw, doc_id, title, page_num, chunker, title_heading)
+        chunks.extend(page_chunks)
+        parents.extend(page_parents)
+    return chunks, parents
+
+def pdf_to_chunks(path: Path, doc_id: str, title: str, chunker="structure"):
+    return pdf_pages_to_chunks(path, doc_id, title, chunker=chunker)
+
+def txt_to_chunks(path: Path, doc_id: str, title: str, chunker="structure"):
+    chunks, parents, _ = text_to_chunks(path.read_text(encoding="utf-8"), doc_id, title, None, chunker)
+    return chunks, parents
+
+def file_hash(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def assign_chunk_ids(rows):
+    """
+    Agrega text_hash y chunk_id (int64 estable) a cada chunk. El ID depende del documento,
+    la página y el contenido, así un chunk que no cambia conserva su ID entre ingestas
+    y su vector puede reutilizarse en el índice.
+    """
+    seen = {}
+    for row in rows:
+        th = text_hash(row["text"])
+        page = row.get("page")
+        page = None if page is None or pd.isna(page) else int(page)
+        key = (row["doc_id"], page, th)
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        digest = hashlib.blake2b(f"{row['doc_id']}|{page}|{th}|{occurrence}".encode("utf-8"), digest_size=8).digest()
+        row["text_hash"] = th
+        row["chunk_id"] = int.from_bytes(digest, "big") & 0x7FFFFFFFFFFFFFFF
+    return rows
+
+def load_manifest(path=MANIFEST_PATH) -> dict:
+    p = Path(path)
+    if not p.exists():
+        return {"files": {}}
+    return json.loads(p.read_text(encoding="utf-8"))
+
+def save_manifest(manifest: dict, path=MANIFEST_PATH):
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(p)
+
+def _run_task(task):
+    """Tarea de extracción (se ejecuta en un proceso del pool): devuelve (chunks con sus IDs, padres)."""
+    kind, path, doc_id, title, first_page, last_page, chunker = task
+    if kind == "pdf":
+        rows, parents = pdf_pages_to_chunks(Path(path), doc_id, title, first_page, last_page, chunker)
+    else:
+        rows, parents = txt_to_chunks(Path(path), doc_id, title, chunker)
+    return assign_chunk_ids(rows), parents
+
+def file_tasks(f: Path, pages_per_task=PAGES_PER_TASK, chunker="structure"):
+    """
+    Divide un archivo en tareas de extracción por rangos de páginas. Con chunker="structure"
+    cada PDF es una sola tarea: el Título vigente pasa de una página a la siguiente y cambia el
+    texto (y por lo tanto chunk_id y parent_id) de los fragmentos, que así no dependen de
+    pages_per_task. El paralelismo queda entre documentos.
+    """
+    if f.suffix.lower() == ".pdf":
+        n_pages = len(PdfReader(str(f)).pages)
+        if chunker == "structure":
+            pages_per_task = max(n_pages, 1)
+        for first in range(1, n_pages + 1, pages_per_task):
+            yield ("pdf", str(f), f.stem, f.stem, first, min(first + pages_per_task - 1, n_pages), chunker)
+    elif f.suffix.lower() == ".txt":
+        yield ("txt", str(f), f.stem, f.stem, None, None, chunker)
+
+def iter_chunk_batches(tasks, workers=1):
+    """
+    Ejecuta las tareas y entrega sus chunks en orden, a medida que terminan.
+    Con workers > 1 usa un ProcessPoolExecutor con una ventana acotada de tareas en vuelo,
+    así la memoria no crece con el tamaño del corpus.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield _run_task(task)
+        return
+    window = workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(_run_task, task))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+class ChunkWriter:
+    """Escribe chunks (o padres) a Parquet en row groups de batch_rows filas (sin DataFrame completo en memoria)."""
+
+    def __init__(self, path, batch_rows=BATCH_ROWS, schema=CHUNK_SCHEMA):
+        self.path = path
+        self.batch_rows = batch_rows
+        self.schema = schema
+        self.writer = pq.ParquetWriter(str(path), schema)
+        self.buffer = []
+        self.count = 0
+        self.per_doc = {}
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.per_doc[row["doc_id"]] = self.per_doc.get(row["doc_id"], 0) + 1
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.batch_rows:
+            self.flush()
+
+    def write_batch(self, batch: pa.RecordBatch):
+        """Copia un RecordBatch existente (chunks reutilizados de la ingesta anterior)."""
+        if batch.num_rows == 0:
+            return
+        table = pa.Table.from_batches([batch]).select(self.schema.names).cast(self.schema)
+        for doc_id in table.column("doc_id").to_pylist():
+            self.per_doc[doc_id] = self.per_doc.get(doc_id, 0) + 1
+        self.flush()
+        self.writer.write_table(table)
+        self.count += table.num_rows
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.writer.write_table(pa.Table.from_pylist(self.buffer, schema=self.schema))
+        self.count += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+def ingest_raw(raw_dir="data/raw", out_parquet="data/processed/chunks.parquet",
+               incremental=True, manifest_path=MANIFEST_PATH, workers=1,
+               batch_rows=BATCH_ROWS, pages_per_task=PAGES_PER_TASK, chunker="structure"):
+    """
+    Procesa data/raw y escribe data/processed/chunks.parquet (y parents.parquet con las
+    secciones completas si chunker="structure", ver rag/chunking.py).
+
+    En modo incremental solo se vuelven a extraer los archivos cuyo hash de contenido cambió
+    respecto del manifiesto; los chunks del resto se copian desde el parquet anterior.
+    La extracción se reparte en `workers` procesos (0 = todos los núcleos), por documento con
+    chunker="structure" y por rangos de páginas con "window", y los chunks se escriben en streaming, por row groups, a un archivo temporal que luego
+    reemplaza al parquet de salida. Cambiar de chunker reprocesa todos los archivos.
+    """
     raw_path = Path(raw_dir)
-    rows = []
-    for f in raw_path.iterdir():
-        if f.suffix.lower() == ".pdf":
-            rows.extend(pdf_to_chunks(f, f.stem, f.stem))
-        elif f.suffix.lower() == ".txt":
-            rows.extend(txt_to_chunks(f, f.stem, f.stem))
-    df = pd.DataFrame(rows)
-    Path(out_parquet).parent.mkdir(parents=True, exist_ok=True)
-    df.to_parquet(out_parquet, index=False)
-    print(f"Procesados {len(df)} chunks de {len(list(raw_path.iterdir()))} archivos")
-    return df
+    out_path = Path(out_parquet)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+
+    parents_out = parents_path(out_path)
+
+    manifest = load_manifest(manifest_path) if incremental else {"files": {}}
+    old_file = old_parents = None
+    if incremental and out_path.exists() and manifest.get("chunker", "window") == chunker:
+        old_file = pq.ParquetFile(str(out_path))
+        if "parent_id" not in old_file.schema_arrow.names:
+            old_file = None  # parquet de una versión anterior: reprocesar todo
+        elif parents_out.exists():
+            old_parents = pq.ParquetFile(str(parents_out))
+
+    files = {}
+    changed, unchanged = [], []
+    for f in sorted(raw_path.iterdir()):
+        if f.suffix.lower() not in (".pdf", ".txt"):
+            continue
+        sha = file_hash(f)
+        prev = manifest["files"].get(f.name)
+        files[f.name] = {"sha256": sha, "doc_id": f.stem}
+        if old_file is not None and prev and prev["sha256"] == sha:
+            unchanged.append(prev["doc_id"])
+        else:
+            changed.append(f)
+
+    tmp_path = out_path.with_suffix(".parquet.tmp")
+    tmp_parents = parents_out.with_suffix(".parquet.tmp")
+    writer = ChunkWriter(tmp_path, batch_rows=batch_rows)
+    parent_writer = ChunkWriter(tmp_parents, batch_rows=batch_rows, schema=PARENT_SCHEMA)
+    try:
+        # Chunks (y padres) reutilizados, leídos por lotes desde los parquet anteriores
+        if unchanged:
+            keep = pa.array(unchanged)
+            for old, w in ((old_file, writer), (old_parents, parent_writer)):
+                if old is None:
+                    continue
+                for batch in old.iter_batches(batch_size=batch_rows):
+                    mask = pc.is_in(batch.column("doc_id"), value_set=keep)
+                    w.write_batch(batch.filter(mask))
+
+        # Archivos nuevos o modificados
+        tasks = (task for f in changed for task in file_tasks(f, pages_per_task, chunker))
+        for rows, parents in iter_chunk_batches(tasks, workers=workers):
+            writer.write_rows(rows)
+            parent_writer.write_rows(parents)
+    finally:
+        writer.close()
+        parent_writer.close()
+    os.replace(tmp_path, out_path)
+    if parent_writer.count:
+        os.replace(tmp_parents, parents_out)
+    else:
+        os.remove(tmp_parents)
+        if parents_out.exists():
+            os.remove(parents_out)
+
+    for info in files.values():
+        info["n_chunks"] = writer.per_doc.get(info["doc_id"], 0)
+        info["n_parents"] = parent_writer.per_doc.get(info["doc_id"], 0)
+    save_manifest({"chunker": chunker, "files": files}, manifest_path)
+    removed = len(set(manifest["files"]) - set(files))
+    print(f"Procesados {writer.count} chunks ({parent_writer.count} secciones padre) de {len(files)} archivos "
+          f"({len(changed)} extraídos, {len(unchanged)} sin cambios, {removed} eliminados, {workers} procesos)")
+    return writer.count
 
 if __name__ == "__main__":
-    ingest_raw()
\ No newline at end of file
+    ingest_raw()
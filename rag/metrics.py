@@ -0,0 +1,72 @@
+"""
+Métricas Prometheus del camino RAG (se exponen en /metrics de web.py y web_async.py).
+
+Con varios workers de gunicorn, definir PROMETHEUS_MULTIPROC_DIR (directorio vacío) para que
+/metrics agregue los valores de todos los procesos.
+Sin prometheus_client instalado las métricas son no-ops y /metrics responde vacío.
+"""
+import os
+
+try:
+    from prometheus_client import (Counter, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST,
+                                   generate_latest, multiprocess)
+    PROMETHEUS = True
+except ImportError:  # pragma: no cover
+    PROMETHEUS = False
+    CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# Etapas medidas por request: ver rag/tracing.py
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _NoOp:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, *args, **kwargs):
+        pass
+
+    def observe(self, *args, **kwargs):
+        pass
+
+
+if PROMETHEUS:
+    STAGE_SECONDS = Histogram("rag_stage_seconds", "Duración de cada etapa del camino RAG",
+                              ["stage", "provider"], buckets=BUCKETS)
+    REQUESTS = Counter("rag_requests_total", "Consultas procesadas", ["provider", "status"])
+    TOKENS = Counter("rag_tokens_total", "Tokens enviados y generados por el LLM", ["provider", "kind"])
+    CACHE_LOOKUPS = Counter("rag_answer_cache_lookups_total", "Búsquedas en la caché de respuestas", ["provider"])
+    CACHE_HITS = Counter("rag_answer_cache_hits_total", "Respuestas servidas desde caché", ["provider"])
+    RETRIES = Counter("rag_llm_retries_total", "Reintentos de llamadas al LLM", ["provider"])
+    ABSTENTIONS = Counter("rag_abstentions_total", "Respuestas con política de abstención", ["provider"])
+    COALESCED = Counter("rag_coalesced_total", "Peticiones servidas por una ejecución idéntica en vuelo",
+                        ["provider"])
+    REJECTED = Counter("rag_rejected_total", "Peticiones rechazadas por el control de admisión",
+                       ["provider", "reason"])
+else:
+    STAGE_SECONDS = REQUESTS = TOKENS = CACHE_LOOKUPS = CACHE_HITS = RETRIES = ABSTENTIONS = _NoOp()
+    COALESCED = REJECTED = _NoOp()
+
+
+def count_tokens(provider, prompt=None, completion=None):
+    if prompt:
+        TOKENS.labels(provider, "prompt").inc(prompt)
+    if completion:
+        TOKENS.labels(provider, "completion").inc(completion)
+
+
+def render():
+    """(cuerpo, content-type) para la respuesta de /metrics."""
+    if not PROMETHEUS:
+        return b"", CONTENT_TYPE_LATEST
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid):
+    """Hook child_exit de gunicorn en modo multiproceso."""
+    if PROMETHEUS and os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
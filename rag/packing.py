@@ -0,0 +1,175 @@
+import os
+import re
+import logging
+from functools import lru_cache
+
+from rag.bm25 import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Presupuesto de tokens para los fragmentos del prompt, por proveedor (se puede cambiar con
+# CONTEXT_BUDGET_<PROVEEDOR>, p. ej. CONTEXT_BUDGET_DEEPSEEK=1200)
+CONTEXT_BUDGETS = {
+    "chatgpt": 2500,    # gpt-4.1-mini: contexto de 1M tokens, prompts largos sin penalizar la latencia
+    "deepseek": 1500,   # deepseek-chat: contexto de 64K y la latencia crece más con el prompt
+}
+DEFAULT_BUDGET = 1500
+
+SENTENCE_RE = re.compile(r"(?<=[.;:!?])\s+")
+MIN_OVERLAP_WORDS = 15
+MAX_OVERLAP_WORDS = 200
+DUPLICATE_JACCARD = 0.8
+
+
+def context_budget(provider) -> int:
+    """
+    Presupuesto de contexto de un proveedor: CONTEXT_BUDGET_<NOMBRE> o CONTEXT_BUDGETS.
+    Para RouterProvider, el menor de sus backends: el prompt se arma antes de saber cuál responde.
+    """
+    name = provider.name
+    var = f"CONTEXT_BUDGET_{name.upper()}"
+    value = (os.getenv(var) or "").strip()
+    if value:
+        try:
+            budget = int(value)
+        except ValueError:
+            budget = 0
+        if budget > 0:
+            return budget
+        logger.warning(f"{var}={value!r} no es un entero positivo; se usa el presupuesto por defecto.")
+    backends = getattr(provider, "backends", None)
+    if backends:
+        return min(context_budget(b.provider) for b in backends)
+    return CONTEXT_BUDGETS.get(name, DEFAULT_BUDGET)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:  # sin tiktoken o sin el archivo BPE en caché
+        logger.warning(f"tiktoken no disponible ({e}); se estiman tokens por caracteres.")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Tokens de un texto con el tokenizador local (o200k_base); aproximación len/4 si no está."""
+    enc = _encoding()
+    if enc is None:
+        return (len(text) + 3) // 4
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def snippet_label(hit) -> str:
+    return f"[{hit['title']}, p{hit.get('page')}]"
+
+
+def format_snippets(snippets) -> str:
+    return "\n\n".join(f"{s['label']} {s['text']}" for s in snippets)
+
+
+def _merge_overlap(a: str, b: str):
+    """Si el final de `a` coincide con el inicio de `b` (ventanas solapadas), devuelve el texto unido."""
+    aw, bw = a.split(), b.split()
+    for k in range(min(len(aw), len(bw), MAX_OVERLAP_WORDS), MIN_OVERLAP_WORDS - 1, -1):
+        if aw[-k:] == bw[:k]:
+            return " ".join(aw + bw[k:])
+    return None
+
+
+def _shingles(text: str, n=3):
+    words = text.lower().split()
+    return {tuple(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))}
+
+
+def merge_neighbours(snippets):
+    """Une fragmentos del mismo documento/página que se solapan o que están contenidos en otro."""
+    merged = []
+    for snip in snippets:
+        for other in merged:
+            if (other["doc_id"], other["page"]) != (snip["doc_id"], snip["page"]):
+                continue
+            if snip["text"] in other["text"]:
+                text = other["text"]
+            elif other["text"] in snip["text"]:
+                text = snip["text"]
+            else:
+                text = _merge_overlap(other["text"], snip["text"]) or _merge_overlap(snip["text"], other["text"])
+            if text is not None:
+                other["text"] = text
+                other["score"] = max(other["score"], snip["score"])
+                break
+        else:
+            merged.append(dict(snip))
+    return merged
+
+
+def drop_near_duplicates(snippets, threshold=DUPLICATE_JACCARD):
+    """Descarta fragmentos casi idénticos (Jaccard de 3-gramas de palabras) a uno de mayor puntaje."""
+    kept = []
+    for snip in sorted(snippets, key=lambda s: -s["score"]):
+        sh = _shingles(snip["text"])
+        if any(len(sh & k["_sh"]) / max(len(sh | k["_sh"]), 1) >= threshold for k in kept):
+            continue
+        snip["_sh"] = sh
+        kept.append(snip)
+    order = {id(s): i for i, s in enumerate(snippets)}
+    kept.sort(key=lambda s: order[id(s)])
+    for snip in kept:
+        del snip["_sh"]
+    return kept
+
+
+def trim_to_budget(query: str, snippets, budget: int):
+    """
+    Si los fragmentos exceden `budget` tokens, conserva las oraciones de mayor puntaje
+    (puntaje del fragmento + solapamiento léxico con la pregunta) en su orden original.
+    """
+    if budget is None or count_tokens(format_snippets(snippets)) <= budget:
+        return snippets
+
+    q_terms = set(tokenize(query))
+    max_score = max((s["score"] for s in snippets), default=1.0) or 1.0
+    sentences = []
+    for si, snip in enumerate(snippets):
+        label_cost = count_tokens(snip["label"]) + 2
+        for pi, sent in enumerate(SENTENCE_RE.split(snip["text"])):
+            terms = set(tokenize(sent))
+            overlap = len(terms & q_terms) / max(len(q_terms), 1)
+            score = 0.5 * snip["score"] / max_score + overlap
+            sentences.append((score, si, pi, sent, count_tokens(sent) + 1, label_cost))
+
+    chosen = {}
+    used = 0
+    for score, si, pi, sent, cost, label_cost in sorted(sentences, key=lambda x: -x[0]):
+        extra = cost + (label_cost if si not in chosen else 0)
+        if used + extra > budget:
+            continue
+        chosen.setdefault(si, []).append((pi, sent))
+        used += extra
+
+    packed = []
+    for si in sorted(chosen):
+        snip = dict(snippets[si])
+        snip["text"] = " ".join(sent for _, sent in sorted(chosen[si]))
+        packed.append(snip)
+    return packed
+
+
+def pack_context(query: str, hits, budget=DEFAULT_BUDGET):
+    """
+    Empaqueta los hits para el prompt: une vecinos solapados, quita casi-duplicados y recorta
+    al presupuesto de tokens. Devuelve (fragmentos sin empaquetar, fragmentos empaquetados),
+    ambos ya formateados como texto para USER_PROMPT_TEMPLATE.
+    """
+    snippets = [{
+        "label": snippet_label(h),
+        "doc_id": h.get("doc_id"),
+        "page": h.get("page"),
+        "text": h["text"],
+        "score": float(h.get("score", 0.0)),
+    } for h in hits]
+    packed = trim_to_budget(query, drop_near_duplicates(merge_neighbours(snippets)), budget)
+    logger.info(f"Contexto empaquetado: {len(snippets)} -> {len(packed)} fragmentos.")
+    return format_snippets(snippets), format_snippets(packed)
@@ -1,18 +1,72 @@
 from rag.retrieve import Retriever
+import os
 import time
+import asyncio
 import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from rag.prompts import SYSTEM_PROMPT, USER_PROMPT_TEMPLATE
+from rag.packing import context_budget as provider_budget, count_tokens, pack_context
+from rag import metrics
+from rag.tracing import Trace
 import re
 
 # Configura logging simple
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
+CITATION_RE = re.compile(r"\[([^\]]+)\]")
+ABSTENTION_MSG = "No encontrado en normativa UFRO. Sugiero consultar a la oficina correspondiente."
+
+_retrieval_executor = None
+
+
+def retrieval_executor() -> ThreadPoolExecutor:
+    """Pool de hilos compartido para la recuperación en el modo asyncio (RETRIEVAL_THREADS)."""
+    global _retrieval_executor
+    if _retrieval_executor is None:
+        _retrieval_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("RETRIEVAL_THREADS", "4")),
+            thread_name_prefix="retrieval"
+        )
+    return _retrieval_executor
+
+
+class CitationTracker:
+    """
+    Extrae citas [..] de forma incremental a medida que llegan los tokens.
+    Mantiene en buffer solo el texto desde el primer corchete sin cerrar.
+    """
+
+    def __init__(self):
+        self.buf = ""
+
+    def feed(self, text: str):
+        self.buf += text
+        found = []
+        end = 0
+        for m in CITATION_RE.finditer(self.buf):
+            found.append(m.group(1))
+            end = m.end()
+        rest = self.buf[end:]
+        i = rest.find("[")
+        self.buf = rest[i:] if i >= 0 else ""
+        return found
+
+
 class RAGPipeline:
-    def __init__(self, retriever: Retriever, provider):
+    def __init__(self, retriever: Retriever, provider, answer_cache=None, context_budget=None, pack=True,
+                 reranker=None):
         self.retriever = retriever
         self.provider = provider
-        self.max_retries = 3
+        self.answer_cache = answer_cache
+        # Reranking con cross-encoder (rag/rerank.py): sobre-recupera y envía menos fragmentos
+        self.reranker = reranker
+        # Presupuesto de tokens para los fragmentos (por defecto, el del proveedor)
+        self.context_budget = context_budget or provider_budget(provider)
+        self.pack = pack
+        # Un proveedor con reintentos propios (RouterProvider) se llama una sola vez
+        self.max_retries = 1 if getattr(provider, "handles_retries", False) else 3
         self.retry_wait = 2  # segundos
 
     def rewrite_query(self, query: str) -> str:
@@ -32,74 +86,200 @@ class RAGPipeline:
                 if attempt == self.max_retries:
                     logger.error(f"Máximo de reintentos alcanzado, abortando con error: {e}")
                     raise
+                metrics.RETRIES.labels(self.provider.name).inc()
                 time.sleep(self.retry_wait)
 
-    def synthesize(self, query: str, top_k=4, max_tokens=512, temperature=0.0, with_usage=False):
-        start_total = time.time()
-        q_rewritten = self.rewrite_query(query)
+    def _stream_with_retries(self, messages, **kwargs):
+        """
+        Igual que _call_provider_with_retries pero para streaming: solo se reintenta
+        si el error ocurre antes del primer token (después ya se envió texto al cliente).
+        """
+        for attempt in range(1, self.max_retries + 1):
+            started = False
+            try:
+                logger.info(f"Llamada al proveedor (stream), intento {attempt}")
+                for delta in self.provider.chat_stream(messages, **kwargs):
+                    started = True
+                    yield delta
+                return
+            except Exception as e:
+                logger.warning(f"Error en intento {attempt}: {e}")
+                if started or attempt == self.max_retries:
+                    logger.error(f"Abortando stream con error: {e}")
+                    raise
+                metrics.RETRIES.labels(self.provider.name).inc()
+                time.sleep(self.retry_wait)
+
+    @staticmethod
+    def _messages(query: str, snippets: str):
+        user_prompt = USER_PROMPT_TEMPLATE.format(question=query, snippets=snippets)
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    @staticmethod
+    def _prompt_tokens(messages) -> int:
+        return sum(count_tokens(m["content"]) for m in messages)
+
+    def pack_messages(self, query: str, hits):
+        """
+        Construye el prompt con el contexto empaquetado (rag/packing.py) y devuelve
+        (messages, stats) con los tokens del prompt antes y después de empaquetar.
+        """
+        if not self.pack:
+            messages = self._messages(query, "\n\n".join(
+                f"[{h['title']}, p{h.get('page')}] {h['text']}" for h in hits
+            ))
+            tokens = self._prompt_tokens(messages)
+            return messages, {"prompt_tokens_raw": tokens, "prompt_tokens_packed": tokens}
+
+        raw, packed = pack_context(query, hits, self.context_budget)
+        messages = self._messages(query, packed)
+        return messages, {
+            "prompt_tokens_raw": self._prompt_tokens(self._messages(query, raw)),
+            "prompt_tokens_packed": self._prompt_tokens(messages),
+        }
+
+    def build_messages(self, query: str, hits):
+        return self.pack_messages(query, hits)[0]
+
+    def _cache_context(self, hits, **params):
+        return self.answer_cache.make_context(
+            provider=self.provider.name,
+            model=getattr(self.provider, "model", None),
+            chunk_ids=[h.get("chunk_id") for h in hits],
+            context_budget=self.context_budget if self.pack else None,
+            **params
+        )
+
+    def _cache_lookup(self, query, q_rewritten, cache_ctx):
+        """Devuelve (resultado cacheado o None, embedding de la consulta para el modo semántico)."""
+        q_emb = None
+        if self.answer_cache.semantic:
+            q_emb = self.retriever.encode([q_rewritten])[0]
+        return self.answer_cache.get(query, cache_ctx, q_emb), q_emb
 
-        # Recuperación
+    def retrieval_depth(self, top_k):
+        """(fragmentos a pedir al retriever, si expandir a secciones padre): con reranking, candidatos sin expandir."""
+        if self.reranker is None:
+            return top_k, True
+        return max(self.reranker.candidates, top_k), False
+
+    def _retrieve(self, query: str, top_k, mode=None, trace=None, filters=None):
+        """Devuelve (consulta reescrita, fragmentos, latencia de recuperación, stats del reranking)."""
+        q_rewritten = self.rewrite_query(query)
+        timings = {}
+        depth, expand = self.retrieval_depth(top_k)
         start_retrieve = time.time()
-        hits = self.retriever.query(q_rewritten, top_k=top_k)
+        hits = self.retriever.query(q_rewritten, top_k=depth, mode=mode, timings=timings, filters=filters,
+                                    expand=expand)
         latency_retrieve = time.time() - start_retrieve
+        if trace is not None:
+            trace.add_timings(timings)
+            trace.add("retrieve", latency_retrieve)
+            trace.set(hits=len(hits))
+            if filters:
+                trace.set(filters=filters)
         logger.info(f"Recuperación completada en {latency_retrieve:.2f}s, {len(hits)} fragmentos obtenidos.")
+        rerank_stats = {}
+        if self.reranker is not None:
+            hits, rerank_stats = self._rerank(q_rewritten, hits, top_k, trace)
+        return q_rewritten, hits, latency_retrieve, rerank_stats
 
-        snippets = "\n\n".join([
-            f"[{h['title']}, p{h.get('page')}] {h['text']}" for h in hits
-        ])
+    def _select(self, hits, n):
+        """Los primeros n resultados, expandidos a su sección padre si el índice las tiene."""
+        if self.retriever.parents is not None:
+            return self.retriever.expand_parents(hits, n)
+        return hits[:n]
 
-        user_prompt = USER_PROMPT_TEMPLATE.format(question=query, snippets=snippets)
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": user_prompt}
-        ]
+    @staticmethod
+    def _context_tokens(hits) -> int:
+        return sum(count_tokens(f"[{h['title']}, p{h.get('page')}] {h['text']}") for h in hits)
 
-        # Llamada al LLM con manejo de errores y reintentos
-        start_llm = time.time()
-        if with_usage and hasattr(self.provider, "chat_with_usage"):
-            call_func = self.provider.chat_with_usage
+    def _rerank(self, query, candidates, top_k, trace=None):
+        """
+        Reordena los candidatos con el cross-encoder y se queda con min(top_k, top_n). Si se agota
+        el presupuesto de tiempo, usa los top_k del bi-encoder (lo mismo que sin reranking).
+        prompt_tokens_saved: tokens de los fragmentos elegidos (antes de expandir a secciones
+        padre) ahorrados frente a esos top_k; se calcula sobre los candidatos, sin expandir la
+        selección del bi-encoder que no se usa.
+        """
+        start = time.time()
+        ranked = self.reranker.rerank(query, candidates)
+        latency_rerank = time.time() - start
+        if ranked is None:
+            hits, saved = self._select(candidates, top_k), 0
         else:
-            call_func = self.provider.chat
+            n = min(top_k, self.reranker.top_n)
+            hits = self._select(ranked, n)
+            saved = self._context_tokens(candidates[:top_k]) - self._context_tokens(ranked[:n])
+        stats = {
+            "latency_rerank": latency_rerank,
+            "rerank_candidates": len(candidates),
+            "rerank_fallback": ranked is None,
+            "prompt_tokens_saved": saved,
+        }
+        if trace is not None:
+            trace.add("rerank", latency_rerank)
+            trace.set(hits=len(hits))
+        logger.info(f"Reranking en {latency_rerank:.2f}s: {len(candidates)} candidatos -> {len(hits)} fragmentos"
+                    f"{' (fuera de presupuesto, orden del bi-encoder)' if ranked is None else ''}.")
+        return hits, stats
 
-        response = self._call_provider_with_retries(
-            call_func, messages, max_tokens=max_tokens, temperature=temperature
-        )
+    def _check_cache(self, query, q_rewritten, hits, **params):
+        """Devuelve (resultado cacheado o None, contexto de caché, embedding de la consulta)."""
+        if self.answer_cache is None:
+            return None, None, None
+        cache_ctx = self._cache_context(hits, **params)
+        cached, q_emb = self._cache_lookup(query, q_rewritten, cache_ctx)
+        metrics.CACHE_LOOKUPS.labels(self.provider.name).inc()
+        if cached is not None:
+            metrics.CACHE_HITS.labels(self.provider.name).inc()
+        return cached, cache_ctx, q_emb
 
-        latency_llm = time.time() - start_llm
+    def _cached_result(self, cached, hits, latency_retrieve, start_total):
         total_latency = time.time() - start_total
-        logger.info(f"Llamada LLM completada en {latency_llm:.2f}s, latencia total {total_latency:.2f}s.")
+        logger.info(f"Respuesta servida desde caché, latencia total {total_latency:.2f}s.")
+        result = dict(cached)
+        result.update({
+            "hits": hits,
+            "latency_retrieve": latency_retrieve,
+            "latency_llm": 0.0,
+            "latency_total": total_latency,
+            "tokens_prompt": 0,
+            "tokens_completion": 0,
+            "tokens_total": 0,
+            "prompt_tokens_raw": 0,
+            "prompt_tokens_packed": 0,
+            "cache_hit": True,
+        })
+        return result
 
-        # Procesar respuesta y citas
-        if with_usage and isinstance(response, dict):
+    def _finalize(self, query, hits, response, with_usage, latency_retrieve, latency_llm, total_latency,
+                  cache_ctx=None, q_emb=None, pack_stats=None):
+        """Procesa la respuesta del LLM: citas, tokens, abstención y escritura en caché."""
+        if isinstance(response, dict):
             answer = response.get("text", "")
             usage = response.get("usage")
         else:
             answer = response
             usage = None
 
-        citations = re.findall(r"\[([^\]]+)\]", answer)
+        citations = CITATION_RE.findall(answer)
 
         tokens_prompt = getattr(usage, "prompt_tokens", None) if usage else None
         tokens_completion = getattr(usage, "completion_tokens", None) if usage else None
         tokens_total = getattr(usage, "total_tokens", None) if usage else None
 
         # Abstención simple si no hay fragmentos o citas (puedes ajustar la política)
-        if not hits or (not citations and with_usage):
-            abstention_msg = "No encontrado en normativa UFRO. Sugiero consultar a la oficina correspondiente."
+        abstained = not hits or (not citations and with_usage)
+        if abstained:
             logger.warning(f"Aplicando política de abstención para consulta: {query}")
-            return {
-                "answer": abstention_msg,
-                "citations": [],
-                "hits": hits,
-                "latency_retrieve": latency_retrieve,
-                "latency_llm": latency_llm,
-                "latency_total": total_latency,
-                "tokens_prompt": tokens_prompt,
-                "tokens_completion": tokens_completion,
-                "tokens_total": tokens_total,
-            }
-
-        return {
+            answer = ABSTENTION_MSG
+            citations = []
+
+        result = {
             "answer": answer,
             "citations": citations,
             "hits": hits,
@@ -109,4 +289,306 @@ class RAGPipeline:
             "tokens_prompt": tokens_prompt,
             "tokens_completion": tokens_completion,
             "tokens_total": tokens_total,
-        }
\ No newline at end of file
+            "cache_hit": False,
+            "abstained": abstained,
+        }
+        if isinstance(response, dict) and response.get("backend"):
+            result["backend"] = response["backend"]
+        result.update(pack_stats or {})
+
+        if self.answer_cache is not None:
+            self.answer_cache.put(query, cache_ctx, {
+                "answer": answer,
+                "citations": citations,
+            }, q_emb)
+
+        return result
+
+    def _record(self, trace, result):
+        """Vuelca en la traza y en los contadores de /metrics el resultado de una consulta."""
+        name = self.provider.name
+        if result.get("abstained"):
+            metrics.ABSTENTIONS.labels(name).inc()
+        if not result.get("cache_hit"):
+            metrics.count_tokens(name, result.get("tokens_prompt"), result.get("tokens_completion"))
+        trace.set(**{k: result.get(k) for k in (
+            "cache_hit", "abstained", "backend", "tokens_prompt", "tokens_completion",
+            "prompt_tokens_raw", "prompt_tokens_packed", "prompt_tokens_saved", "rerank_fallback"
+        ) if result.get(k) is not None})
+        trace.finish()
+        return result
+
+    def synthesize(self, query: str, top_k=4, max_tokens=512, temperature=0.0, with_usage=False, mode=None,
+                   filters=None):
+        """
+        Recupera, consulta la caché y llama al LLM. Cada llamada deja una traza con los tiempos
+        por etapa (rag/tracing.py) que alimenta las métricas de /metrics.
+        filters: filtros de metadatos de la recuperación (doc_id, title, page, year; ver rag/shards.py).
+        """
+        trace = Trace("synthesize", self.provider.name, query)
+        try:
+            result = self._synthesize(query, top_k, max_tokens, temperature, with_usage, mode, filters, trace)
+        except Exception:
+            trace.finish(status="error")
+            raise
+        return self._record(trace, result)
+
+    def _synthesize(self, query, top_k, max_tokens, temperature, with_usage, mode, filters, trace):
+        start_total = time.time()
+
+        # Recuperación (y reranking, si está activo)
+        q_rewritten, hits, latency_retrieve, rerank_stats = self._retrieve(query, top_k, mode, trace, filters)
+        result = self._generate(query, q_rewritten, hits, latency_retrieve, start_total,
+                                top_k, max_tokens, temperature, with_usage, trace)
+        result.update(rerank_stats)
+        return result
+
+    def synthesize_hits(self, query: str, hits, top_k=4, max_tokens=512, temperature=0.0, with_usage=False,
+                        latency_retrieve=0.0, before_llm=None):
+        """
+        Como synthesize, pero con fragmentos ya recuperados (p. ej. con Retriever.query_batch
+        para muchas preguntas a la vez). Con reranking, `hits` son los candidatos recuperados según
+        retrieval_depth(top_k). before_llm(pack_stats), si se indica, se llama justo antes de la
+        llamada al LLM (con los tokens del prompt), p. ej. para un límite de tokens.
+        """
+        trace = Trace("synthesize", self.provider.name, query)
+        trace.add("retrieve", latency_retrieve)
+        try:
+            start_total = time.time()
+            q_rewritten = self.rewrite_query(query)
+            rerank_stats = {}
+            if self.reranker is not None:
+                hits, rerank_stats = self._rerank(q_rewritten, hits, top_k, trace)
+            result = self._generate(query, q_rewritten, hits, latency_retrieve, start_total,
+                                    top_k, max_tokens, temperature, with_usage, trace, before_llm)
+            result.update(rerank_stats)
+        except Exception:
+            trace.finish(status="error")
+            raise
+        return self._record(trace, result)
+
+    def _generate(self, query, q_rewritten, hits, latency_retrieve, start_total, top_k, max_tokens, temperature,
+                  with_usage, trace, before_llm=None):
+        """Caché de respuestas, empaquetado del prompt y llamada al LLM para fragmentos ya recuperados."""
+        # Caché de respuestas (exacta o semántica) antes de llamar al LLM
+        cached, cache_ctx, q_emb = self._check_cache(
+            query, q_rewritten, hits,
+            top_k=top_k, temperature=temperature, max_tokens=max_tokens, with_usage=with_usage
+        )
+        if cached is not None:
+            return self._cached_result(cached, hits, latency_retrieve, start_total)
+
+        with trace.span("prompt_build"):
+            messages, pack_stats = self.pack_messages(query, hits)
+        if before_llm is not None:
+            before_llm(pack_stats)
+
+        # Llamada al LLM con manejo de errores y reintentos (con uso de tokens si el proveedor lo da)
+        start_llm = time.time()
+        if hasattr(self.provider, "chat_with_usage"):
+            call_func = self.provider.chat_with_usage
+        else:
+            call_func = self.provider.chat
+
+        response = self._call_provider_with_retries(
+            call_func, messages, max_tokens=max_tokens, temperature=temperature
+        )
+
+        latency_llm = time.time() - start_llm
+        trace.add("llm_total", latency_llm)
+        total_latency = time.time() - start_total
+        logger.info(f"Llamada LLM completada en {latency_llm:.2f}s, latencia total {total_latency:.2f}s.")
+
+        return self._finalize(query, hits, response, with_usage, latency_retrieve, latency_llm, total_latency,
+                              cache_ctx, q_emb, pack_stats)
+
+    async def _acall_provider_with_retries(self, call_func, *args, **kwargs):
+        """Versión asíncrona de _call_provider_with_retries (no bloquea el event loop)."""
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                logger.info(f"Llamada al proveedor (async), intento {attempt}")
+                return await call_func(*args, **kwargs)
+            except Exception as e:
+                logger.warning(f"Error en intento {attempt}: {e}")
+                if attempt == self.max_retries:
+                    logger.error(f"Máximo de reintentos alcanzado, abortando con error: {e}")
+                    raise
+                metrics.RETRIES.labels(self.provider.name).inc()
+                await asyncio.sleep(self.retry_wait)
+
+    async def asynthesize(self, query: str, top_k=4, max_tokens=512, temperature=0.0, with_usage=False, mode=None,
+                          filters=None):
+        """
+        Versión asyncio de synthesize. La recuperación (CPU: encode + FAISS) y la caché corren
+        en un pool de hilos; la llamada al LLM usa el cliente asíncrono del proveedor, así un
+        solo proceso puede mantener cientos de llamadas en vuelo.
+        """
+        trace = Trace("asynthesize", self.provider.name, query)
+        try:
+            result = await self._asynthesize(query, top_k, max_tokens, temperature, with_usage, mode, filters, trace)
+        except BaseException:
+            trace.finish(status="error")
+            raise
+        return self._record(trace, result)
+
+    async def _asynthesize(self, query, top_k, max_tokens, temperature, with_usage, mode, filters, trace):
+        loop = asyncio.get_running_loop()
+        executor = retrieval_executor()
+        start_total = time.time()
+
+        q_rewritten, hits, latency_retrieve, rerank_stats = await loop.run_in_executor(
+            executor, self._retrieve, query, top_k, mode, trace, filters
+        )
+
+        if self.answer_cache is not None:
+            cached, cache_ctx, q_emb = await loop.run_in_executor(executor, functools.partial(
+                self._check_cache, query, q_rewritten, hits,
+                top_k=top_k, temperature=temperature, max_tokens=max_tokens, with_usage=with_usage
+            ))
+            if cached is not None:
+                return dict(self._cached_result(cached, hits, latency_retrieve, start_total), **rerank_stats)
+        else:
+            cache_ctx = q_emb = None
+
+        # El empaquetado tokeniza el contexto (CPU): también va al pool
+        start_pack = time.time()
+        messages, pack_stats = await loop.run_in_executor(executor, self.pack_messages, query, hits)
+        trace.add("prompt_build", time.time() - start_pack)
+
+        start_llm = time.time()
+        if hasattr(self.provider, "achat_with_usage"):
+            call_func = self.provider.achat_with_usage
+        elif hasattr(self.provider, "achat"):
+            call_func = self.provider.achat
+        else:
+            # Proveedor sin cliente asíncrono: se ejecuta la llamada síncrona en el pool
+            sync_func = self.provider.chat_with_usage if hasattr(self.provider, "chat_with_usage") \
+                else self.provider.chat
+
+            async def call_func(*args, **kwargs):
+                return await loop.run_in_executor(executor, functools.partial(sync_func, *args, **kwargs))
+
+        response = await self._acall_provider_with_retries(
+            call_func, messages, max_tokens=max_tokens, temperature=temperature
+        )
+
+        latency_llm = time.time() - start_llm
+        trace.add("llm_total", latency_llm)
+        total_latency = time.time() - start_total
+        logger.info(f"Llamada LLM completada en {latency_llm:.2f}s, latencia total {total_latency:.2f}s.")
+
+        # _finalize puede persistir la caché en disco: fuera del event loop
+        result = await loop.run_in_executor(executor, functools.partial(
+            self._finalize, query, hits, response, with_usage, latency_retrieve, latency_llm, total_latency,
+            cache_ctx, q_emb, pack_stats
+        ))
+        result.update(rerank_stats)
+        return result
+
+    def synthesize_stream(self, query: str, top_k=4, max_tokens=512, temperature=0.0,
+                          abstain_without_citations=False, mode=None, filters=None):
+        """
+        Versión en streaming de synthesize. Genera eventos (dicts con clave "type"):
+          - "meta":     fragmentos recuperados y latencias de recuperación y reranking (antes del LLM)
+          - "token":    fragmento de texto generado
+          - "citation": cita detectada en cuanto se cierra el corchete
+          - "done":     respuesta final, citas, abstención, latencias y tokens del prompt
+        La abstención se decide al final del stream; si aplica, "done" trae el mensaje
+        de abstención en "answer" y abstained=True para que el cliente reemplace el texto.
+        """
+        trace = Trace("stream", self.provider.name, query)
+        status = "error"
+        try:
+            for event in self._synthesize_stream(query, top_k, max_tokens, temperature,
+                                                 abstain_without_citations, mode, filters, trace):
+                if event["type"] == "done":
+                    status = None
+                    self._record(trace, event)
+                yield event
+        except GeneratorExit:
+            # El cliente cerró la conexión antes de "done"
+            if status:
+                status = "cancelled"
+            raise
+        finally:
+            if status:
+                trace.finish(status=status)
+
+    def _synthesize_stream(self, query, top_k, max_tokens, temperature, abstain_without_citations, mode, filters,
+                           trace):
+        start_total = time.time()
+        q_rewritten, hits, latency_retrieve, rerank_stats = self._retrieve(query, top_k, mode, trace, filters)
+
+        yield dict({"type": "meta", "hits": hits, "latency_retrieve": latency_retrieve}, **rerank_stats)
+
+        done = {
+            "type": "done",
+            "latency_retrieve": latency_retrieve,
+            "latency_first_token": None,
+            "latency_llm": 0.0,
+            "cache_hit": False,
+            "abstained": False,
+            **rerank_stats,
+        }
+
+        # Sin fragmentos no se llama al LLM
+        if not hits:
+            logger.warning(f"Aplicando política de abstención para consulta: {query}")
+            done.update(answer=ABSTENTION_MSG, citations=[], abstained=True,
+                        latency_total=time.time() - start_total)
+            yield done
+            return
+
+        cached, cache_ctx, q_emb = self._check_cache(
+            query, q_rewritten, hits,
+            top_k=top_k, temperature=temperature, max_tokens=max_tokens,
+            abstain_without_citations=abstain_without_citations
+        )
+        if cached is not None:
+            yield {"type": "token", "text": cached["answer"]}
+            for cit in cached["citations"]:
+                yield {"type": "citation", "citation": cit}
+            done.update(cached, cache_hit=True, latency_first_token=0.0,
+                        latency_total=time.time() - start_total)
+            yield done
+            return
+
+        with trace.span("prompt_build"):
+            messages, pack_stats = self.pack_messages(query, hits)
+        done.update(pack_stats)
+        tracker = CitationTracker()
+        parts = []
+        citations = []
+
+        start_llm = time.time()
+        for delta in self._stream_with_retries(messages, max_tokens=max_tokens, temperature=temperature):
+            if done["latency_first_token"] is None:
+                done["latency_first_token"] = time.time() - start_llm
+                trace.add("llm_first_token", done["latency_first_token"])
+            parts.append(delta)
+            yield {"type": "token", "text": delta}
+            for cit in tracker.feed(delta):
+                citations.append(cit)
+                yield {"type": "citation", "citation": cit}
+
+        done["latency_llm"] = time.time() - start_llm
+        trace.add("llm_total", done["latency_llm"])
+        answer = "".join(parts)
+        # En streaming el proveedor no informa el uso: se estima con el tokenizador local
+        metrics.count_tokens(self.provider.name, pack_stats["prompt_tokens_packed"], count_tokens(answer))
+
+        if abstain_without_citations and not citations:
+            logger.warning(f"Aplicando política de abstención para consulta: {query}")
+            answer = ABSTENTION_MSG
+            done["abstained"] = True
+
+        done.update(answer=answer, citations=citations, latency_total=time.time() - start_total)
+        logger.info(f"Stream completado en {done['latency_llm']:.2f}s, latencia total {done['latency_total']:.2f}s.")
+
+        if self.answer_cache is not None:
+            self.answer_cache.put(query, cache_ctx, {
+                "answer": answer,
+                "citations": citations,
+            }, q_emb)
+
+        yield done
@@ -0,0 +1,76 @@
+"""
+Profiler por muestreo (solo stdlib) para requests lentos. Mientras dura un request, un hilo
+toma la pila del hilo del request cada `interval_ms` (sys._current_frames); si el request
+supera `threshold_ms`, las pilas se guardan en formato "folded" (una línea "a;b;c N"),
+que leen flamegraph.pl y speedscope.
+
+Se activa con PROFILE_SLOW_MS (umbral en ms); PROFILE_DIR y PROFILE_INTERVAL_MS lo ajustan.
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold_ms: float, interval_ms: float = 5.0, out_dir="data/profiles"):
+        self.threshold = threshold_ms / 1000.0
+        self.interval = interval_ms / 1000.0
+        self.out_dir = Path(out_dir)
+
+    @classmethod
+    def from_env(cls):
+        """Profiler configurado por variables de entorno, o None si PROFILE_SLOW_MS no está definido."""
+        threshold = os.getenv("PROFILE_SLOW_MS")
+        if not threshold:
+            return None
+        return cls(float(threshold), float(os.getenv("PROFILE_INTERVAL_MS", "5")),
+                   os.getenv("PROFILE_DIR", "data/profiles"))
+
+    @contextmanager
+    def profile(self, label="request"):
+        target = threading.get_ident()
+        samples = Counter()
+        stop = threading.Event()
+
+        def sampler():
+            while not stop.wait(self.interval):
+                frame = sys._current_frames().get(target)
+                if frame is not None:
+                    samples[_collapse(frame)] += 1
+
+        thread = threading.Thread(target=sampler, name="slow-request-profiler", daemon=True)
+        start = time.perf_counter()
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.threshold and samples:
+                self._dump(label, elapsed, samples)
+
+    def _dump(self, label, elapsed, samples):
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        safe = "".join(c if c.isalnum() else "_" for c in label)
+        path = self.out_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{safe}-{int(elapsed * 1000)}ms.folded"
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.warning(f"Request lento ({elapsed * 1000:.0f} ms): perfil guardado en {path}")
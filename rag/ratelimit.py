@@ -0,0 +1,62 @@
+import time
+import threading
+
+
+class TokenBucket:
+    """
+    Limitador token bucket thread-safe: se reponen `rate` tokens por segundo hasta `capacity`
+    (tamaño de ráfaga). Un pedido mayor que la capacidad se concede cuando el balde está
+    lleno y deja el saldo en negativo, así no se bloquea para siempre.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("rate debe ser > 0")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1.0))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, n: float = 1) -> float:
+        """Segundos hasta que haya `n` tokens disponibles (0 si ya los hay)."""
+        with self.lock:
+            self._refill()
+            need = min(n, self.capacity) - self.tokens
+            return max(need / self.rate, 0.0)
+
+    def try_acquire(self, n: float = 1) -> bool:
+        """Toma `n` tokens si están disponibles, sin esperar."""
+        with self.lock:
+            self._refill()
+            if self.tokens >= min(n, self.capacity):
+                self.tokens -= n
+                return True
+            return False
+
+    def acquire(self, n: float = 1, timeout: float = None) -> bool:
+        """Espera hasta tomar `n` tokens; devuelve False si se agota `timeout`."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.try_acquire(n):
+                return True
+            wait = self.wait_time(n)
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or wait > remaining:
+                    return False
+            time.sleep(max(wait, 0.001))
+
+    def adjust(self, n: float):
+        """
+        Corrige el saldo sin esperar: n > 0 descuenta tokens (puede quedar negativo), n < 0 los
+        devuelve (hasta la capacidad). Sirve cuando se reservó una estimación y el uso real difiere.
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - n)
@@ -0,0 +1,172 @@
+"""
+Reranking con cross-encoder en CPU (opcional, RERANK=1).
+
+Con reranking, RAGPipeline pide al retriever `candidates` fragmentos (30 por defecto, sin
+expandir a secciones padre) en vez de top_k. Un cross-encoder multilingüe puntúa cada par
+(pregunta, fragmento) en lotes y al LLM se envían solo los `top_n` mejores (1-2) en lugar de
+los top_k ordenados por MiniLM: el prompt es bastante más corto sin perder los aciertos que
+el bi-encoder deja en posiciones bajas.
+
+  - Los puntajes se guardan en una caché LRU con clave (pregunta normalizada, chunk_id).
+  - Presupuesto de tiempo por petición (budget_ms): la latencia por par se estima con una media
+    móvil exponencial de las llamadas anteriores (sembrada al cargar el modelo) y cada lote se
+    recorta a los pares que caben en el tiempo restante. Si no cabe ni uno, se abandona el
+    reranking y se usa el orden del bi-encoder con los top_k de siempre. Los puntajes ya
+    calculados quedan en la caché.
+
+sentence-transformers y PyTorch se importan al crear el reranker, no al importar este módulo.
+"""
+import os
+import time
+import logging
+import threading
+
+import numpy as np
+
+from rag.cache import LRUCache, normalize_query
+
+logger = logging.getLogger(__name__)
+
+MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"  # multilingüe (mMARCO, incluye español)
+CANDIDATES = 30     # fragmentos que se piden al bi-encoder
+TOP_N = 2           # fragmentos que llegan al LLM
+BUDGET_MS = 250     # tiempo máximo de reranking por petición (0 = sin límite)
+BATCH_SIZE = 16
+MAX_LENGTH = 256    # tokens por par (pregunta + fragmento)
+EWMA_ALPHA = 0.2    # peso de cada lote nuevo en la latencia estimada por par
+
+
+class CrossEncoderReranker:
+    def __init__(self, model_name=MODEL, top_n=TOP_N, candidates=CANDIDATES, budget_ms=BUDGET_MS,
+                 batch_size=BATCH_SIZE, max_length=MAX_LENGTH, cache_size=4096, threads=None):
+        if threads:
+            import torch
+            torch.set_num_threads(int(threads))
+        from sentence_transformers import CrossEncoder
+
+        t0 = time.perf_counter()
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        self.load_seconds = time.perf_counter() - t0
+        logger.info(f"Cross-encoder {model_name} cargado en {self.load_seconds:.2f}s.")
+        self.model_name = model_name
+        self.top_n = top_n
+        self.candidates = candidates
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        # Puntajes por (pregunta normalizada, chunk_id)
+        self.cache = LRUCache(maxsize=cache_size)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.fallbacks = 0
+        self.pairs_scored = 0
+        # Segundos por par (media móvil); el lote de calentamiento da la primera estimación
+        self.pair_seconds = None
+        warmup = [("calentamiento", "texto " * max_length)] * batch_size
+        t0 = time.perf_counter()
+        self.model.predict(warmup, batch_size=batch_size, show_progress_bar=False)
+        self._observe(time.perf_counter() - t0, len(warmup))
+
+    @classmethod
+    def from_env(cls):
+        """None si RERANK != 1; si no, RERANK_MODEL, RERANK_TOP_N, RERANK_CANDIDATES, RERANK_BUDGET_MS..."""
+        if os.getenv("RERANK", "0") != "1":
+            return None
+        return cls(
+            model_name=os.getenv("RERANK_MODEL", MODEL),
+            top_n=int(os.getenv("RERANK_TOP_N", str(TOP_N))),
+            candidates=int(os.getenv("RERANK_CANDIDATES", str(CANDIDATES))),
+            budget_ms=float(os.getenv("RERANK_BUDGET_MS", str(BUDGET_MS))),
+            batch_size=int(os.getenv("RERANK_BATCH_SIZE", str(BATCH_SIZE))),
+            cache_size=int(os.getenv("RERANK_CACHE_SIZE", "4096")),
+            threads=int(os.getenv("RERANK_THREADS", "0")) or None,
+        )
+
+    def _observe(self, seconds, pairs):
+        per_pair = seconds / pairs
+        with self._lock:
+            if self.pair_seconds is None:
+                self.pair_seconds = per_pair
+            else:
+                self.pair_seconds += EWMA_ALPHA * (per_pair - self.pair_seconds)
+
+    def _batch_size(self, deadline):
+        """Pares del siguiente lote: los que caben antes de `deadline` según la latencia estimada."""
+        if deadline is None:
+            return self.batch_size
+        remaining = deadline - time.perf_counter()
+        with self._lock:
+            per_pair = self.pair_seconds
+        if remaining <= 0:
+            return 0
+        if not per_pair:
+            return self.batch_size
+        return min(self.batch_size, int(remaining / per_pair))
+
+    def score(self, query: str, hits, deadline=None):
+        """
+        Puntaje del cross-encoder para cada fragmento (np.ndarray), o None si ni un par más
+        cabe antes de `deadline` (time.perf_counter()). Los pares se agrupan por longitud
+        del texto para minimizar el padding.
+        """
+        key = normalize_query(query)
+        scores = np.zeros(len(hits), dtype="float32")
+        missing = []
+        for i, hit in enumerate(hits):
+            cached = self.cache.get((key, hit["chunk_id"]))
+            if cached is None:
+                missing.append(i)
+            else:
+                scores[i] = cached
+        missing.sort(key=lambda i: len(hits[i]["text"]))
+
+        start = 0
+        while start < len(missing):
+            size = self._batch_size(deadline)
+            if size < 1:
+                return None
+            idx = missing[start:start + size]
+            start += len(idx)
+            t0 = time.perf_counter()
+            out = self.model.predict([(query, hits[i]["text"]) for i in idx], batch_size=len(idx),
+                                     convert_to_numpy=True, show_progress_bar=False)
+            self._observe(time.perf_counter() - t0, len(idx))
+            for i, s in zip(idx, out):
+                scores[i] = s
+                self.cache.put((key, hits[i]["chunk_id"]), float(s))
+            with self._lock:
+                self.pairs_scored += len(idx)
+        return scores
+
+    def rerank(self, query: str, hits, budget_ms=None):
+        """
+        Todos los candidatos ordenados por el cross-encoder (con rerank_score y retrieval_rank,
+        su posición en el orden del bi-encoder), o None si se agotó el presupuesto.
+        """
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        deadline = time.perf_counter() + budget_ms / 1000 if budget_ms else None
+        scores = self.score(query, hits, deadline) if hits else np.zeros(0, dtype="float32")
+        with self._lock:
+            self.calls += 1
+            if scores is None:
+                self.fallbacks += 1
+        if scores is None:
+            logger.info(f"Reranking fuera de presupuesto ({budget_ms:.0f} ms); se usa el orden del bi-encoder.")
+            return None
+        order = np.argsort(-scores, kind="stable")
+        return [dict(hits[i], rerank_score=float(scores[i]), retrieval_rank=int(i)) for i in order]
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls, fallbacks, pairs, pair_seconds = self.calls, self.fallbacks, self.pairs_scored, self.pair_seconds
+        return {
+            "model": self.model_name,
+            "top_n": self.top_n,
+            "candidates": self.candidates,
+            "budget_ms": self.budget_ms,
+            "calls": calls,
+            "fallbacks": fallbacks,
+            "fallback_rate": round(fallbacks / calls, 4) if calls else 0.0,
+            "pairs_scored": pairs,
+            "pair_ms": round(pair_seconds * 1000, 3) if pair_seconds else None,
+            "score_cache": self.cache.stats(),
+        }
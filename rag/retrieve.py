@@ -1,24 +1,513 @@
+import time
+import logging
+import threading
 import faiss
-import pandas as pd
-from sentence_transformers import SentenceTransformer
 import numpy as np
 
-MODEL = "all-MiniLM-L6-v2"
+from rag.cache import LRUCache, normalize_query
+from rag.embed import load_index_manifest, bm25_path
+from rag.bm25 import BM25Index
+from rag.store import ChunkStore, parents_path
+from rag.packing import DEFAULT_BUDGET, count_tokens
+from rag.encoder import get_engine, manifest_config
+from rag.batcher import EmbeddingBatcher
+from rag.shards import (MetadataIndex, ShardSet, shards_path, normalize_filters, filter_key,
+                        MAX_SHARDS_PER_QUERY, NO_PAGE)
+from rag.snapshots import SNAPSHOT_ROOT, current_version, snapshot_paths, resolve, index_fingerprint
+
+logger = logging.getLogger(__name__)
+
+CHILD_FANOUT = 3  # hijos candidatos por resultado pedido: varios hijos suelen caer en la misma sección
+SNAPSHOT_POLL = 2.0  # segundos entre lecturas de data/snapshots/CURRENT
+MODES = ("dense", "bm25", "hybrid")
+
+def read_index(index_path, mmap=True):
+    """
+    Lee el índice FAISS. Con mmap=True las listas/códigos se mapean desde el archivo
+    (IO_FLAG_MMAP), de modo que varios workers comparten las mismas páginas del caché del SO.
+    Si el tipo de índice no admite mmap se lee completo en memoria.
+    """
+    if mmap:
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        try:
+            return faiss.read_index(str(index_path), flags)
+        except RuntimeError as e:
+            logger.warning(f"No se pudo mapear {index_path} en memoria ({e}); se lee completo.")
+    return faiss.read_index(str(index_path))
+
+def _search_params(index, nprobe=None, ef_search=None, sel=None):
+    """
+    SearchParameters de FAISS para ajustar nprobe (IVF) o efSearch (HNSW) en una consulta
+    y, con sel, restringir la búsqueda a un subconjunto de IDs.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and (nprobe or sel is not None):
+        return faiss.SearchParametersIVF(nprobe=int(nprobe or ivf.nprobe), sel=sel)
+    hnsw = _hnsw_of(index)
+    if hnsw is not None and (ef_search or sel is not None):
+        return faiss.SearchParametersHNSW(efSearch=int(ef_search or hnsw.hnsw.efSearch), sel=sel)
+    if sel is not None:
+        return faiss.SearchParameters(sel=sel)
+    return None
+
+def _hnsw_of(index):
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    return index if isinstance(index, faiss.IndexHNSW) else None
+
+def normalize_mode(mode):
+    """Modo de búsqueda de una petición: None (el del retriever) o uno de MODES; ValueError si no."""
+    if mode is None or mode == "":
+        return None
+    if mode not in MODES:
+        raise ValueError(f"Modo de búsqueda desconocido: {mode!r} (opciones: {', '.join(MODES)})")
+    return mode
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """RRF: suma 1/(k + rango) de cada lista. rankings: listas de (chunk_id, score) ordenadas."""
+    fused = {}
+    for ranking in rankings:
+        for rank, (idx, _) in enumerate(ranking):
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda x: -x[1])
+
+def weighted_fusion(dense, lexical, alpha=0.5):
+    """Combina puntajes normalizados (min-max): alpha * denso + (1 - alpha) * BM25."""
+    def normalize(ranking):
+        if not ranking:
+            return {}
+        scores = np.array([s for _, s in ranking], dtype="float32")
+        lo, hi = scores.min(), scores.max()
+        span = (hi - lo) or 1.0
+        return {idx: float((s - lo) / span) for idx, s in ranking}
+
+    d, l = normalize(dense), normalize(lexical)
+    fused = {idx: alpha * d.get(idx, 0.0) + (1 - alpha) * l.get(idx, 0.0) for idx in set(d) | set(l)}
+    return sorted(fused.items(), key=lambda x: -x[1])
+
+class IndexSnapshot:
+    """
+    Lo que se lee de una versión del índice: FAISS, manifiesto, metadatos Arrow, secciones
+    padre, BM25 y sub-índices. Cada consulta trabaja de principio a fin sobre un mismo
+    snapshot; `refs` cuenta las consultas en curso (para drenar el anterior tras un cambio).
+    """
+
+    def __init__(self, index_path, meta_path, version=None, mmap=True, expand=True):
+        self.index_path = str(index_path)
+        self.version = version or index_fingerprint(index_path)
+        self.index = read_index(index_path, mmap=mmap)
+        # Tipo de índice y parámetros registrados por build_index (index.json)
+        self.manifest = load_index_manifest(index_path) or {"index_type": "flat", "params": {}}
+        # Metadatos en Arrow mapeado en memoria: solo se leen las filas de los hits
+        self.store = ChunkStore.open(meta_path)
+        # Secciones padre (chunking por estructura): se busca en los hijos y se devuelven los padres
+        parents = parents_path(meta_path)
+        self.parents = ChunkStore.open(parents, id_column="parent_id") if expand and parents.exists() else None
+        # Índice léxico BM25 (bm25/), construido por build_index
+        bm25_dir = bm25_path(index_path)
+        self.bm25 = BM25Index.load(bm25_dir) if (bm25_dir / "vocab.json").exists() else None
+        # Metadatos por documento y sub-índices (shards/) para las búsquedas filtradas
+        self.meta_index = MetadataIndex.load(shards_path(index_path))
+        self.shards = ShardSet(shards_path(index_path), self.meta_index, lambda p: read_index(p, mmap=mmap)) \
+            if self.meta_index is not None else None
+        self._meta_lock = threading.Lock()
+        self.refs = 0
+
+    def metadata(self):
+        """MetadataIndex para los filtros. Sin shards/ se construye desde el almacén, una vez por snapshot."""
+        if self.meta_index is None:
+            with self._meta_lock:
+                if self.meta_index is None:
+                    logger.warning("Sin shards/ (ejecuta `python app.py index`); se filtra sobre el índice principal.")
+                    pages = self.store.column("page").fill_null(NO_PAGE).to_numpy()
+                    self.meta_index = MetadataIndex.build(self.store.column("doc_id").to_pylist(),
+                                                          self.store.column("title").to_pylist(), pages, self.store.ids)
+        return self.meta_index
 
 class Retriever:
-    def __init__(self, index_path="data/index.faiss", meta_path="data/processed/chunks.parquet"):
-        self.index = faiss.read_index(index_path)
-        self.df = pd.read_parquet(meta_path)
-        self.model = SentenceTransformer(MODEL)
-
-    def query(self, question: str, top_k=5):
-        q_emb = self.model.encode([question], convert_to_numpy=True)
-        faiss.normalize_L2(q_emb)
-        D, I = self.index.search(q_emb, top_k)
-        results = []
-        for score, idx in zip(D[0], I[0]):
-            row = self.df.iloc[idx].to_dict()
-            row["score"] = float(score)
-            results.append(row)
+    """
+    Sin index_path / meta_path sirve el snapshot vigente (data/snapshots/CURRENT, ver
+    rag/snapshots.py) y lo vigila: cuando CURRENT cambia, carga la versión nueva en un hilo
+    aparte y la pone en servicio de forma atómica; las consultas en curso terminan sobre la
+    anterior. Con rutas explícitas sirve siempre ese índice.
+    """
+
+    def __init__(self, index_path=None, meta_path=None,
+                 cache_size=1024, cache_ttl=3600, nprobe=None, ef_search=None, mmap=True,
+                 mode="dense", fusion="rrf", rrf_k=60, alpha=0.5, encoder_backend=None,
+                 batch_size=0, batch_wait_ms=5.0, expand=True, parent_budget=None,
+                 snapshots=SNAPSHOT_ROOT, poll_interval=SNAPSHOT_POLL):
+        self.snapshots = snapshots if index_path is None and meta_path is None else None
+        self.mmap = mmap
+        self.expand = expand
+        self.poll_interval = poll_interval
+        self._nprobe, self._ef_search = nprobe, ef_search
+        t0 = time.perf_counter()
+        self.current = self._load(*resolve(index_path, meta_path, self.snapshots))
+        self.parent_budget = parent_budget or DEFAULT_BUDGET
+        # Cambio de snapshot: versiones reemplazadas con consultas en curso, carga en segundo plano
+        self._swap_lock = threading.Lock()
+        self._retired = []
+        self._loading = False
+        self._failed = None
+        self._next_check = time.monotonic() + poll_interval
+        self.swaps = 0
+        self.mode = normalize_mode(mode) or "dense"
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.alpha = alpha
+        t1 = time.perf_counter()
+        # Motor de embeddings compartido del proceso (EMBED_BACKEND: st | onnx)
+        self.encoder = get_engine(encoder_backend)
+        mismatch = self._encoder_mismatch(self.current)
+        if mismatch:
+            logger.warning(f"{mismatch}: los puntajes de la búsqueda densa no serán confiables "
+                           f"(reconstruye con `python app.py index --full` o ajusta EMBED_BACKEND / EMBED_QUANTIZE).")
+        # Segundos de carga (índice + metadatos + BM25, y modelo) para el reporte de arranque
+        self.load_timings = {"index": t1 - t0, "model": time.perf_counter() - t1}
+        # Caché de embeddings de consulta (clave = pregunta normalizada)
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        # Micro-batching de consultas concurrentes (batch_size=0 lo desactiva)
+        self.batcher = None
+        self.enable_batching(batch_size, batch_wait_ms)
+
+    def enable_batching(self, max_batch=32, max_wait_ms=5.0):
+        """
+        Junta las llamadas concurrentes a query() de hasta `max_wait_ms` ms (o `max_batch`
+        consultas) en un solo encode + index.search. max_batch <= 1 vuelve al camino directo.
+        """
+        self.batcher = EmbeddingBatcher(self._run_batch, max_batch, max_wait_ms) if max_batch > 1 else None
+
+    def _run_batch(self, items, enqueued):
+        """Lote del batcher: agrupa por parámetros de búsqueda y resuelve cada grupo con query_batch."""
+        groups = {}
+        for i, (question, params, _, _) in enumerate(items):
+            groups.setdefault(params, []).append(i)
+        results = [None] * len(items)
+        start = time.perf_counter()
+        for (top_k, nprobe, ef_search, mode, expand, _), idx in groups.items():
+            t = {}
+            hits = self.query_batch([items[i][0] for i in idx], top_k=top_k, nprobe=nprobe,
+                                    ef_search=ef_search, mode=mode, timings=t, filters=items[idx[0]][3],
+                                    expand=expand)
+            for i, h in zip(idx, hits):
+                results[i] = h
+                timings = items[i][2]
+                if timings is not None:
+                    for stage, seconds in t.items():
+                        timings[stage] = timings.get(stage, 0.0) + seconds
+                    timings["queue"] = timings.get("queue", 0.0) + start - enqueued[i]
+                    timings["batch"] = len(items)
         return results
 
+    def encode(self, questions):
+        """
+        Embeddings normalizados (float32) para una lista de preguntas.
+        Las preguntas ya vistas salen de la caché; el resto se codifica en una sola pasada.
+        """
+        keys = [normalize_query(q) for q in questions]
+        out = [None] * len(keys)
+        missing = {}
+        for i, key in enumerate(keys):
+            emb = self.cache.get(key)
+            if emb is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                out[i] = emb
+
+        if missing:
+            texts = list(missing)
+            embs = self.encoder.encode(texts)
+            for key, emb in zip(texts, embs):
+                emb = emb.copy()
+                self.cache.put(key, emb)
+                for i in missing[key]:
+                    out[i] = emb
+
+        return np.vstack(out).astype("float32")
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """
+        Valores por defecto de nprobe (IVF) y efSearch (HNSW) para todas las consultas
+        (también en los snapshots que se carguen después).
+        """
+        self._nprobe = nprobe or self._nprobe
+        self._ef_search = ef_search or self._ef_search
+        self._apply_search_params(self.current)
+
+    def _apply_search_params(self, snap):
+        params = snap.manifest.get("params") or {}
+        nprobe = self._nprobe or params.get("nprobe")
+        ef_search = self._ef_search or params.get("ef_search")
+        ivf = faiss.try_extract_index_ivf(snap.index)
+        if ivf is not None and nprobe:
+            ivf.nprobe = int(nprobe)
+        hnsw = _hnsw_of(snap.index)
+        if hnsw is not None and ef_search:
+            hnsw.hnsw.efSearch = int(ef_search)
+
+    def _encoder_mismatch(self, snap):
+        """Mensaje si el índice se construyó con otro motor de embeddings que el de las consultas (si no, None)."""
+        if "backend" not in snap.manifest:
+            return None  # índice sin manifiesto: no se puede saber
+        built = manifest_config(snap.manifest)
+        serving = (self.encoder.name, self.encoder.quantize)
+        if built != serving:
+            return f"Índice {snap.version} construido con (backend, quantize)={built} y consultas con {serving}"
+        return None
+
+    # --- Snapshots ---
+
+    def _load(self, index_path, meta_path, version=None):
+        snap = IndexSnapshot(index_path, meta_path, version, mmap=self.mmap, expand=self.expand)
+        self._apply_search_params(snap)
+        return snap
+
+    # Vista del snapshot vigente (para scripts y estadísticas; las consultas fijan el suyo)
+    index = property(lambda self: self.current.index)
+    index_path = property(lambda self: self.current.index_path)
+    version = property(lambda self: self.current.version)
+    manifest = property(lambda self: self.current.manifest)
+    store = property(lambda self: self.current.store)
+    parents = property(lambda self: self.current.parents)
+    bm25 = property(lambda self: self.current.bm25)
+    meta_index = property(lambda self: self.current.meta_index)
+    shards = property(lambda self: self.current.shards)
+
+    def _acquire(self):
+        """Snapshot para una consulta (y, cada poll_interval s, revisa si CURRENT cambió)."""
+        if self.snapshots is not None and time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + self.poll_interval
+            version = current_version(self.snapshots)
+            if version and version not in (self.current.version, self._failed):
+                with self._swap_lock:
+                    start, self._loading = not self._loading, True
+                if start:
+                    threading.Thread(target=self.reload, args=(version,), daemon=True,
+                                     name="snapshot-loader").start()
+        with self._swap_lock:
+            snap = self.current
+            snap.refs += 1
+        return snap
+
+    def _release(self, snap):
+        with self._swap_lock:
+            snap.refs -= 1
+            if snap.refs == 0 and snap in self._retired:
+                self._retired.remove(snap)
+                logger.info(f"Snapshot {snap.version} drenado y liberado.")
+
+    def reload(self, version=None) -> bool:
+        """
+        Carga una versión (por defecto la de CURRENT), la precalienta con una búsqueda y la
+        pone en servicio. Devuelve True si cambió. Las consultas en curso siguen en la anterior,
+        que se libera cuando terminan.
+        """
+        try:
+            if self.snapshots is None:
+                return False
+            version = version or current_version(self.snapshots)
+            if version is None or version == self.current.version:
+                return False
+            start = time.perf_counter()
+            try:
+                snap = self._load(*snapshot_paths(self.snapshots, version), version)
+                if snap.index.d != self.current.index.d:
+                    raise ValueError(f"dimensión {snap.index.d} != {self.current.index.d}")
+                # Vectores de otro motor: no se pone en servicio
+                mismatch = self._encoder_mismatch(snap)
+                if mismatch:
+                    raise ValueError(mismatch)
+                # Toca las páginas del índice antes de recibir tráfico
+                snap.index.search(np.zeros((1, snap.index.d), dtype="float32"), 1)
+            except Exception as e:
+                logger.error(f"No se pudo cargar el snapshot {version}: {e}; se sigue sirviendo {self.version}.")
+                self._failed = version
+                return False
+            with self._swap_lock:
+                old, self.current = self.current, snap
+                if old.refs:
+                    self._retired.append(old)
+                self.swaps += 1
+            logger.info(f"Snapshot {version} en servicio ({time.perf_counter() - start:.2f}s de carga); "
+                        f"{old.refs} consultas terminan en {old.version}.")
+            return True
+        finally:
+            with self._swap_lock:
+                self._loading = False
+
+    def snapshot_stats(self) -> dict:
+        with self._swap_lock:
+            return {
+                "version": self.current.version,
+                "index_path": self.current.index_path,
+                "swaps": self.swaps,
+                "loading": self._loading,
+                "draining": {s.version: s.refs for s in self._retired},
+                "failed": self._failed,
+            }
+
+    def query(self, question: str, top_k=5, nprobe=None, ef_search=None, mode=None, timings=None, filters=None,
+              expand=True):
+        mode = normalize_mode(mode)
+        if self.batcher is not None:
+            filters = normalize_filters(filters)
+            params = (top_k, nprobe, ef_search, mode, expand, filter_key(filters))
+            return self.batcher.submit((question, params, timings, filters))
+        return self.query_batch([question], top_k=top_k, nprobe=nprobe, ef_search=ef_search, mode=mode,
+                                timings=timings, filters=filters, expand=expand)[0]
+
+    def query_batch(self, questions, top_k=5, nprobe=None, ef_search=None, mode=None, timings=None,
+                    filters=None, expand=True):
+        """
+        Recupera para varias preguntas con un solo encode y un solo index.search.
+        nprobe / ef_search ajustan la búsqueda aproximada solo para esta llamada.
+        mode: "dense" (MiniLM + FAISS), "bm25" (léxico) o "hybrid" (fusión de ambos).
+        timings: dict opcional donde se acumulan los segundos de "encode", "search" y "fetch".
+        filters: {"doc_id", "title", "page": [desde, hasta], "year": n | [desde, hasta]} (ver
+        rag/shards.py); la búsqueda solo recorre los chunks que los cumplen.
+        Si hay secciones padre, se buscan top_k * CHILD_FANOUT hijos y se devuelven hasta
+        top_k padres sin repetir (ver expand_parents). expand=False devuelve los top_k hijos tal
+        cual (p. ej. para reordenarlos antes de expandir, ver rag/rerank.py).
+        """
+        if not questions:
+            return []
+        t = timings if timings is not None else {}
+        for stage in ("encode", "search", "fetch"):
+            t.setdefault(stage, 0.0)
+        snap = self._acquire()
+        try:
+            ranges = self._resolve(snap, normalize_filters(filters))
+            if snap.parents is None or not expand:
+                return self._search(snap, questions, top_k, nprobe, ef_search, mode, t, ranges)
+            results = self._search(snap, questions, top_k * CHILD_FANOUT, nprobe, ef_search, mode, t, ranges)
+            t0 = time.perf_counter()
+            results = [self.expand_parents(hits, top_k, snap) for hits in results]
+            t["fetch"] += time.perf_counter() - t0
+            return results
+        finally:
+            self._release(snap)
+
+    def expand_parents(self, hits, top_k, snap=None):
+        """
+        Small-to-big: reemplaza cada hijo por su sección padre, una vez por padre y en el orden
+        del mejor hijo, mientras el total quepa en parent_budget tokens; si el padre no cabe,
+        se conserva el hijo. Cada padre lleva chunk_id y score de su mejor hijo y la lista children.
+        """
+        snap = snap or self.current
+        pids = np.array(sorted({h["parent_id"] for h in hits if h.get("parent_id") is not None}), dtype="int64")
+        positions = snap.parents.positions(pids)
+        found = positions >= 0
+        parents = dict(zip(pids[found].tolist(), snap.parents.rows(positions[found])))
+
+        out, expanded, used = [], {}, 0
+        for hit in hits:
+            pid = hit.get("parent_id")
+            if pid in expanded:
+                expanded[pid]["children"].append(hit["chunk_id"])
+                continue
+            if len(out) >= top_k:
+                continue
+            parent = parents.get(pid)
+            if parent is not None and used + parent["n_tokens"] <= self.parent_budget:
+                parent.update(chunk_id=hit["chunk_id"], score=hit["score"], children=[hit["chunk_id"]])
+                expanded[pid] = parent
+                out.append(parent)
+                used += parent["n_tokens"]
+            else:
+                out.append(hit)
+                used += count_tokens(hit["text"])
+        return out
+
+    def _resolve(self, snap, filters):
+        """Rangos de chunks que cumplen los filtros (None = sin filtros)."""
+        if filters is None:
+            return None
+        return snap.metadata().resolve(filters)
+
+    def _bm25_mask(self, snap, ranges):
+        if ranges is None:
+            return None
+        mask = np.zeros(len(snap.bm25), dtype=bool)
+        positions = snap.store.positions(snap.meta_index.allowed_ids(ranges))
+        mask[positions[positions >= 0]] = True
+        return mask
+
+    def _search(self, snap, questions, top_k, nprobe, ef_search, mode, t, ranges=None):
+        mode = normalize_mode(mode) or self.mode
+        if mode != "dense" and snap.bm25 is None:
+            logger.warning("Índice BM25 no disponible (ejecuta `python app.py index`); se usa búsqueda densa.")
+            mode = "dense"
+        if ranges is not None and not ranges:
+            return [[] for _ in questions]  # ningún chunk cumple los filtros
+
+        if mode == "bm25":
+            t0 = time.perf_counter()
+            mask = self._bm25_mask(snap, ranges)
+            found = [snap.bm25.search(q, top_k, mask=mask) for q in questions]
+            t1 = time.perf_counter()
+            results = [self._hits(snap, *f) for f in found]
+            t["search"] += t1 - t0
+            t["fetch"] += time.perf_counter() - t1
+            return results
+
+        # En modo híbrido se piden más candidatos a cada recuperador antes de fusionar
+        depth = top_k if mode == "dense" else max(top_k * 4, 20)
+        t0 = time.perf_counter()
+        q_emb = self.encode(questions)
+        t1 = time.perf_counter()
+        D, I = self._dense_search(snap, q_emb, depth, nprobe, ef_search, ranges)
+        t["encode"] += t1 - t0
+
+        if mode == "dense":
+            t2 = time.perf_counter()
+            results = [self._hits(snap, D[i], I[i]) for i in range(len(questions))]
+            t["search"] += t2 - t1
+            t["fetch"] += time.perf_counter() - t2
+            return results
+
+        ranked = []
+        mask = self._bm25_mask(snap, ranges)
+        for i, q in enumerate(questions):
+            dense = [(int(idx), float(score)) for idx, score in zip(I[i], D[i]) if idx >= 0]
+            b_scores, b_ids = snap.bm25.search(q, depth, mask=mask)
+            lexical = [(int(idx), float(score)) for idx, score in zip(b_ids, b_scores)]
+            if self.fusion == "weighted":
+                fused = weighted_fusion(dense, lexical, alpha=self.alpha)
+            else:
+                fused = reciprocal_rank_fusion([dense, lexical], k=self.rrf_k)
+            ranked.append(fused[:top_k])
+        t2 = time.perf_counter()
+        results = [self._hits(snap, [s for _, s in fused], [idx for idx, _ in fused]) for fused in ranked]
+        t["search"] += t2 - t1
+        t["fetch"] += time.perf_counter() - t2
+        return results
+
+    def _dense_search(self, snap, q_emb, top_k, nprobe=None, ef_search=None, ranges=None):
+        index = snap.index
+        if ranges is not None:
+            # Pocos documentos: solo sus sub-índices. Muchos: el índice principal con IDSelectorBatch
+            if snap.shards is not None and len(ranges) <= MAX_SHARDS_PER_QUERY:
+                return snap.shards.search(q_emb, top_k, ranges)
+            allowed = np.ascontiguousarray(snap.meta_index.allowed_ids(ranges), dtype="int64")
+            selector = faiss.IDSelectorBatch(len(allowed), faiss.swig_ptr(allowed))
+            return index.search(q_emb, top_k, params=_search_params(index, nprobe, ef_search, selector))
+        params = _search_params(index, nprobe, ef_search)
+        if params is not None:
+            return index.search(q_emb, top_k, params=params)
+        return index.search(q_emb, top_k)
+
+    def _hits(self, snap, scores, ids):
+        ids = np.asarray(ids, dtype="int64")
+        positions = snap.store.positions(ids)
+        keep = [i for i, (idx, pos) in enumerate(zip(ids, positions)) if idx >= 0 and pos >= 0]
+        rows = snap.store.rows(positions[keep])
+        for row, i in zip(rows, keep):
+            row["score"] = float(scores[i])
+        return rows
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats()
+
+    def batch_stats(self) -> dict:
+        return self.batcher.stats() if self.batcher is not None else None
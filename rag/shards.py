@@ -0,0 +1,281 @@
+"""
+Búsqueda filtrada por metadatos (doc_id, título, rango de páginas, año del documento).
+
+build_index escribe en data/shards/:
+  - <hash>.faiss: un IndexFlatIP por documento con sus vectores ordenados por (página, chunk_id).
+    La etiqueta de cada vector es su posición, así que un rango de páginas es un rango
+    contiguo de etiquetas (IDSelectorRange).
+  - ids.npz: chunk_id y página de todos los chunks agrupados por documento (offsets por documento).
+  - shards.json: doc_id, título, año y archivo de cada documento.
+
+Resolver un filtro cuesta O(1) por doc_id o año (diccionarios precalculados) más un
+searchsorted sobre las páginas de cada documento; la búsqueda solo recorre ese subconjunto.
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+from rag.bm25 import fold_accents
+
+logger = logging.getLogger(__name__)
+
+YEAR_RE = re.compile(r"(?<!\d)(19[5-9]\d|20\d{2})(?!\d)")
+FILTER_KEYS = ("doc_id", "title", "page", "year")
+NO_PAGE = -1                 # página de los documentos de texto (sin páginas)
+MAX_SHARDS_PER_QUERY = 32    # con más documentos se filtra sobre el índice principal (IDSelectorBatch)
+
+
+def shards_path(index_path) -> Path:
+    """Directorio de sub-índices junto al índice FAISS (data/index.faiss -> data/shards/)."""
+    return Path(index_path).with_name("shards")
+
+
+def doc_year(doc_id: str, title: str):
+    """Año del documento: el primero (1950-2099) que aparezca en el título o el doc_id."""
+    m = YEAR_RE.search(f"{title or ''} {doc_id}")
+    return int(m.group(1)) if m else None
+
+
+def _range(value, name):
+    """Acepta un número o [desde, hasta] (inclusive; null = sin límite)."""
+    if isinstance(value, (list, tuple)):
+        if len(value) != 2:
+            raise ValueError(f"Filtro '{name}': se espera [desde, hasta]")
+        lo, hi = value
+    else:
+        lo = hi = value
+    try:
+        lo = int(lo) if lo is not None else -(2 ** 62)
+        hi = int(hi) if hi is not None else 2 ** 62
+    except (TypeError, ValueError):
+        raise ValueError(f"Filtro '{name}': valores no numéricos")
+    return lo, hi
+
+
+def normalize_filters(filters):
+    """
+    Valida los filtros de una consulta y devuelve un dict sin claves vacías (o None).
+    Formato: {"doc_id": str | [str], "title": str, "page": n | [desde, hasta], "year": n | [desde, hasta]}
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("filters debe ser un objeto JSON")
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Filtros desconocidos: {', '.join(sorted(unknown))}")
+    out = {}
+    for key in FILTER_KEYS:
+        value = filters.get(key)
+        if value is None or value == "" or value == []:
+            continue
+        if key == "doc_id":
+            value = [value] if isinstance(value, str) else [str(v) for v in value]
+        elif key == "title":
+            value = str(value)
+        else:
+            value = list(_range(value, key))
+        out[key] = value
+    return out or None
+
+
+def filter_key(filters) -> str:
+    """Clave hashable de unos filtros normalizados (para agrupar consultas en el micro-batching)."""
+    return json.dumps(filters, sort_keys=True) if filters else ""
+
+
+def _shard_file(doc_id: str) -> str:
+    return hashlib.sha1(doc_id.encode("utf-8")).hexdigest()[:16] + ".faiss"
+
+
+class MetadataIndex:
+    """Chunks agrupados por documento (ordenados por página) y diccionarios doc_id/título/año -> documentos."""
+
+    def __init__(self, docs, ids, pages, offsets):
+        self.docs = docs
+        self.ids = ids
+        self.pages = pages
+        self.offsets = offsets
+        self.by_doc = {d["doc_id"]: i for i, d in enumerate(docs)}
+        self.by_title = {}
+        self.by_year = {}
+        for i, d in enumerate(docs):
+            self.by_title.setdefault(fold_accents(d["title"] or "").strip(), []).append(i)
+            if d["year"] is not None:
+                self.by_year.setdefault(d["year"], []).append(i)
+
+    @classmethod
+    def build(cls, doc_ids, titles, pages, ids):
+        """doc_ids, titles, pages, ids: un valor por chunk (página NO_PAGE si no tiene)."""
+        doc_ids = np.asarray(doc_ids, dtype=object)
+        pages = np.asarray(pages, dtype="int64")
+        ids = np.asarray(ids, dtype="int64")
+        names, codes = np.unique(doc_ids, return_inverse=True)
+        order = np.lexsort((ids, pages, codes))
+        offsets = np.zeros(len(names) + 1, dtype="int64")
+        offsets[1:] = np.cumsum(np.bincount(codes, minlength=len(names)))
+        first = {}
+        for code, title in zip(codes, titles):
+            first.setdefault(int(code), title)
+        docs = [{"doc_id": str(name), "title": first[i], "year": doc_year(str(name), first[i]),
+                 "file": _shard_file(str(name))} for i, name in enumerate(names)]
+        return cls(docs, ids[order], pages[order], offsets)
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        if not (path / "shards.json").exists():
+            return None
+        docs = json.loads((path / "shards.json").read_text(encoding="utf-8"))["docs"]
+        arrays = np.load(path / "ids.npz")
+        return cls(docs, arrays["ids"], arrays["pages"], arrays["offsets"])
+
+    def save(self, path):
+        path = Path(path)
+        np.savez(path / "ids.npz", ids=self.ids, pages=self.pages, offsets=self.offsets)
+        (path / "shards.json").write_text(json.dumps({"docs": self.docs}, ensure_ascii=False, indent=1),
+                                          encoding="utf-8")
+
+    def doc_ids(self, i):
+        return self.ids[self.offsets[i]:self.offsets[i + 1]]
+
+    def resolve(self, filters):
+        """
+        Rangos [(documento, desde, hasta)] de posiciones dentro de cada sub-índice que cumplen
+        los filtros (normalizados con normalize_filters).
+        """
+        docs = None
+        if "doc_id" in filters:
+            docs = {self.by_doc[d] for d in filters["doc_id"] if d in self.by_doc}
+        if "title" in filters:
+            wanted = fold_accents(filters["title"]).strip()
+            match = set(self.by_title.get(wanted, ()))
+            if not match:
+                # Coincidencia parcial: recorre los títulos (uno por documento, no por chunk)
+                match = {i for title, idx in self.by_title.items() if wanted in title for i in idx}
+            docs = match if docs is None else docs & match
+        if "year" in filters:
+            lo, hi = filters["year"]
+            match = {i for year, idx in self.by_year.items() if lo <= year <= hi for i in idx}
+            docs = match if docs is None else docs & match
+
+        ranges = []
+        for i in sorted(docs) if docs is not None else range(len(self.docs)):
+            start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+            lo, hi = 0, end - start
+            if "page" in filters:
+                pages = self.pages[start:end]
+                lo = int(np.searchsorted(pages, filters["page"][0], side="left"))
+                hi = int(np.searchsorted(pages, filters["page"][1], side="right"))
+            if hi > lo:
+                ranges.append((i, lo, hi))
+        return ranges
+
+    def allowed_ids(self, ranges) -> np.ndarray:
+        """chunk_id de los rangos resueltos."""
+        if not ranges:
+            return np.empty(0, dtype="int64")
+        return np.concatenate([self.ids[self.offsets[i] + lo:self.offsets[i] + hi] for i, lo, hi in ranges])
+
+
+class ShardSet:
+    """Sub-índices por documento, cargados en el primer uso."""
+
+    def __init__(self, path, meta: MetadataIndex, loader=None):
+        self.path = Path(path)
+        self.meta = meta
+        self.loader = loader or (lambda p: faiss.read_index(str(p)))
+        self._indexes = {}
+
+    def index(self, i):
+        index = self._indexes.get(i)
+        if index is None:
+            index = self._indexes[i] = self.loader(self.path / self.meta.docs[i]["file"])
+        return index
+
+    def search(self, q_emb, top_k, ranges):
+        """Busca en los sub-índices de los rangos y mezcla los resultados: (D, chunk_ids) como FAISS."""
+        nq = len(q_emb)
+        all_d, all_i = [np.full((nq, top_k), -np.inf, dtype="float32")], [np.full((nq, top_k), -1, dtype="int64")]
+        for i, lo, hi in ranges:
+            index = self.index(i)
+            k = min(top_k, hi - lo)
+            if lo == 0 and hi == index.ntotal:
+                D, I = index.search(q_emb, k)
+            else:
+                selector = faiss.IDSelectorRange(lo, hi)
+                D, I = index.search(q_emb, k, params=faiss.SearchParameters(sel=selector))
+            doc_ids = self.meta.doc_ids(i)
+            all_d.append(np.where(I >= 0, D, -np.inf))
+            all_i.append(np.where(I >= 0, doc_ids[np.maximum(I, 0)], -1))
+        D, I = np.hstack(all_d), np.hstack(all_i)
+        top = np.argsort(-D, axis=1, kind="stable")[:, :top_k]
+        return np.take_along_axis(D, top, axis=1), np.take_along_axis(I, top, axis=1)
+
+
+def _fill(vecs, found, ids, src_ids, src_vecs):
+    """Copia a vecs los vectores de src para los ids que estén ahí."""
+    if not len(src_ids):
+        return
+    order = np.argsort(src_ids)
+    sorted_ids = src_ids[order]
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    hit = (sorted_ids[pos] == ids) & ~found
+    vecs[hit] = src_vecs[order[pos[hit]]]
+    found |= hit
+
+
+def build_shards(path, df, dim, fresh_ids, fresh_vecs, encode):
+    """
+    Escribe los sub-índices por documento y los metadatos a partir del DataFrame de chunks.
+    Los vectores salen de fresh (recién codificados), del sub-índice anterior del documento
+    o, si no están en ninguno, de encode(textos). Un documento cuyos chunk_id no cambiaron
+    conserva su archivo. Devuelve (MetadataIndex, documentos reescritos).
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    old = MetadataIndex.load(path)
+    pages = df["page"].fillna(NO_PAGE).to_numpy(dtype="int64")
+    meta = MetadataIndex.build(df["doc_id"].to_numpy(dtype=object), df["title"].tolist(), pages,
+                               df["chunk_id"].to_numpy(dtype="int64"))
+    fresh_ids = np.asarray(fresh_ids, dtype="int64")
+    text_by_id = None
+    rebuilt = 0
+    for i, doc in enumerate(meta.docs):
+        ids = meta.doc_ids(i)
+        file = path / doc["file"]
+        j = old.by_doc.get(doc["doc_id"]) if old is not None else None
+        if j is not None and file.exists() and np.array_equal(old.doc_ids(j), ids):
+            continue
+
+        vecs = np.zeros((len(ids), dim), dtype="float32")
+        found = np.zeros(len(ids), dtype=bool)
+        _fill(vecs, found, ids, fresh_ids, fresh_vecs)
+        if not found.all() and j is not None and file.exists():
+            previous = faiss.read_index(str(file))
+            _fill(vecs, found, ids, old.doc_ids(j), previous.reconstruct_n(0, previous.ntotal))
+        if not found.all():
+            if text_by_id is None:
+                text_by_id = dict(zip(df["chunk_id"].tolist(), df["text"].tolist()))
+            vecs[~found] = encode([text_by_id[int(x)] for x in ids[~found]])
+
+        shard = faiss.IndexFlatIP(dim)
+        shard.add(vecs)
+        # Temporal + os.replace: el archivo anterior puede ser un enlace duro de otro snapshot
+        tmp = file.with_suffix(".tmp")
+        faiss.write_index(shard, str(tmp))
+        os.replace(tmp, file)
+        rebuilt += 1
+
+    keep = {d["file"] for d in meta.docs}
+    for f in path.glob("*.faiss"):
+        if f.name not in keep:
+            f.unlink()
+    meta.save(path)
+    return meta, rebuilt
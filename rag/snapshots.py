@@ -0,0 +1,165 @@
+"""
+Snapshots versionados del índice (data/snapshots/).
+
+build_index escribe cada versión en su propio directorio y la publica reemplazando de forma
+atómica el puntero CURRENT:
+
+    data/snapshots/
+      CURRENT                  nombre de la versión vigente (p. ej. 20261018-081402-512034)
+      20261018-081402-512034/
+        manifest.json          versión, fecha, modelo, tipo de índice, chunks y documentos
+        index.faiss            índice FAISS (+ index.json con ids y parámetros)
+        chunks.parquet         metadatos (+ chunks.arrow, parents.parquet, parents.arrow)
+        bm25/  shards/
+
+Un directorio publicado no se modifica nunca: el build trabaja en .build-<versión> y lo
+renombra al terminar, así un lector (Retriever) no puede ver archivos a medio escribir.
+Sin snapshots (índices antiguos o `app.py index --in-place`) se usan data/index.faiss y
+data/processed/chunks.parquet.
+"""
+import os
+import json
+import time
+import shutil
+import logging
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_ROOT = "data/snapshots"
+LEGACY_INDEX = "data/index.faiss"
+LEGACY_META = "data/processed/chunks.parquet"
+INDEX_FILE = "index.faiss"
+META_FILE = "chunks.parquet"
+KEEP = 3  # versiones publicadas que se conservan (para volver atrás con `app.py snapshots --use`)
+
+
+def pointer_path(root) -> Path:
+    return Path(root) / "CURRENT"
+
+
+def current_version(root=SNAPSHOT_ROOT):
+    """Versión apuntada por CURRENT (None si no hay snapshots)."""
+    try:
+        return pointer_path(root).read_text(encoding="utf-8").strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def snapshot_paths(root, version):
+    """(index_path, meta_path) de una versión."""
+    path = Path(root) / version
+    return path / INDEX_FILE, path / META_FILE
+
+
+def resolve(index_path=None, meta_path=None, root=SNAPSHOT_ROOT):
+    """
+    (index_path, meta_path, versión) a usar: las rutas indicadas si las hay; si no, las del
+    snapshot vigente o, sin snapshots, las rutas fijas de antes (versión None).
+    """
+    if index_path is None and meta_path is None and root is not None:
+        version = current_version(root)
+        if version is not None:
+            return (*snapshot_paths(root, version), version)
+    if index_path is not None and meta_path is None:
+        # Índice de un snapshot indicado a mano: sus metadatos están al lado
+        sibling = Path(index_path).with_name(META_FILE)
+        meta_path = sibling if sibling.exists() else None
+    return index_path or LEGACY_INDEX, meta_path or LEGACY_META, None
+
+
+def index_fingerprint(index_path=None) -> str:
+    """
+    Versión del índice: la del snapshot vigente o, para un índice fuera de snapshots,
+    tamaño + mtime del archivo. Cambia cada vez que se reconstruye.
+    """
+    if index_path is None:
+        version = current_version()
+        if version is not None:
+            return version
+        index_path = LEGACY_INDEX
+    try:
+        st = os.stat(index_path)
+    except FileNotFoundError:
+        return None
+    return f"{st.st_size}-{st.st_mtime_ns}"
+
+
+def new_version() -> str:
+    """Nombre de versión: fecha con microsegundos, así el orden alfabético es el cronológico."""
+    return datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+
+
+def staging_dir(root, version) -> Path:
+    path = Path(root) / f".build-{version}"
+    path.mkdir(parents=True, exist_ok=False)
+    return path
+
+
+def link_tree(src, dst, suffixes=(".faiss",)):
+    """
+    Copia src en dst usando enlaces duros para los archivos con esos sufijos (no se modifican:
+    se reemplazan con os.replace) y copias para el resto (que sí se reescriben).
+    """
+    src, dst = Path(src), Path(dst)
+    dst.mkdir(parents=True, exist_ok=True)
+    for f in src.iterdir():
+        if not f.is_file():
+            continue
+        if f.suffix in suffixes:
+            try:
+                os.link(f, dst / f.name)
+                continue
+            except OSError:
+                pass
+        shutil.copy2(f, dst / f.name)
+
+
+def publish(root, staging, version, manifest, keep=KEEP):
+    """Cierra el snapshot: manifest.json, renombra el directorio y mueve CURRENT (atómico)."""
+    root, staging = Path(root), Path(staging)
+    manifest = dict(manifest, version=version, created=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    (staging / "manifest.json").write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+    final = root / version
+    os.rename(staging, final)
+    set_current(root, version)
+    prune(root, keep)
+    return final
+
+
+def set_current(root, version):
+    """Apunta CURRENT a una versión publicada (p. ej. para volver a la anterior)."""
+    if not (Path(root) / version / "manifest.json").exists():
+        raise ValueError(f"No existe el snapshot {version}")
+    tmp = Path(root) / f"CURRENT.{os.getpid()}.tmp"
+    tmp.write_text(version, encoding="utf-8")
+    os.replace(tmp, pointer_path(root))
+
+
+def list_snapshots(root=SNAPSHOT_ROOT):
+    """Manifiestos de las versiones publicadas, de la más antigua a la más nueva."""
+    root = Path(root)
+    if not root.exists():
+        return []
+    out = []
+    for path in sorted(p for p in root.iterdir() if p.is_dir() and not p.name.startswith(".")):
+        try:
+            out.append(json.loads((path / "manifest.json").read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            continue
+    return out
+
+
+def prune(root, keep=KEEP):
+    """
+    Borra las versiones más antiguas dejando `keep` (nunca la vigente). Los procesos que aún
+    tengan abierta una versión borrada siguen leyéndola: los archivos mapeados en memoria
+    viven hasta que se cierran.
+    """
+    current = current_version(root)
+    versions = [m["version"] for m in list_snapshots(root)]
+    for version in versions[:max(len(versions) - keep, 0)]:
+        if version != current:
+            shutil.rmtree(Path(root) / version, ignore_errors=True)
+            logger.info(f"Snapshot {version} eliminado.")
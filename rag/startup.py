@@ -0,0 +1,49 @@
+import os
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """
+    Tiempos de arranque de un proceso por fase (import, model, index...). Cada worker
+    tiene su propio reporte; con preload los workers heredan el del master.
+    """
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.phases = {}
+        self.inherited_from = None
+
+    @contextmanager
+    def phase(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    def record(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def after_fork(self):
+        """En el worker: las fases ya medidas se pagaron en el master (copy-on-write)."""
+        if os.getpid() != self.pid:
+            self.inherited_from = self.pid
+            self.pid = os.getpid()
+
+    def report(self) -> dict:
+        return {
+            "pid": self.pid,
+            "preloaded_by": self.inherited_from,
+            "phases_sec": {k: round(v, 3) for k, v in self.phases.items()},
+            "total_sec": round(sum(self.phases.values()), 3),
+        }
+
+    def log(self):
+        r = self.report()
+        origin = f" (heredado del master {r['preloaded_by']})" if r["preloaded_by"] else ""
+        phases = ", ".join(f"{k} {v:.2f}s" for k, v in r["phases_sec"].items())
+        logger.info(f"Arranque pid {r['pid']}{origin}: {phases}; total {r['total_sec']:.2f}s")
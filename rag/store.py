@@ -0,0 +1,82 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+
+def store_path(meta_path) -> Path:
+    """Ruta del almacén Arrow junto al parquet (chunks.parquet -> chunks.arrow)."""
+    return Path(meta_path).with_suffix(".arrow")
+
+
+def parents_path(meta_path) -> Path:
+    """Secciones padre de los chunks, junto al parquet (chunks.parquet -> parents.parquet)."""
+    return Path(meta_path).with_name("parents.parquet")
+
+
+def write_store(data, path, id_column="chunk_id"):
+    """
+    Escribe los metadatos de los chunks como archivo Arrow IPC sin compresión, ordenado por
+    id_column. Así se puede abrir con memory-map (sin copiar) y buscar filas por ID con
+    una búsqueda binaria.
+    """
+    table = pa.Table.from_pandas(data, preserve_index=False) if isinstance(data, pd.DataFrame) else data
+    if id_column not in table.column_names:
+        # Índices antiguos: el ID es la posición de la fila
+        table = table.append_column(id_column, pa.array(np.arange(table.num_rows, dtype="int64")))
+    table = table.sort_by(id_column).combine_chunks()
+
+    path = Path(path)
+    tmp = path.with_suffix(f".arrow.{os.getpid()}.tmp")
+    with pa.OSFile(str(tmp), "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+    return path
+
+
+class ChunkStore:
+    """
+    Metadatos de los chunks en un archivo Arrow mapeado en memoria. Las páginas las comparte
+    el caché del sistema operativo entre todos los workers, y solo se materializan en Python
+    las filas de los hits de cada consulta.
+    """
+
+    def __init__(self, path, id_column="chunk_id"):
+        self.path = Path(path)
+        self._source = pa.memory_map(str(self.path), "r")
+        self.table = ipc.open_file(self._source).read_all()
+        self.ids = self.table.column(id_column).to_numpy()
+
+    @classmethod
+    def open(cls, meta_path, id_column="chunk_id"):
+        """Abre chunks.arrow; si no existe (datos de una versión anterior) lo genera desde el parquet."""
+        path = store_path(meta_path)
+        if not path.exists():
+            write_store(pq.read_table(str(meta_path)), path, id_column)
+        return cls(path, id_column)
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def positions(self, ids) -> np.ndarray:
+        """Posición de cada ID en el almacén (-1 si no existe)."""
+        ids = np.asarray(ids, dtype="int64")
+        if not len(self.ids):
+            return np.full(len(ids), -1, dtype="int64")
+        pos = np.searchsorted(self.ids, ids)
+        clipped = np.minimum(pos, len(self.ids) - 1)
+        return np.where(self.ids[clipped] == ids, clipped, -1)
+
+    def rows(self, positions):
+        """Filas (dicts) para las posiciones dadas; solo se copian esas filas."""
+        if len(positions) == 0:
+            return []
+        return self.table.take(pa.array(np.asarray(positions, dtype="int64"))).to_pylist()
+
+    def column(self, name):
+        return self.table.column(name)
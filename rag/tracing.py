@@ -0,0 +1,98 @@
+"""
+Trazas livianas por request: tiempos de cada etapa (encode, search, fetch, prompt_build,
+llm_first_token, llm_total...) y atributos (proveedor, cache_hit, tokens, abstención).
+
+Al terminar, cada traza alimenta los histogramas de rag/metrics.py y, si RAG_TRACE_FILE
+está definido, se agrega como una línea JSON a ese archivo.
+"""
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+
+from rag import metrics
+
+
+class TraceWriter:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def trace_writer():
+    """Escritor compartido (None si RAG_TRACE_FILE no está definido)."""
+    global _writer
+    path = os.getenv("RAG_TRACE_FILE")
+    if not path:
+        return None
+    with _writer_lock:
+        if _writer is None or _writer.path != path:
+            _writer = TraceWriter(path)
+        return _writer
+
+
+class Trace:
+    def __init__(self, kind: str, provider: str, query: str = None):
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.provider = provider
+        self.query = query
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.stages = {}
+        self.attrs = {}
+
+    @contextmanager
+    def span(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_timings(self, timings: dict):
+        """Agrega los tiempos por etapa que reporta Retriever.query(timings=...)."""
+        for name, value in timings.items():
+            if name == "batch":
+                self.attrs["batch_size"] = value
+            else:
+                self.add(name, value)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self, status="ok"):
+        self.stages["total"] = time.perf_counter() - self._t0
+        for name, seconds in self.stages.items():
+            metrics.STAGE_SECONDS.labels(name, self.provider).observe(seconds)
+        metrics.REQUESTS.labels(self.provider, status).inc()
+
+        writer = trace_writer()
+        if writer is not None:
+            writer.write({
+                "trace_id": self.id,
+                "kind": self.kind,
+                "provider": self.provider,
+                "status": status,
+                "ts": self.started,
+                "query": self.query,
+                "stages_ms": {k: round(v * 1000, 3) for k, v in self.stages.items()},
+                **self.attrs,
+            })
+        return self
@@ -39,6 +39,6 @@ python -m rag.embed
 
 # Ejecutar evaluación batch con gold_set usando el proveedor chatgpt (puedes cambiarlo)
 echo "Ejecutando evaluación batch sobre gold_set con ChatGPT..."
-python app.py evaluate --provider chatgpt --k 4
+python eval/evaluate.py --providers chatgpt --k 4
 
 echo "Pipeline y evaluación completados exitosamente."
\ No newline at end of file
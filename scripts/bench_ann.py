@@ -0,0 +1,136 @@
+"""
+Benchmark de índices FAISS aproximados (IVF-Flat, IVF-PQ, HNSW) contra el índice exacto.
+
+Genera corpus sintéticos (mezcla de gaussianas normalizada, dim 384 como MiniLM) y reporta
+para cada variante: recall@k respecto de IndexFlatIP, QPS (consultas de a una y en lote),
+memoria del índice serializado y tiempo de construcción.
+
+    python scripts/bench_ann.py --sizes 10000,100000,1000000 --k 5
+    python scripts/bench_ann.py --sizes 100000 --nprobe 4,16,64 --ef-search 32,128 --out bench_ann.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from rag.embed import make_index, train_index
+
+
+def synthetic_corpus(n, dim=384, n_clusters=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype("float32")
+    labels = rng.integers(0, n_clusters, n)
+    x = centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype("float32")
+    faiss.normalize_L2(x)
+    return x
+
+
+def synthetic_queries(corpus, n_queries, seed=1):
+    rng = np.random.default_rng(seed)
+    base = corpus[rng.choice(len(corpus), n_queries, replace=False)]
+    q = base + 0.3 * rng.standard_normal(base.shape).astype("float32")
+    faiss.normalize_L2(q)
+    return q
+
+
+def recall_at_k(I, gt, k):
+    hits = sum(len(set(I[i, :k]) & set(gt[i, :k])) for i in range(len(gt)))
+    return hits / (len(gt) * k)
+
+
+def index_bytes(index):
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def set_runtime(index, nprobe=None, ef_search=None):
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe:
+        ivf.nprobe = nprobe
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+    if isinstance(inner, faiss.IndexHNSW) and ef_search:
+        inner.hnsw.efSearch = ef_search
+
+
+def measure(index, queries, gt, k, single_queries=200):
+    t0 = time.perf_counter()
+    _, I = index.search(queries, k)
+    batch_qps = len(queries) / (time.perf_counter() - t0)
+
+    n_single = min(single_queries, len(queries))
+    t0 = time.perf_counter()
+    for i in range(n_single):
+        index.search(queries[i:i + 1], k)
+    single_qps = n_single / (time.perf_counter() - t0)
+    return {"recall": round(recall_at_k(I, gt, k), 4),
+            "qps_batch": round(batch_qps, 1),
+            "qps_single": round(single_qps, 1)}
+
+
+def bench_size(n, args):
+    print(f"\n=== Corpus sintético: {n} vectores, dim {args.dim} ===")
+    corpus = synthetic_corpus(n, args.dim)
+    queries = synthetic_queries(corpus, args.queries)
+    ids = np.arange(n, dtype="int64")
+
+    rows = []
+    variants = [("flat", {})]
+    variants += [("ivf", {"nprobe": p}) for p in args.nprobe]
+    variants += [("ivfpq", {"nprobe": p}) for p in args.nprobe]
+    variants += [("hnsw", {"ef_search": e}) for e in args.ef_search]
+
+    built = {}
+    gt = None
+    for index_type, runtime in variants:
+        if index_type not in built:
+            t0 = time.perf_counter()
+            index, params = make_index(index_type, args.dim, n)
+            train_index(index, corpus)
+            index.add_with_ids(corpus, ids)
+            built[index_type] = (index, params, time.perf_counter() - t0)
+        index, params, build_sec = built[index_type]
+
+        if gt is None:
+            _, gt = index.search(queries, args.k)  # el primero es flat: verdad de referencia
+
+        set_runtime(index, **runtime)
+        res = measure(index, queries, gt, args.k)
+        row = {"n": n, "index_type": index_type, **params, **runtime,
+               "build_sec": round(build_sec, 2), "memory_mb": round(index_bytes(index) / 2**20, 1), **res}
+        rows.append(row)
+        knob = ", ".join(f"{k}={v}" for k, v in runtime.items()) or "-"
+        print(f"{index_type:<7}{knob:<16} recall@{args.k}={res['recall']:<8} "
+              f"QPS 1x1={res['qps_single']:<10} QPS lote={res['qps_batch']:<10} "
+              f"mem={row['memory_mb']} MB  build={row['build_sec']}s")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de índices FAISS aproximados")
+    parser.add_argument("--sizes", default="10000,100000", help="Tamaños de corpus (coma)")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nprobe", default="8,32", help="Valores de nprobe para IVF")
+    parser.add_argument("--ef-search", default="64,128", help="Valores de efSearch para HNSW")
+    parser.add_argument("--out", default=None, help="Guardar resultados en JSON")
+    args = parser.parse_args()
+    args.nprobe = [int(x) for x in args.nprobe.split(",") if x]
+    args.ef_search = [int(x) for x in args.ef_search.split(",") if x]
+
+    rows = []
+    for n in [int(x) for x in args.sizes.split(",") if x]:
+        rows.extend(bench_size(n, args))
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+        print(f"\nResultados guardados en {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compara la recuperación por petición (un encode + search por consulta) con el micro-batching
+de Retriever.enable_batching a concurrencia creciente: throughput y latencia p50/p95/p99.
+
+    python scripts/bench_batcher.py --concurrency 1,4,16,64 --requests 512 --batch 32 --wait-ms 5
+
+Sin caché de embeddings, para que cada consulta pague el encode.
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+
+from rag.retrieve import Retriever
+
+
+def make_questions(retriever, n, seed=0):
+    """Consultas distintas: primeras palabras de chunks al azar."""
+    rng = np.random.default_rng(seed)
+    texts = retriever.store.column("text").to_pylist()
+    picks = rng.choice(len(texts), size=n, replace=len(texts) < n)
+    return [" ".join(texts[i].split()[:12]) + f" {k}" for k, i in enumerate(picks)]
+
+
+def run(retriever, questions, concurrency, top_k):
+    """`concurrency` hilos consumen la lista de consultas; devuelve (qps, latencias en ms)."""
+    latencies = []
+    lock = threading.Lock()
+    it = iter(questions)
+
+    def worker():
+        while True:
+            with lock:
+                q = next(it, None)
+            if q is None:
+                return
+            start = time.perf_counter()
+            retriever.query(q, top_k=top_k)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return len(questions) / (time.perf_counter() - start), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-batching de consultas vs camino por petición")
+    parser.add_argument("--index", default=None, help="Por defecto, el snapshot vigente")
+    parser.add_argument("--meta", default=None)
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument("--requests", type=int, default=512)
+    parser.add_argument("--batch", type=int, default=32, help="Tamaño máximo del lote")
+    parser.add_argument("--wait-ms", type=float, default=5.0, help="Espera máxima para juntar un lote")
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    retriever = Retriever(args.index, args.meta, cache_size=0)
+    questions = make_questions(retriever, args.requests)
+    retriever.query(questions[0], top_k=args.k)  # calentamiento
+
+    print(f"{'modo':<10}{'conc':>6}{'QPS':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'lote medio':>12}")
+    for c in [int(x) for x in args.concurrency.split(",") if x]:
+        for mode in ("directo", "batch"):
+            retriever.enable_batching(args.batch if mode == "batch" else 0, args.wait_ms)
+            qps, lat = run(retriever, questions, c, args.k)
+            p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+            stats = retriever.batch_stats()
+            avg = f"{stats['avg_batch']:>12}" if stats else f"{'-':>12}"
+            print(f"{mode:<10}{c:>6}{qps:>9.1f}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}{avg}")
+
+
+if __name__ == "__main__":
+    main()
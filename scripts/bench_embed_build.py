@@ -0,0 +1,69 @@
+"""
+Compara la codificación de chunks.parquet en una sola llamada a encode (build_index sin
+--workers) con la codificación por row groups en varios procesos de rag/embed_build.py.
+
+    python scripts/bench_embed_build.py --docs 20000 --workers 1,2,4,8
+
+Reporta chunks/s de cada variante y verifica que los vectores coincidan con los de la
+llamada única (coseno mínimo por fila).
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+
+import numpy as np
+import pyarrow.parquet as pq
+
+from rag.embed import _encode
+from rag.embed_build import EmbeddingBuild, workers_count
+from rag.encoder import get_engine
+from rag.snapshots import resolve
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Velocidad de la codificación en varios procesos con checkpoints")
+    parser.add_argument("--meta", default=None, help="Por defecto, los chunks del snapshot vigente")
+    parser.add_argument("--docs", type=int, default=20000, help="Chunks a codificar (los primeros del parquet)")
+    parser.add_argument("--workers", default="1,2,4", help="Procesos a probar, separados por coma (0 = todos)")
+    parser.add_argument("--backend", choices=["st", "onnx"], default=None)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    args = parser.parse_args()
+
+    source = args.meta or str(resolve()[1])
+    n_rows = pq.ParquetFile(source).metadata.num_rows
+    select = np.arange(n_rows) < args.docs
+    texts = pq.read_table(source, columns=["text"]).column("text").to_pylist()[:args.docs]
+
+    engine = get_engine(args.backend, batch_size=args.batch_size)
+    engine.encode(texts[:args.batch_size])  # calentamiento
+    start = time.perf_counter()
+    reference = _encode(engine, texts)
+    single = len(texts) / (time.perf_counter() - start)
+
+    print(f"{'variante':<22}{'chunks/s':>10}{'x':>7}{'coseno min':>12}")
+    print(f"{'una llamada':<22}{single:>10.1f}{1.0:>7.2f}{1.0:>12.4f}")
+    for w in [int(x) for x in args.workers.split(",") if x.strip()]:
+        work_dir = tempfile.mkdtemp(prefix="embed_build_")
+        try:
+            job = EmbeddingBuild(source, select=select, backend=args.backend, workers=w,
+                                 batch_size=args.batch_size, dtype=args.dtype, work_dir=work_dir)
+            # Incluye el arranque de los procesos y la carga del modelo en cada uno
+            start = time.perf_counter()
+            vecs = np.asarray(job.run(), dtype="float32")
+            rate = len(texts) / (time.perf_counter() - start)
+            cos = float(np.min(np.sum(vecs * reference, axis=1))) if len(vecs) else 1.0
+            name = f"{workers_count(w)} procesos ({args.dtype})"
+            print(f"{name:<22}{rate:>10.1f}{rate / single:>7.2f}{cos:>12.4f}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compara los motores de embeddings de rag/encoder.py: velocidad de codificación (chunks y
+consultas) y paridad de rankings del backend ONNX int8 contra sentence-transformers.
+
+    python scripts/bench_encoder.py --docs 2000 --threads 4
+
+Termina con código 1 si la paridad queda fuera de tolerancia (PARITY_MIN_COSINE /
+PARITY_MIN_OVERLAP).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+
+from rag.encoder import EmbeddingEngine, parity_check
+from rag.snapshots import resolve
+
+
+def load_texts(meta_path, gold_path, n_docs):
+    from rag.store import ChunkStore
+    store = ChunkStore.open(meta_path)
+    corpus = store.column("text").to_pylist()[:n_docs]
+    with open(gold_path, "r", encoding="utf-8") as f:
+        queries = [json.loads(line)["question"] for line in f]
+    return corpus, queries
+
+
+def throughput(engine, texts, batch_size):
+    engine.encode(texts[:batch_size])  # calentamiento
+    start = time.perf_counter()
+    engine.encode(texts, batch_size=batch_size)
+    return len(texts) / (time.perf_counter() - start)
+
+
+def query_latency_ms(engine, queries, reps=5):
+    start = time.perf_counter()
+    for _ in range(reps):
+        for q in queries:
+            engine.encode([q])
+    return (time.perf_counter() - start) * 1000 / (reps * len(queries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Velocidad y paridad de los motores de embeddings")
+    parser.add_argument("--meta", default=None, help="Por defecto, los chunks del snapshot vigente")
+    parser.add_argument("--gold", default="eval/gold_set.jsonl")
+    parser.add_argument("--docs", type=int, default=2000, help="Chunks a codificar")
+    parser.add_argument("--threads", type=int, default=None, help="Hilos intra-op (por defecto todos)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    corpus, queries = load_texts(args.meta or resolve()[1], args.gold, args.docs)
+    engines = {
+        "st": EmbeddingEngine("st", threads=args.threads, batch_size=args.batch_size),
+        "onnx": EmbeddingEngine("onnx", threads=args.threads, batch_size=args.batch_size, quantize=False),
+        "onnx-int8": EmbeddingEngine("onnx", threads=args.threads, batch_size=args.batch_size, quantize=True),
+    }
+
+    print(f"{'motor':<12}{'chunks/s':>10}{'ms/consulta':>13}")
+    for name, engine in engines.items():
+        print(f"{name:<12}{throughput(engine, corpus, args.batch_size):>10.1f}"
+              f"{query_latency_ms(engine, queries):>13.2f}")
+
+    failed = False
+    for name in ("onnx", "onnx-int8"):
+        report = parity_check(engines["st"], engines[name], corpus, queries, k=args.k)
+        failed |= not report["ok"]
+        print(f"paridad st vs {name}: " + ", ".join(
+            f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}" for k, v in report.items()))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Búsqueda filtrada vs sin filtrar a medida que crece el corpus (vectores sintéticos, sin modelo).
+
+Para cada tamaño se arma un índice plano con documentos de --chunks-per-doc chunks y se comparan:
+  - sin filtro:   búsqueda en todo el índice
+  - post-filtro:  búsqueda en todo el índice con k grande y descarte de lo que no cumple el filtro
+                  (lo que se hacía antes; puede devolver menos de k resultados)
+  - selector:     índice principal con IDSelectorBatch (rama para filtros que abarcan muchos documentos)
+  - sub-índices:  ShardSet sobre data/shards/ (doc_id, y doc_id + rango de páginas con IDSelectorRange)
+
+    python scripts/bench_filters.py --sizes 10000,100000,500000 --queries 200
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import faiss
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+
+from rag.shards import ShardSet, build_shards, normalize_filters
+
+
+def make_corpus(n, chunks_per_doc, dim, rng):
+    vecs = rng.standard_normal((n, dim)).astype("float32")
+    faiss.normalize_L2(vecs)
+    n_docs = max(1, n // chunks_per_doc)
+    doc = np.arange(n) % n_docs
+    df = pd.DataFrame({
+        "doc_id": [f"reglamento-{d:05d}" for d in doc],
+        "title": [f"Reglamento {d} {2000 + d % 25}" for d in doc],
+        "page": (np.arange(n) // n_docs) // 4 + 1,
+        "chunk_id": rng.permutation(np.arange(1, n + 1, dtype="int64") * 7919),
+        "text": "",
+    })
+    return df, vecs, n_docs
+
+
+def timed(fn, queries):
+    lat = []
+    out = []
+    for q in queries:
+        start = time.perf_counter()
+        out.append(fn(q[None, :]))
+        lat.append((time.perf_counter() - start) * 1000)
+    return np.percentile(lat, [50, 95]), out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia de búsquedas filtradas vs sin filtrar")
+    parser.add_argument("--sizes", default="10000,100000,500000")
+    parser.add_argument("--chunks-per-doc", type=int, default=400)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--post-k", type=int, default=200, help="k de la búsqueda completa en el post-filtro")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print(f"{'chunks':>9} {'filtro':<18} {'método':<12} {'p50 ms':>8} {'p95 ms':>8} {'k ok':>6} {'= exacto':>9}")
+    for n in [int(x) for x in args.sizes.split(",") if x]:
+        df, vecs, n_docs = make_corpus(n, args.chunks_per_doc, args.dim, rng)
+        ids = df["chunk_id"].to_numpy()
+        index = faiss.IndexIDMap2(faiss.IndexFlatIP(args.dim))
+        index.add_with_ids(vecs, ids)
+        queries = vecs[rng.choice(n, args.queries)] + 0.05 * rng.standard_normal((args.queries, args.dim)).astype("float32")
+        faiss.normalize_L2(queries)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            meta, _ = build_shards(tmp, df, args.dim, ids, vecs, encode=None)
+            shards = ShardSet(tmp, meta)
+            doc = meta.docs[0]["doc_id"]
+            cases = {
+                "ninguno": None,
+                "doc_id": normalize_filters({"doc_id": doc}),
+                "doc_id + páginas": normalize_filters({"doc_id": doc, "page": [2, 3]}),
+            }
+            for name, filters in cases.items():
+                ranges = meta.resolve(filters) if filters else None
+                allowed = np.ascontiguousarray(meta.allowed_ids(ranges)) if ranges else ids
+                selector = faiss.IDSelectorBatch(len(allowed), faiss.swig_ptr(allowed))
+                exact_params = faiss.SearchParameters(sel=selector)
+                _, exact = timed(lambda q: index.search(q, args.k, params=exact_params)[1][0], queries)
+
+                methods = {"completo": lambda q: index.search(q, args.k)[1][0]}
+                if filters:
+                    allowed_set = set(allowed.tolist())
+                    methods = {
+                        "post-filtro": lambda q: np.array([i for i in index.search(q, args.post_k)[1][0]
+                                                           if i in allowed_set][:args.k]),
+                        "selector": lambda q: index.search(q, args.k, params=exact_params)[1][0],
+                        "sub-índices": lambda q: shards.search(q, args.k, ranges)[1][0],
+                    }
+                for method, fn in methods.items():
+                    (p50, p95), out = timed(fn, queries)
+                    full = np.mean([len(o) == args.k for o in out])
+                    same = np.mean([np.array_equal(np.sort(o), np.sort(e)) for o, e in zip(out, exact)])
+                    print(f"{n:>9} {name:<18} {method:<12} {p50:>8.2f} {p95:>8.2f} {full:>6.2f} {same:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Mide la memoria por worker al cargar el índice y los metadatos de los chunks, comparando
+la carga tradicional (faiss.read_index + pd.read_parquet) con la carga mapeada en memoria
+(IO_FLAG_MMAP + chunks.arrow).
+
+Lanza N procesos independientes (como workers de gunicorn), cada uno carga los datos, hace
+consultas aleatorias para tocar las páginas y reporta RSS y PSS (/proc/self/smaps_rollup;
+PSS reparte las páginas compartidas entre los procesos que las usan).
+
+    python scripts/bench_memory.py --workers 1,4,16
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+
+from rag.snapshots import resolve
+
+
+def _mem_kb():
+    """(RSS, PSS) del proceso actual en KB."""
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                values[parts[0][:-1]] = int(parts[1])
+    return values.get("Rss", 0), values.get("Pss", 0)
+
+
+def worker(mode, index_path, meta_path, n_queries, hold):
+    """Cuerpo de un worker: carga, consulta y reporta memoria en una línea JSON."""
+    import numpy as np
+    import faiss
+    import pandas as pd
+    from rag.retrieve import read_index
+    from rag.store import ChunkStore
+
+    # Las importaciones quedan fuera de la medición: solo cuenta la carga de datos
+    rss0, _ = _mem_kb()
+    t0 = time.perf_counter()
+    if mode == "mmap":
+        index = read_index(index_path, mmap=True)
+        store = ChunkStore.open(meta_path)
+        fetch = lambda ids: store.rows(store.positions(ids))
+    else:
+        index = faiss.read_index(index_path)
+        df = pd.read_parquet(meta_path)
+        # Con IndexIDMap2 los IDs no son posiciones; para medir memoria basta una fila por hit
+        fetch = lambda ids: [df.iloc[int(i) % len(df)].to_dict() for i in ids]
+    load_sec = time.perf_counter() - t0
+
+    rng = np.random.default_rng(os.getpid())
+    q = rng.standard_normal((n_queries, index.d)).astype("float32")
+    faiss.normalize_L2(q)
+    for i in range(n_queries):
+        _, I = index.search(q[i:i + 1], 5)
+        fetch([x for x in I[0] if x >= 0])
+
+    rss, pss = _mem_kb()
+    print(json.dumps({"load_sec": load_sec, "rss_kb": rss - rss0, "pss_kb": pss, "rss_total_kb": rss}), flush=True)
+    time.sleep(hold)  # mantener vivos los workers mientras los demás miden (páginas compartidas)
+
+
+def run(mode, n_workers, args):
+    cmd = [sys.executable, __file__, "--worker", mode, "--index", args.index, "--meta", args.meta,
+           "--queries", str(args.queries), "--hold", str(args.hold)]
+    procs = [subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.PIPE, text=True) for _ in range(n_workers)]
+    reports = [json.loads(p.stdout.readline()) for p in procs]
+    for p in procs:
+        p.wait()
+    return {
+        "mode": mode,
+        "workers": n_workers,
+        "load_sec_avg": round(sum(r["load_sec"] for r in reports) / n_workers, 3),
+        "rss_delta_mb_per_worker": round(sum(r["rss_kb"] for r in reports) / n_workers / 1024, 1),
+        "pss_mb_total": round(sum(r["pss_kb"] for r in reports) / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria por worker: carga tradicional vs mmap")
+    parser.add_argument("--workers", default="1,4,16")
+    parser.add_argument("--index", default=None, help="Por defecto, el snapshot vigente")
+    parser.add_argument("--meta", default=None)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--hold", type=float, default=2.0, help=argparse.SUPPRESS)
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    index_path, meta_path, _ = resolve(args.index, args.meta)
+    args.index, args.meta = str(index_path), str(meta_path)
+
+    if args.worker:
+        worker(args.worker, args.index, args.meta, args.queries, args.hold)
+        return
+
+    print(f"{'modo':<8}{'workers':>8}{'carga s':>10}{'ΔRSS MB/worker':>16}{'PSS MB total':>14}")
+    for n in [int(x) for x in args.workers.split(",") if x]:
+        for mode in ("legacy", "mmap"):
+            r = run(mode, n, args)
+            print(f"{r['mode']:<8}{r['workers']:>8}{r['load_sec_avg']:>10}"
+                  f"{r['rss_delta_mb_per_worker']:>16}{r['pss_mb_total']:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Servidor local compatible con la API de OpenAI (/v1/chat/completions), con y sin streaming.
+Sirve para probar providers, web.py y scripts de carga sin red ni API keys reales.
+
+Uso:
+    python scripts/fake_openai_server.py --port 8000 --latency 0.5 --token-delay 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8000/v1 OPENAI_API_KEY=fake python web.py
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _fake_answer(messages, n_tokens):
+    """Respuesta determinista que cita el primer fragmento presente en el prompt."""
+    user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    labels = re.findall(r"^\[([^\]]+)\]", user, flags=re.MULTILINE)
+    citation = f" [{labels[0]}]" if labels else ""
+    words = ["Según", "la", "normativa", "UFRO,"] + ["lorem"] * max(n_tokens - 5, 0)
+    return " ".join(words) + citation + "."
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Configuración compartida (se asigna en make_server)
+    latency = 0.0
+    token_delay = 0.0
+    error_rate = 0.0
+    slow_rate = 0.0
+    slow_latency = 0.0
+    n_tokens = 40
+    stats = None
+    stats_lock = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _count(self, key):
+        with self.stats_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            with self.stats_lock:
+                self._send_json(200, dict(self.stats))
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        req = json.loads(self.rfile.read(length) or b"{}")
+        self._count("requests")
+
+        # Cola de latencia: una fracción de las respuestas tarda slow_latency en vez de latency
+        if random.random() < self.slow_rate:
+            self._count("slow")
+            time.sleep(self.slow_latency)
+        else:
+            time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self._count("errors")
+            self._send_json(500, {"error": {"message": "fake upstream error", "type": "server_error"}})
+            return
+
+        model = req.get("model", "fake-model")
+        text = _fake_answer(req.get("messages", []), self.n_tokens)
+        prompt_tokens = sum(len(m.get("content", "").split()) for m in req.get("messages", []))
+        completion_tokens = len(text.split())
+        created = int(time.time())
+
+        if not req.get("stream"):
+            self._send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, word in enumerate(text.split(" ")):
+            delta = word if i == 0 else " " + word
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            time.sleep(self.token_delay)
+        final = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def make_server(host="127.0.0.1", port=8000, latency=0.0, token_delay=0.0, error_rate=0.0, n_tokens=40,
+                slow_rate=0.0, slow_latency=0.0):
+    """Crea el servidor con su propia configuración (permite varios en un mismo proceso)."""
+    handler = type("ConfiguredFakeOpenAIHandler", (FakeOpenAIHandler,), {
+        "latency": latency,
+        "token_delay": token_delay,
+        "error_rate": error_rate,
+        "slow_rate": slow_rate,
+        "slow_latency": slow_latency,
+        "n_tokens": n_tokens,
+        "stats": {},
+        "stats_lock": threading.Lock(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(**kwargs):
+    """Levanta el servidor en un hilo daemon y devuelve (server, base_url)."""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor falso compatible con OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Segundos antes de responder")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Segundos entre tokens (stream)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de respuestas HTTP 500")
+    parser.add_argument("--tokens", type=int, default=40, help="Largo aproximado de la respuesta")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fracción de respuestas lentas (cola)")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="Segundos de las respuestas lentas")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.token_delay, args.error_rate, args.tokens,
+                         args.slow_rate, args.slow_latency)
+    print(f"Servidor falso OpenAI escuchando en http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
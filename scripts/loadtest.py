@@ -0,0 +1,289 @@
+"""
+Prueba de carga de la API contra un LLM falso local (sin red ni costo).
+
+Levanta scripts/fake_openai_server.py en este proceso, arranca cada servidor objetivo
+apuntando sus providers al LLM falso y mide throughput y latencias p50/p95/p99 de /api/chat.
+
+    python scripts/loadtest.py --requests 500 --concurrency 100 --llm-latency 1.0
+    python scripts/loadtest.py --targets async --url externo=http://10.0.0.5:8082
+
+Objetivos incluidos:
+    flask  -> gunicorn (workers síncronos) sirviendo web:app
+    async  -> web_async.py (aiohttp + AsyncOpenAI)
+
+Escenario de ráfagas (--scenario burst): oleadas de peticiones simultáneas donde la mayoría
+repite la misma pregunta (p. ej. tras un anuncio de plazos). Compara web.py con workers gthread
+sin protección y con coalescing + control de admisión: llamadas al LLM (contadas por el
+servidor falso en /stats), códigos 429/503 y latencias de las respuestas 200.
+
+    python scripts/loadtest.py --scenario burst --waves 5 --wave-size 200 --hot-share 0.8
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import subprocess
+import urllib.request
+
+import aiohttp
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from fake_openai_server import start_in_thread
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+TARGETS = {
+    "flask": ["gunicorn", "-w", "{workers}", "-b", "127.0.0.1:{port}", "web:app"],
+    "async": [sys.executable, "web_async.py", "--host", "127.0.0.1", "--port", "{port}"],
+}
+
+
+def load_questions(path=os.path.join(ROOT, "eval", "gold_set.jsonl")):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["question"] for line in f if line.strip()]
+
+
+def spawn(name, port, workers, env):
+    cmd = [part.format(port=port, workers=workers) for part in TARGETS[name]]
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
+
+async def wait_ready(base_url, timeout=180):
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.time() < deadline:
+            try:
+                async with session.get(f"{base_url}/api/stats") as resp:
+                    if resp.status == 200:
+                        return True
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    return False
+
+
+async def run_load(base_url, questions, n_requests, concurrency, provider="chatgpt", payload_fn=None):
+    """Lanza n_requests POST /api/chat con a lo más `concurrency` en vuelo."""
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=300)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def one(i):
+            payload = payload_fn(i) if payload_fn else {
+                "question": random.choice(questions), "provider": provider
+            }
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    async with session.post(f"{base_url}/api/chat", json=payload) as resp:
+                        await resp.read()
+                        status = resp.status
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    status = "error"
+                elapsed = time.perf_counter() - t0
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(elapsed)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(n_requests)))
+        wall = time.perf_counter() - start
+
+    return summarize(latencies, statuses, wall)
+
+
+async def run_burst(base_url, questions, waves, wave_size, gap, hot_share, provider="chatgpt"):
+    """
+    `waves` oleadas de `wave_size` POST /api/chat simultáneos (sin límite de concurrencia del
+    cliente); una fracción hot_share de cada oleada pregunta lo mismo (questions[0]).
+    """
+    latencies = []
+    statuses = {}
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=300)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def one():
+            question = questions[0] if random.random() < hot_share else random.choice(questions)
+            t0 = time.perf_counter()
+            try:
+                async with session.post(f"{base_url}/api/chat",
+                                        json={"question": question, "provider": provider}) as resp:
+                    await resp.read()
+                    status = resp.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = "error"
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(time.perf_counter() - t0)
+
+        start = time.perf_counter()
+        for wave in range(waves):
+            await asyncio.gather(*(one() for _ in range(wave_size)))
+            if wave < waves - 1:
+                await asyncio.sleep(gap)
+        wall = time.perf_counter() - start
+
+    return summarize(latencies, statuses, wall)
+
+
+def upstream_calls(llm_url) -> int:
+    """Llamadas recibidas por el LLM falso (GET /stats)."""
+    with urllib.request.urlopen(llm_url.rsplit("/v1", 1)[0] + "/stats") as resp:
+        return json.loads(resp.read()).get("requests", 0)
+
+
+def summarize(latencies, statuses, wall):
+    lat = np.array(latencies) if latencies else np.array([np.nan])
+    ok = len(latencies)
+    return {
+        "requests": sum(statuses.values()),
+        "ok": ok,
+        "statuses": {str(k): v for k, v in statuses.items()},
+        "wall_sec": round(wall, 3),
+        "throughput_rps": round(ok / wall, 2) if wall else 0.0,
+        "p50_sec": round(float(np.percentile(lat, 50)), 4),
+        "p95_sec": round(float(np.percentile(lat, 95)), 4),
+        "p99_sec": round(float(np.percentile(lat, 99)), 4),
+    }
+
+
+def print_table(results):
+    print(f"\n{'objetivo':<12}{'ok/total':>12}{'rps':>10}{'p50 s':>10}{'p95 s':>10}{'p99 s':>10}")
+    for name, r in results.items():
+        print(f"{name:<12}{str(r['ok']) + '/' + str(r['requests']):>12}{r['throughput_rps']:>10}"
+              f"{r['p50_sec']:>10}{r['p95_sec']:>10}{r['p99_sec']:>10}")
+
+
+def print_burst_table(results):
+    print(f"\n{'configuración':<24}{'200':>6}{'429':>6}{'503':>6}{'LLM':>6}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}")
+    for name, r in results.items():
+        st = r["statuses"]
+        print(f"{name:<24}{st.get('200', 0):>6}{st.get('429', 0):>6}{st.get('503', 0):>6}{r['upstream_calls']:>6}"
+              f"{r['p50_sec']:>9}{r['p95_sec']:>9}{r['p99_sec']:>9}")
+
+
+def burst_scenario(args, llm_url, questions):
+    """web.py (gunicorn gthread) sin protección vs con coalescing + admisión, bajo ráfagas."""
+    configs = {
+        "sin protección": {"COALESCE": "0", "ADMISSION_RPS": "0", "PROVIDER_CONCURRENCY": ""},
+        "coalescing + admisión": {
+            "COALESCE": "1",
+            "ADMISSION_RPS": str(args.admission_rps),
+            "ADMISSION_BURST": str(args.admission_burst),
+            "PROVIDER_CONCURRENCY": str(args.provider_concurrency),
+            "ADMISSION_QUEUE": str(args.admission_queue),
+            "ADMISSION_QUEUE_TIMEOUT": str(args.queue_timeout),
+        },
+    }
+    results = {}
+    for i, (name, extra) in enumerate(configs.items()):
+        port = args.port + i
+        base_url = f"http://127.0.0.1:{port}"
+        env = fake_llm_env(llm_url, dict(extra, WEB_THREADS=str(args.threads)))
+        proc = spawn("flask", port, args.workers, env)
+        try:
+            if not asyncio.run(wait_ready(base_url)):
+                print(f"{name}: no respondió a tiempo, se omite")
+                continue
+            asyncio.run(run_load(base_url, questions, min(20, args.requests), 4))  # calentamiento
+            before = upstream_calls(llm_url)
+            print(f"Midiendo {name} ({args.waves} oleadas de {args.wave_size})...")
+            results[name] = asyncio.run(run_burst(base_url, questions, args.waves, args.wave_size,
+                                                  args.wave_gap, args.hot_share))
+            results[name]["upstream_calls"] = upstream_calls(llm_url) - before
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+    print_burst_table(results)
+    return results
+
+
+def fake_llm_env(llm_url, extra=None):
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": llm_url,
+        "DEEPSEEK_BASE_URL": llm_url,
+        "OPENAI_API_KEY": "fake",
+        "DEEPSEEK_API_KEY": "fake",
+        "ANSWER_CACHE": "0",  # que la caché no oculte el costo del LLM
+    })
+    env.update(extra or {})
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga Flask vs asyncio con LLM falso")
+    parser.add_argument("--targets", default="flask,async", help="Objetivos a levantar (coma)")
+    parser.add_argument("--url", action="append", default=[], help="Objetivo ya levantado: nombre=http://host:puerto")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=4, help="Workers de gunicorn (flask)")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Latencia del LLM falso (s)")
+    parser.add_argument("--port", type=int, default=8090, help="Puerto base para los objetivos")
+    parser.add_argument("--out", default=None, help="Guardar resultados en JSON")
+    parser.add_argument("--scenario", choices=["compare", "burst"], default="compare",
+                        help="compare = objetivos con carga sostenida; burst = ráfagas sobre web.py")
+    parser.add_argument("--waves", type=int, default=5, help="Oleadas (burst)")
+    parser.add_argument("--wave-size", type=int, default=200, help="Peticiones simultáneas por oleada (burst)")
+    parser.add_argument("--wave-gap", type=float, default=2.0, help="Segundos entre oleadas (burst)")
+    parser.add_argument("--hot-share", type=float, default=0.8, help="Fracción que repite la misma pregunta (burst)")
+    parser.add_argument("--threads", type=int, default=32, help="Hilos por worker gthread (burst)")
+    parser.add_argument("--provider-concurrency", type=int, default=16, help="Ejecuciones por proveedor y worker (burst)")
+    parser.add_argument("--admission-rps", type=float, default=100.0, help="Tasa de admisión por worker (burst)")
+    parser.add_argument("--admission-burst", type=float, default=200.0, help="Ráfaga admitida por worker (burst)")
+    parser.add_argument("--admission-queue", type=int, default=32, help="Cola por proveedor y worker (burst)")
+    parser.add_argument("--queue-timeout", type=float, default=3.0, help="Espera máxima en cola, s (burst)")
+    args = parser.parse_args()
+
+    llm_server, llm_url = start_in_thread(port=0, latency=args.llm_latency)
+    print(f"LLM falso en {llm_url} (latencia {args.llm_latency}s)")
+    questions = load_questions()
+    env = fake_llm_env(llm_url)
+
+    if args.scenario == "burst":
+        results = burst_scenario(args, llm_url, questions)
+        llm_server.shutdown()
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        return
+
+    results = {}
+    targets = [t for t in args.targets.split(",") if t]
+    for i, name in enumerate(targets):
+        port = args.port + i
+        base_url = f"http://127.0.0.1:{port}"
+        proc = spawn(name, port, args.workers, env)
+        try:
+            if not asyncio.run(wait_ready(base_url)):
+                print(f"{name}: no respondió a tiempo, se omite")
+                continue
+            asyncio.run(run_load(base_url, questions, min(20, args.requests), 4))  # calentamiento
+            print(f"Midiendo {name} ({args.requests} peticiones, concurrencia {args.concurrency})...")
+            results[name] = asyncio.run(run_load(base_url, questions, args.requests, args.concurrency))
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    for spec in args.url:
+        name, base_url = spec.split("=", 1)
+        print(f"Midiendo {name} en {base_url}...")
+        results[name] = asyncio.run(run_load(base_url.rstrip("/"), questions, args.requests, args.concurrency))
+
+    llm_server.shutdown()
+    print_table(results)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Prueba RouterProvider contra dos servidores falsos locales (scripts/fake_openai_server.py):
+
+  - "chatgpt":  rápido, pero con cola de latencia (slow_rate) y errores ocasionales
+  - "deepseek": más lento y estable
+
+Fases: proveedor único con los reintentos de RAGPipeline vs enrutador (hedging), caída total
+de "chatgpt" (el circuito se abre y el tráfico pasa a "deepseek"), recuperación (prueba en
+half_open) y una ronda concurrente con asyncio.
+
+    python scripts/router_demo.py --requests 200
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+from collections import Counter
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(__file__))
+
+from fake_openai_server import start_in_thread
+from providers.chatgpt import ChatGPTProvider
+from providers.deepseek import DeepSeekProvider
+from providers.router import RouterProvider
+
+MESSAGES = [{"role": "user", "content": "Fragmentos relevantes:\n[Reglamento, p1] texto\n¿Pregunta?"}]
+
+
+def report(name, latencies, errors, served=None):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (0, 0, 0)
+    extra = f" servidos={dict(served)}" if served else ""
+    print(f"{name:<28} n={len(latencies) + errors:<5} errores={errors:<4} "
+          f"p50={p50:.3f}s p95={p95:.3f}s p99={p99:.3f}s{extra}")
+
+
+def single_with_retries(provider, n, retries=3, retry_wait=2.0):
+    """Lo que hacía RAGPipeline: mismo proveedor, hasta 3 intentos con 2 s fijos entre ellos."""
+    latencies, errors = [], 0
+    for _ in range(n):
+        start = time.monotonic()
+        for attempt in range(1, retries + 1):
+            try:
+                provider.chat(MESSAGES, max_tokens=64)
+                latencies.append(time.monotonic() - start)
+                break
+            except Exception:
+                if attempt == retries:
+                    errors += 1
+                else:
+                    time.sleep(retry_wait)
+    return latencies, errors
+
+
+def routed(router, n):
+    latencies, errors, served = [], 0, Counter()
+    for _ in range(n):
+        start = time.monotonic()
+        try:
+            served[router.chat_with_usage(MESSAGES, max_tokens=64)["backend"]] += 1
+            latencies.append(time.monotonic() - start)
+        except Exception:
+            errors += 1
+    return latencies, errors, served
+
+
+async def routed_async(router, n, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    latencies, served = [], Counter()
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        async with sem:
+            start = time.monotonic()
+            try:
+                served[(await router.achat_with_usage(MESSAGES, max_tokens=64))["backend"]] += 1
+                latencies.append(time.monotonic() - start)
+            except Exception:
+                errors += 1
+
+    await asyncio.gather(*(one() for _ in range(n)))
+    return latencies, errors, served
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Demo del enrutador con hedging y circuit breaker")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--cooldown", type=float, default=3.0)
+    args = parser.parse_args()
+
+    fast, fast_url = start_in_thread(latency=0.05, slow_rate=0.1, slow_latency=2.0, error_rate=0.05, n_tokens=20)
+    stable, stable_url = start_in_thread(latency=0.25, n_tokens=20)
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    os.environ.setdefault("DEEPSEEK_API_KEY", "fake")
+
+    def backends():
+        return [ChatGPTProvider(base_url=fast_url, max_retries=0), DeepSeekProvider(base_url=stable_url, max_retries=0)]
+
+    n = args.requests
+    report("solo chatgpt + reintentos", *single_with_retries(backends()[0], n))
+
+    router = RouterProvider(backends(), deadline=10.0, cooldown=args.cooldown)
+    report("router (hedging)", *routed(router, n))
+    print(f"  estado: {router.stats()}")
+
+    # Caída total del backend rápido: el circuito se abre y todo va al estable
+    fast.RequestHandlerClass.error_rate = 1.0
+    report("router, chatgpt caído", *routed(router, n // 2))
+    print(f"  estado: {router.stats()}")
+
+    # Recuperación: tras el cooldown pasa una petición de prueba y el circuito se cierra
+    fast.RequestHandlerClass.error_rate = 0.0
+    time.sleep(args.cooldown)
+    report("router, chatgpt recuperado", *routed(router, n // 2))
+    print(f"  estado: {router.stats()}")
+
+    report(f"router async (x{args.concurrency})", *asyncio.run(routed_async(router, n, args.concurrency)))
+    print(f"  peticiones recibidas: chatgpt={fast.RequestHandlerClass.stats} deepseek={stable.RequestHandlerClass.stats}")
+
+    fast.shutdown()
+    stable.shutdown()
+
+
+if __name__ == "__main__":
+    main()
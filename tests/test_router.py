@@ -0,0 +1,51 @@
+from providers.router import RouterProvider
+
+
+class StreamProvider:
+    """Proveedor falso: el stream se cancela antes de entregar el primer fragmento."""
+
+    name = "fake"
+    model = "fake"
+
+    def __init__(self, cancel=True):
+        self.cancel = cancel
+
+    def chat_stream(self, messages, **kwargs):
+        if self.cancel:
+            raise GeneratorExit
+        yield "hola"
+
+
+def half_open(router):
+    breaker = router.backends[0].breaker
+    breaker.failure()
+    breaker.opened_at -= breaker.cooldown + 1
+    return breaker
+
+
+def test_stream_closed_before_first_delta_releases_probe():
+    router = RouterProvider([StreamProvider()], failure_threshold=1, cooldown=30.0)
+    breaker = half_open(router)
+
+    stream = router.chat_stream([{"role": "user", "content": "hola"}])
+    try:
+        next(stream)
+    except (GeneratorExit, RuntimeError):
+        pass
+    stream.close()
+
+    assert breaker.state == "half_open"
+    assert not breaker.probe_in_flight
+    assert breaker.acquire()
+
+
+def test_stream_closed_after_first_delta_closes_circuit():
+    router = RouterProvider([StreamProvider(cancel=False)], failure_threshold=1, cooldown=30.0)
+    breaker = half_open(router)
+
+    stream = router.chat_stream([{"role": "user", "content": "hola"}])
+    assert next(stream) == "hola"
+    stream.close()
+
+    assert breaker.state == "closed"
+    assert breaker.acquire()
@@ -1,23 +1,126 @@
-from flask import Flask, request, render_template_string, jsonify
-from rag.pipeline import RAGPipeline
-from rag.retrieve import Retriever
-from providers.chatgpt import ChatGPTProvider
-from providers.deepseek import DeepSeekProvider
+"""
+Interfaz web y API JSON (Flask).
+
+El retriever (modelo + índice) y los proveedores se cargan una vez por proceso en init():
+  - WEB_PRELOAD=1: al importar el módulo. Con `gunicorn --preload` (ver gunicorn.conf.py)
+    ocurre en el master antes del fork y los workers comparten modelo e índice copy-on-write.
+  - sin preload: en cada worker al iniciar (hook post_worker_init) o en la primera petición.
+"""
+import gc
+import os
+import json
+import atexit
+import logging
+import threading
+from contextlib import nullcontext
+
+from rag.startup import StartupTimer
+
+startup = StartupTimer()
+with startup.phase("import"):
+    from flask import Flask, request, render_template_string, jsonify, Response, stream_with_context
+    from rag.pipeline import RAGPipeline
+    from rag.retrieve import Retriever, normalize_mode
+    from rag.answer_cache import AnswerCache
+    from rag.rerank import CrossEncoderReranker
+    from rag import encoder, metrics
+    from rag.profiling import SlowRequestProfiler
+    from rag.shards import normalize_filters
+    from rag.admission import AdmissionController, SingleFlight, Overloaded, coalesce_key
+    from providers.chatgpt import ChatGPTProvider
+    from providers.deepseek import DeepSeekProvider
+    from providers.router import RouterProvider
 
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 
-# Inicializar retriever y providers
-retriever = Retriever()
-providers = {
-    "chatgpt": ChatGPTProvider(),
-    "deepseek": DeepSeekProvider()
-}
+PRELOAD = os.getenv("WEB_PRELOAD", "0") == "1"
+
+# Perfil por muestreo de los requests más lentos que PROFILE_SLOW_MS (opcional)
+profiler = SlowRequestProfiler.from_env()
+
+
+def profiled(label):
+    return profiler.profile(label) if profiler is not None else nullcontext()
+
+# Ráfagas: preguntas idénticas en vuelo comparten una ejecución (COALESCE=1) y el control de
+# admisión limita tasa de entrada y ejecuciones por proveedor (ver rag/admission.py)
+COALESCE = os.getenv("COALESCE", "1") == "1"
+flights = SingleFlight()
+admission = AdmissionController.from_env()
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def init() -> dict:
+    """Crea retriever, proveedores, caché de respuestas y pipelines (una vez por proceso)."""
+    global _state
+    if _state is not None:
+        return _state
+    with _state_lock:
+        if _state is None:
+            retriever = Retriever(
+                cache_size=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+                cache_ttl=float(os.getenv("QUERY_CACHE_TTL", "3600")),
+                mode=os.getenv("RETRIEVAL_MODE", "dense"),
+                fusion=os.getenv("RETRIEVAL_FUSION", "rrf"),
+                batch_size=int(os.getenv("QUERY_BATCH_SIZE", "0")),
+                batch_wait_ms=float(os.getenv("QUERY_BATCH_WAIT_MS", "5")),
+                expand=os.getenv("RETRIEVAL_EXPAND", "1") == "1",
+                parent_budget=int(os.getenv("PARENT_BUDGET", "0")) or None
+            )
+            for phase, seconds in retriever.load_timings.items():
+                startup.record(phase, seconds)
+            # Reranking con cross-encoder (RERANK=1): menos fragmentos al LLM
+            with startup.phase("rerank"):
+                reranker = CrossEncoderReranker.from_env()
+
+            with startup.phase("providers"):
+                providers = {
+                    "chatgpt": ChatGPTProvider(),
+                    "deepseek": DeepSeekProvider(),
+                    # Enrutador: elige el backend más rápido y sano, con hedging y circuit breaker
+                    "auto": RouterProvider([ChatGPTProvider(max_retries=0), DeepSeekProvider(max_retries=0)])
+                }
+                # Caché de respuestas compartida (la clave incluye el proveedor); se invalida
+                # cuando el retriever pone en servicio otro snapshot del índice
+                answer_cache = AnswerCache.from_env(version=lambda: retriever.version)
+                if answer_cache is not None:
+                    atexit.register(answer_cache.save)
+
+            _state = {
+                "retriever": retriever,
+                "reranker": reranker,
+                "router": providers["auto"],
+                "answer_cache": answer_cache,
+                "pipelines": {name: RAGPipeline(retriever, p, answer_cache=answer_cache, reranker=reranker)
+                              for name, p in providers.items()},
+            }
+            startup.log()
+    return _state
+
+
+def after_fork():
+    """Hook post_fork de gunicorn: el worker hereda lo cargado por el master."""
+    startup.after_fork()
+    encoder.after_fork()
+
 
-pipelines = {name: RAGPipeline(retriever, p) for name, p in providers.items()}
+def get_pipeline(provider):
+    return init()["pipelines"].get(provider)
+
+
+if PRELOAD:
+    init()
+    # Objetos cargados fuera del recolector de ciclos: el GC no toca sus páginas en los
+    # workers y siguen compartidas tras el fork
+    gc.freeze()
 
 # HTML simple de chat
 HTML_TEMPLATE = """
@@ -33,6 +136,13 @@ HTML_TEMPLATE = """
       <select name="provider">
         <option value="chatgpt">ChatGPT</option>
         <option value="deepseek">DeepSeek</option>
+        <option value="auto">Automático</option>
+      </select>
+      <label>Búsqueda:</label>
+      <select name="mode">
+        <option value="dense">Densa</option>
+        <option value="bm25">BM25</option>
+        <option value="hybrid">Híbrida</option>
       </select><br><br>
       <input type="submit" value="Enviar">
     </form>
@@ -46,13 +156,40 @@ HTML_TEMPLATE = """
 </html>
 """
 
+def answer(provider, question, label, top_k=4, mode=None, filters=None):
+    """synthesize con coalescing de preguntas idénticas en vuelo y control de admisión."""
+    pipeline = get_pipeline(provider)
+
+    def run():
+        with admission.slot(provider), profiled(label):
+            return pipeline.synthesize(question, top_k=top_k, mode=mode, filters=filters)
+
+    if not COALESCE:
+        return run()
+    res, shared = flights.do(coalesce_key(provider, question, top_k, mode, filters), run)
+    if shared:
+        metrics.COALESCED.labels(provider).inc()
+        res = dict(res, coalesced=True)
+    return res
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    """429 (tasa excedida) o 503 (cola llena o espera agotada), con Retry-After."""
+    resp = jsonify({"error": str(e), "reason": e.reason, "retry_after": e.retry_after})
+    resp.status_code = e.status
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp
+
 @app.route("/chat", methods=["GET", "POST"])
 def chat():
     if request.method == "POST":
         question = request.form.get("question")
         provider = request.form.get("provider", "chatgpt")
-        pipeline = pipelines.get(provider)
-        res = pipeline.synthesize(question, top_k=4)
+        try:
+            mode = normalize_mode(request.form.get("mode"))
+        except ValueError as e:
+            return str(e), 400
+        res = answer(provider, question, f"chat-{provider}", mode=mode)
         return render_template_string(
             HTML_TEMPLATE,
             answer=res.get("answer", ""),
@@ -61,14 +198,89 @@ def chat():
         )
     return render_template_string(HTML_TEMPLATE)
 
+def request_filters(data):
+    """Filtros de metadatos del JSON ("filters"); ValueError si son inválidos."""
+    return normalize_filters(data.get("filters"))
+
+def request_mode(data):
+    """Modo de búsqueda del JSON ("mode": dense | bm25 | hybrid); ValueError si es otro."""
+    return normalize_mode(data.get("mode"))
+
 @app.route("/api/chat", methods=["POST"])
 def api_chat():
     data = request.json
     question = data.get("question")
     provider = data.get("provider", "chatgpt")
-    pipeline = pipelines.get(provider)
-    res = pipeline.synthesize(question, top_k=4)
+    try:
+        filters = request_filters(data)
+        mode = request_mode(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    res = answer(provider, question, f"api-chat-{provider}", mode=mode, filters=filters)
     return jsonify(res)
 
+@app.route("/api/chat/stream", methods=["POST"])
+def api_chat_stream():
+    """Server-Sent Events: meta (fragmentos) -> token* -> citation* -> done."""
+    data = request.json
+    question = data.get("question")
+    provider = data.get("provider", "chatgpt")
+    try:
+        filters = request_filters(data)
+        mode = request_mode(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    pipeline = get_pipeline(provider)
+    # Sin coalescing (cada cliente recibe su propio stream), pero con cupo durante todo el stream
+    admission.acquire(provider)
+
+    def events():
+        with profiled(f"api-stream-{provider}"):
+            try:
+                for event in pipeline.synthesize_stream(question, top_k=4, mode=mode, filters=filters):
+                    yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            except Exception as e:
+                app.logger.exception("Error en stream")
+                yield f"event: error\ndata: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+
+    response = Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.call_on_close(lambda: admission.release(provider))
+    return response
+
+@app.route("/api/documents", methods=["GET"])
+def api_documents():
+    """Documentos indexados (doc_id, título, año) para armar los filtros."""
+    meta_index = init()["retriever"].meta_index
+    docs = meta_index.docs if meta_index is not None else []
+    return jsonify([{k: d[k] for k in ("doc_id", "title", "year")} for d in docs])
+
+@app.route("/api/stats", methods=["GET"])
+def api_stats():
+    state = init()
+    answer_cache = state["answer_cache"]
+    reranker = state["reranker"]
+    return jsonify({
+        "query_cache": state["retriever"].cache_stats(),
+        "query_batcher": state["retriever"].batch_stats(),
+        "snapshot": state["retriever"].snapshot_stats(),
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "rerank": reranker.stats() if reranker else None,
+        "router": state["router"].stats(),
+        "coalescing": flights.stats(),
+        "admission": admission.stats(),
+        "startup": startup.report()
+    })
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Histogramas por etapa y contadores por proveedor en formato Prometheus."""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 if __name__ == "__main__":
+    init()
     app.run(host="0.0.0.0", port=8081, debug=True)
@@ -0,0 +1,113 @@
+"""
+Modo de servicio asyncio (aiohttp) de la API JSON.
+
+A diferencia de web.py (Flask síncrono, un worker ocupado por cada llamada al LLM), aquí
+un solo proceso mantiene cientos de llamadas en vuelo: las llamadas al LLM usan AsyncOpenAI
+sobre un pool HTTP compartido y la recuperación corre en un pool de hilos.
+
+    python web_async.py --port 8082
+    gunicorn web_async:create_app --worker-class aiohttp.GunicornWebWorker -b 0.0.0.0:8082
+"""
+import os
+import json
+import argparse
+import functools
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+from rag.pipeline import RAGPipeline
+from rag.retrieve import Retriever, normalize_mode
+from rag.answer_cache import AnswerCache
+from rag.rerank import CrossEncoderReranker
+from rag import metrics
+from rag.shards import normalize_filters
+from providers.chatgpt import ChatGPTProvider
+from providers.deepseek import DeepSeekProvider
+from providers.router import RouterProvider
+from providers.http_pool import close_async_http_client
+
+load_dotenv()
+
+json_response = functools.partial(web.json_response, dumps=functools.partial(json.dumps, default=str))
+
+
+async def api_chat(request: web.Request):
+    data = await request.json()
+    question = data.get("question")
+    provider = data.get("provider", "chatgpt")
+    pipeline = request.app["pipelines"].get(provider)
+    if not question or pipeline is None:
+        return json_response({"error": "question/provider inválidos"}, status=400)
+    try:
+        filters = normalize_filters(data.get("filters"))
+        mode = normalize_mode(data.get("mode"))
+    except ValueError as e:
+        return json_response({"error": str(e)}, status=400)
+    res = await pipeline.asynthesize(question, top_k=4, mode=mode, filters=filters)
+    return json_response(res)
+
+
+async def api_stats(request: web.Request):
+    answer_cache = request.app["answer_cache"]
+    reranker = request.app["reranker"]
+    return json_response({
+        "query_cache": request.app["retriever"].cache_stats(),
+        "query_batcher": request.app["retriever"].batch_stats(),
+        "snapshot": request.app["retriever"].snapshot_stats(),
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "rerank": reranker.stats() if reranker else None,
+        "router": request.app["router"].stats()
+    })
+
+
+async def prometheus_metrics(request: web.Request):
+    body, content_type = metrics.render()
+    return web.Response(body=body, headers={"Content-Type": content_type})
+
+
+async def _on_cleanup(app: web.Application):
+    if app["answer_cache"] is not None:
+        app["answer_cache"].save()
+    await close_async_http_client()
+
+
+def create_app() -> web.Application:
+    retriever = Retriever(
+        cache_size=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+        cache_ttl=float(os.getenv("QUERY_CACHE_TTL", "3600")),
+        mode=os.getenv("RETRIEVAL_MODE", "dense"),
+        fusion=os.getenv("RETRIEVAL_FUSION", "rrf"),
+        batch_size=int(os.getenv("QUERY_BATCH_SIZE", "0")),
+        batch_wait_ms=float(os.getenv("QUERY_BATCH_WAIT_MS", "5")),
+        expand=os.getenv("RETRIEVAL_EXPAND", "1") == "1",
+        parent_budget=int(os.getenv("PARENT_BUDGET", "0")) or None
+    )
+    providers = {
+        "chatgpt": ChatGPTProvider(),
+        "deepseek": DeepSeekProvider(),
+        "auto": RouterProvider([ChatGPTProvider(max_retries=0), DeepSeekProvider(max_retries=0)])
+    }
+    answer_cache = AnswerCache.from_env(version=lambda: retriever.version)
+    reranker = CrossEncoderReranker.from_env()
+
+    app = web.Application()
+    app["retriever"] = retriever
+    app["answer_cache"] = answer_cache
+    app["reranker"] = reranker
+    app["router"] = providers["auto"]
+    app["pipelines"] = {name: RAGPipeline(retriever, p, answer_cache=answer_cache, reranker=reranker)
+                        for name, p in providers.items()}
+    app.router.add_post("/api/chat", api_chat)
+    app.router.add_get("/api/stats", api_stats)
+    app.router.add_get("/metrics", prometheus_metrics)
+    app.on_cleanup.append(_on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API UFRO en modo asyncio")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8082)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)